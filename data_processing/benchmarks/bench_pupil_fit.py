@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+"""
+Report on the spline fitting options of process_participant.
+
+Writes a synthetic eye-tracker recording, fits the splines with the exact interpolating fit,
+with decimation to a target rate, with a smoothing spline of a bounded number of knots, and with both,
+and reports for each the size of the .pkl files, the evaluation throughput, and the error versus
+the raw samples and versus the exact fit.
+
+Usage: python3 bench_pupil_fit.py [rate_hz] [segment_minutes] [target_rate_hz] [knots_per_second]
+"""
+
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from bench_pupil_ingest import create_recording
+from data_processing.pupil.process_data import (
+    process_participant,
+    read_data,
+    read_segments,
+    SEG_NAME_TO_EMOTION,
+    split_segments,
+)
+
+EVALUATIONS = 1_000_000
+
+
+def run(root: Path, name: str, target_rate: Optional[float], max_knots: Optional[int]) -> dict:
+    """
+    Fits the splines into their own directory and returns the size, throughput and errors.
+    """
+    output_dir = root / name
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    process_participant(
+        output_dir,
+        root / "data_bm.csv",
+        root / "segments_bm.csv",
+        "bm",
+        target_rate=target_rate,
+        max_knots=max_knots,
+    )
+    fit_time = time.perf_counter() - start
+
+    splines = {}
+    for file in os.listdir(output_dir):
+        with open(output_dir / file, "rb") as f:
+            splines[file] = pickle.load(f)
+
+    # Evaluate each spline at random times, as the windows do
+    rng = np.random.default_rng(496)
+    queries = {file: rng.uniform(spline.x[0], spline.x[-1], EVALUATIONS) for file, spline in splines.items()}
+    start = time.perf_counter()
+    for file, spline in splines.items():
+        spline(queries[file])
+    eval_time = time.perf_counter() - start
+
+    return {
+        "size": sum(os.path.getsize(output_dir / file) for file in splines),
+        "pieces": sum(len(spline.x) - 1 for spline in splines.values()),
+        "fit": fit_time,
+        "throughput": EVALUATIONS * len(splines) / eval_time,
+        "splines": splines,
+    }
+
+
+if __name__ == "__main__":
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 120
+    segment_minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    target_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 20
+    knots_per_second = float(sys.argv[4]) if len(sys.argv) > 4 else 10
+    max_knots = int(knots_per_second * segment_minutes * 60)
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        num_samples = create_recording(root, rate, segment_minutes)
+        segments = read_segments(root / "segments_bm.csv")
+        data = split_segments(segments, *read_data(root / "data_bm.csv"))
+
+        results = {
+            "exact": run(root, "exact", None, None),
+            f"{target_rate:g} Hz": run(root, "decimated", target_rate, None),
+            f"{max_knots} knots": run(root, "smoothing", None, max_knots),
+            "both": run(root, "both", target_rate, max_knots),
+        }
+
+        print(f"{num_samples} samples at {rate:g} Hz, {segment_minutes:g} minute segments")
+        exact = results["exact"]
+        for name, result in results.items():
+            # Errors versus the raw samples and the exact fit, in pupil diameter units
+            raw_errors = []
+            exact_errors = []
+            for seg_name, seg_data in data.items():
+                if seg_name not in SEG_NAME_TO_EMOTION:
+                    continue
+                file = f"pupil_bm_{SEG_NAME_TO_EMOTION[seg_name]}.pkl"
+                times = seg_data["times"]
+                midpoints = (times[1:] + times[:-1]) / 2
+                raw_errors.append(result["splines"][file](times) - seg_data["diameters"])
+                exact_errors.append(result["splines"][file](midpoints) - exact["splines"][file](midpoints))
+            raw_rms = np.sqrt(np.mean(np.concatenate(raw_errors) ** 2))
+            exact_rms = np.sqrt(np.mean(np.concatenate(exact_errors) ** 2))
+
+            print(
+                f"{name + ':':14}{result['size'] / 2**20:7.2f} MB ({exact['size'] / result['size']:5.1f}x smaller), "
+                f"{result['pieces']:7d} pieces, fit {result['fit']:.2f} s, "
+                f"{result['throughput'] / 1e6:5.1f}M evals/s ({result['throughput'] / exact['throughput']:.1f}x), "
+                f"RMS error {raw_rms:.4f} vs samples, {exact_rms:.4f} vs exact"
+            )
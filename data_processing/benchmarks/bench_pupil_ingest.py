@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for reading the pupil data in process_participant.
+
+Writes a synthetic eye-tracker recording with the 7 emotion segments separated by
+transitions, processes it with the row by row reader, the vectorized reader and the
+streaming reader, checks that the splines are identical, and reports the time taken
+and the peak memory allocated (measured in a separate pass with tracemalloc) by each.
+
+Usage: python3 bench_pupil_ingest.py [rate_hz] [segment_minutes] [chunk_size]
+"""
+
+import csv
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Optional, Tuple
+
+from data_processing.pupil.process_data import process_participant, SEG_NAME_TO_EMOTION
+
+
+def create_recording(root: Path, rate: float, segment_minutes: float):
+    """
+    Writes the data and segments csv files of a synthetic participant.
+    """
+    rng = np.random.default_rng(496)
+    names = []
+    for name in SEG_NAME_TO_EMOTION:
+        names += ["transition", name]
+
+    segments = []
+    start = 0.0
+    for name in names:
+        duration = segment_minutes * 60 if name != "transition" else 10.0
+        segments.append({"segmentName": name, "segmentStart": start, "segmentEnd": start + duration})
+        start += duration
+
+    times = np.arange(0, start * 1000, 1000 / rate)
+    diameters = 15 + np.cumsum(rng.normal(0, 0.05, len(times)))
+
+    with open(root / "segments_bm.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, segments[0].keys())
+        writer.writeheader()
+        writer.writerows(segments)
+
+    with open(root / "data_bm.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["times", "diameters"])
+        writer.writerows(zip(times.round(3), diameters.round(6)))
+
+    return len(times)
+
+
+def run(root: Path, name: str, vectorized: bool, chunk_size: Optional[int] = None) -> Tuple[float, int]:
+    """
+    Processes the participant into its own directory and returns the elapsed time and peak memory.
+    """
+    output_dir = root / name
+    os.makedirs(output_dir, exist_ok=True)
+    args = (output_dir, root / "data_bm.csv", root / "segments_bm.csv", "bm", vectorized, chunk_size)
+
+    start = time.perf_counter()
+    process_participant(*args)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    process_participant(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 120
+    segment_minutes = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    chunk_size = int(sys.argv[3]) if len(sys.argv) > 3 else 8192
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        num_samples = create_recording(root, rate, segment_minutes)
+
+        results = {
+            "rows": run(root, "rows", False),
+            "vectorized": run(root, "vectorized", True),
+            "streaming": run(root, "streaming", True, chunk_size),
+        }
+
+        # The splines must be identical
+        for name in ("vectorized", "streaming"):
+            for file in os.listdir(root / "rows"):
+                with open(root / "rows" / file, "rb") as f:
+                    expected = pickle.load(f)
+                with open(root / name / file, "rb") as f:
+                    actual = pickle.load(f)
+                assert np.array_equal(expected.x, actual.x) and np.array_equal(expected.c, actual.c)
+
+        print(f"{num_samples} samples at {rate:g} Hz ({os.path.getsize(root / 'data_bm.csv') / 2**20:.1f} MB)")
+        rows = results["rows"][0]
+        for name, (elapsed, peak) in results.items():
+            print(
+                f"{name + ':':12}{elapsed:.2f} s ({num_samples / elapsed:.0f} samples/s, {rows / elapsed:.1f}x), "
+                f"peak {peak / 2**20:.1f} MB"
+            )
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for processing several participants in pupil process_data.
+
+Writes the same synthetic recording for each participant, processes the directory
+serially and on a pool of processes, and reports the throughput of each.
+The benefit of the pool depends on the number of cores available.
+
+Usage: python3 bench_pupil_participants.py [num_participants] [rate_hz] [segment_minutes] [workers]
+"""
+
+import logging
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+
+from bench_pupil_ingest import create_recording
+from data_processing.pupil.process_data import process_data
+
+
+def run(root: Path, parallel: bool, workers: int) -> float:
+    """
+    Processes every participant in the directory and returns the elapsed time.
+    """
+    for file in root.glob("*.pkl"):
+        os.remove(file)
+
+    start = time.perf_counter()
+    results = process_data(root, parallel=parallel, workers=workers)
+    elapsed = time.perf_counter() - start
+
+    assert not any(result.error for result in results)
+    return elapsed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    num_participants = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 120
+    segment_minutes = float(sys.argv[3]) if len(sys.argv) > 3 else 5
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else os.cpu_count() or 1
+
+    with tempfile.TemporaryDirectory() as root:
+        root = Path(root)
+        num_samples = create_recording(root, rate, segment_minutes)
+        for i in range(num_participants):
+            shutil.copy(root / "data_bm.csv", root / f"data_p{i}.csv")
+            shutil.copy(root / "segments_bm.csv", root / f"segments_p{i}.csv")
+        os.remove(root / "data_bm.csv")
+        os.remove(root / "segments_bm.csv")
+
+        serial = run(root, False, 1)
+        parallel = run(root, True, workers)
+
+        total = num_samples * num_participants
+        print(f"{num_participants} participants, {total} samples at {rate:g} Hz")
+        print(f"serial:     {serial:.2f} s ({total / serial:.0f} samples/s)")
+        print(
+            f"{workers} workers:  {parallel:.2f} s ({total / parallel:.0f} samples/s, {serial / parallel:.2f}x)"
+        )
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+
+"""
+Benchmark for the copy step of separate_images.
+
+Builds a synthetic tree of cropped frames and separates it once with the serial copy
+path (a single worker) and once with the thread pool, then reports the throughput.
+Run it with the temporary directory on the filesystem being measured (e.g. TMPDIR=/mnt/nfs),
+since the benefit of the thread pool depends on the latency of each file operation.
+
+Usage: python3 bench_separate_images.py [num_frames] [file_size_bytes] [workers]
+"""
+
+import os
+from pathlib import Path
+import shutil
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from data_processing.process_data import MULTICLASS_EMOTIONS, separate_images
+
+NUM_PARTICIPANTS = 40
+
+
+def create_tree(root: Path, num_frames: int, file_size: int) -> List[Path]:
+    """
+    Creates one source folder per participant and emotion, with the frames spread evenly.
+    """
+    data = os.urandom(file_size)
+    source_dirs = []
+    folders = [
+        (f"p{participant:02d}", emotion)
+        for participant in range(NUM_PARTICIPANTS)
+        for emotion in MULTICLASS_EMOTIONS
+    ]
+    for i, (inits, emotion) in enumerate(folders):
+        source_dir = root / "source" / f"{inits}_{emotion}"
+        os.makedirs(source_dir / "cropped")
+        for frame in range(i, num_frames, len(folders)):
+            with open(source_dir / "cropped" / f"{inits}_{emotion}_{frame}.0_c.png", "wb") as f:
+                f.write(data)
+        source_dirs.append(source_dir)
+    return source_dirs
+
+
+def run(source_dirs: List[Path], output_dir: Path, workers: Optional[int]) -> float:
+    """
+    Separates the images into a new output directory and returns the elapsed time.
+    """
+    shutil.rmtree(output_dir, ignore_errors=True)
+    start = time.perf_counter()
+    separate_images(source_dirs, output_dir, copy_workers=workers)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    num_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    file_size = int(sys.argv[2]) if len(sys.argv) > 2 else 16384
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    with tempfile.TemporaryDirectory() as root:
+        source_dirs = create_tree(Path(root), num_frames, file_size)
+
+        serial = run(source_dirs, Path(root) / "serial", 1)
+        pooled = run(source_dirs, Path(root) / "pooled", workers)
+
+        # Each frame is copied to its dataset, and the test frames again to the participant's folder
+        num_copies = sum(1 for _ in Path(root, "pooled").glob("*/*/*.png"))
+
+        print(f"{num_frames} frames of {file_size} bytes, {num_copies} copies")
+        print(f"serial:      {serial:.2f} s ({num_copies / serial:.0f} files/s)")
+        print(f"thread pool: {pooled:.2f} s ({num_copies / pooled:.0f} files/s, {serial / pooled:.2f}x)")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+import csv
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+DATASET_INDEX_FILE = "dataset_index.csv"
+DATASET_INDEX_FIELDS = ["split", "label", "inits", "emotion", "time", "path"]
+
+
+def write_dataset_index(output_dir: Path, rows: List[Dict[str, str]]):
+    """
+    Write the index of every image in the separated output directory, replacing the previous index atomically.
+    Each row has the split (dataset or participant directory), label, participant, emotion and timestamp of an image,
+    and its path relative to the output directory (empty when the images are packed into shards).
+    """
+    index_path = Path(output_dir) / DATASET_INDEX_FILE
+    tmp_path = index_path.with_suffix(".tmp")
+    with open(tmp_path, "w", newline="") as f:
+        writer = csv.DictWriter(f, DATASET_INDEX_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    os.replace(tmp_path, index_path)
+
+
+def read_indexed_paths(output_dir: Path) -> List[Path]:
+    """
+    Get the path of every image listed in the index of an output directory,
+    or an empty list if it has no index. Images packed into shards have no path and are not listed.
+    """
+    index_path = Path(output_dir) / DATASET_INDEX_FILE
+    if not index_path.exists():
+        return []
+
+    with open(index_path, "r") as f:
+        return [Path(output_dir) / row["path"] for row in csv.DictReader(f) if row["path"]]
+
+
+def list_labels(split_dir: Path) -> List[str]:
+    """
+    List the label directories of a split directory, in the order they are listed by the filesystem.
+    Files next to them, like the shards and their index, are not labels.
+    """
+    return [entry.name for entry in os.scandir(split_dir) if entry.is_dir()]
+
+
+def dataset_index_path(split_dir: Path) -> Path:
+    """
+    Get the path to the index of the output directory a split directory is in.
+    When the files were not split, the split directory is the output directory itself.
+    """
+    if (Path(split_dir) / DATASET_INDEX_FILE).exists():
+        return Path(split_dir) / DATASET_INDEX_FILE
+    return Path(split_dir).parent / DATASET_INDEX_FILE
+
+
+def read_dataset_index(
+    split_dir: Path,
+) -> Optional[Dict[Tuple[str, str, str], List[Tuple[float, Optional[Path]]]]]:
+    """
+    Read the rows of a split directory (for example 'train') from the index of its output directory in one pass.\n
+    It returns the (time, image path) of each image by (label, participant, emotion), in the order they were
+    separated, or None if the output directory has no index.
+    """
+    index_path = dataset_index_path(split_dir)
+    if not index_path.exists():
+        return None
+
+    output_dir = index_path.parent
+    split = "" if output_dir == Path(split_dir) else Path(split_dir).name
+    images: Dict[Tuple[str, str, str], List[Tuple[float, Optional[Path]]]] = {}
+    with open(index_path, "r") as f:
+        for row in csv.DictReader(f):
+            if row["split"] != split:
+                continue
+            images.setdefault((row["label"], row["inits"], row["emotion"]), []).append(
+                (float(row["time"]), output_dir / row["path"] if row["path"] else None)
+            )
+    return images
+
+
+def read_split_images(
+    split_dir: Path,
+    label: str,
+    inits: str,
+    emotion: str,
+    index: Optional[Dict[Tuple[str, str, str], List[Tuple[float, Optional[Path]]]]] = None,
+) -> List[Tuple[float, Optional[Path]]]:
+    """
+    Get the (time, image path) of each image of a participant and emotion in a label directory of a split.
+    The rows are taken from the index if one is given (see read_dataset_index), and otherwise from the times file
+    in the label directory, with the image paths built from the image names.
+    """
+    if index is not None:
+        return index.get((label, inits, emotion), [])
+
+    # The times file format is defined with separate_images, which imports this module
+    from data_processing.process_data import TIMES_FILE_FORMAT
+
+    times_path = Path(split_dir) / label / TIMES_FILE_FORMAT.format(inits, emotion)
+    if not os.path.isfile(times_path):
+        return []
+
+    with open(times_path, "r") as f:
+        return [
+            (time, Path(split_dir) / label / f"{inits}_{emotion}_{time}_c.png")
+            for time in (float(row["times"]) for row in csv.DictReader(f))
+        ]
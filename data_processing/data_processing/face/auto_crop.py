@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import logging
+import multiprocessing
+import numpy as np
+import os
+from pathlib import Path
+from PIL import Image
+import sys
+from typing import List, Optional
+
+from data_processing.utils import Point, Region, Resolution, save_crop_region
+
+CASCADE_PATH = cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+IMAGE_FORMATS = (".png", ".jpg", ".jpeg")
+# Fraction of the face size added on each side of the detected face
+FACE_MARGIN = 0.2
+# Number of frames sampled to find the crop region of a whole video
+SAMPLE_FRAMES = 15
+
+# The classifier is loaded once per process
+_cascade = None
+
+
+def detect_face(image: np.ndarray, margin: float = FACE_MARGIN) -> Optional[Region]:
+    """
+    This function detects the largest face in an image with OpenCV's Haar cascade.
+    The detected box is grown by the margin on each side and kept square and inside the image.\n
+    It returns the square region around the face, or None if no face is found.
+    """
+
+    global _cascade
+    if _cascade is None:
+        _cascade = cv2.CascadeClassifier(CASCADE_PATH)
+
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    faces = _cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+    if len(faces) == 0:
+        return None
+
+    # Use the largest face, which is the participant closest to the camera
+    x, y, w, h = max(faces, key=lambda face: face[2] * face[3])
+
+    height, width = image.shape[0:2]
+    size = min(int(max(w, h) * (1 + 2 * margin)), width, height)
+    center_x, center_y = x + w // 2, y + h // 2
+    left = min(max(center_x - size // 2, 0), width - size)
+    top = min(max(center_y - size // 2, 0), height - size)
+
+    return Region(Point(int(left), int(top)), Point(int(left + size), int(top + size)))
+
+
+def detect_faces(image_paths: List[Path], margin: float = FACE_MARGIN) -> List[Optional[Region]]:
+    """
+    This function detects the face in each of the images.\n
+    It returns a region (or None) for each image, in the same order.
+    """
+
+    return [detect_face(cv2.imread(str(image_path)), margin) for image_path in image_paths]
+
+
+def median_region(regions: List[Optional[Region]]) -> Optional[Region]:
+    """
+    This function combines the regions found in several frames, ignoring frames without a face.\n
+    It returns the region with the median corners, or None if there are no regions.
+    """
+
+    regions = [region for region in regions if region]
+    if not regions:
+        return None
+
+    corners = np.median(
+        [
+            [region.top_left.x, region.top_left.y, region.bottom_right.x, region.bottom_right.y]
+            for region in regions
+        ],
+        axis=0,
+    ).astype(int)
+
+    # Keep the region square after taking the median of each corner
+    size = min(corners[2] - corners[0], corners[3] - corners[1])
+    return Region(
+        Point(int(corners[0]), int(corners[1])),
+        Point(int(corners[0] + size), int(corners[1] + size)),
+    )
+
+
+def list_images(image_dir: Path) -> List[Path]:
+    """
+    This function lists the images in a directory, not including the 'cropped' directory.\n
+    It returns the sorted paths to the images.
+    """
+
+    return sorted(
+        Path(entry.path)
+        for entry in os.scandir(image_dir)
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_FORMATS)
+    )
+
+
+def crop_image_file(image_path, crop_box, size=None):
+    """Crop an image file to the box and save it in a 'cropped' folder next to it, without the GUI.
+
+    Args:
+        image_path (str): The path of the image to be cropped.
+        crop_box (tuple): The (left, upper, right, lower) box to crop to.
+        size (tuple): The (width, height) to resize the cropped image to. Defaults to the size of the box.
+
+    Returns:
+        str: The path of the cropped image.
+    """
+
+    with Image.open(image_path) as img:
+        cropped_img = img.crop(crop_box)
+    if size:
+        cropped_img = cropped_img.resize(size, Image.BILINEAR)
+
+    # Save the cropped image in a new cropped folder
+    cropped_folder = os.path.join(os.path.dirname(image_path), "cropped")
+    os.makedirs(cropped_folder, exist_ok=True)
+
+    base_name = os.path.basename(image_path)
+    file_name_without_extension, file_extension = os.path.splitext(base_name)
+
+    cropped_file_name = f"{file_name_without_extension}_c{file_extension}"
+    cropped_file_path = os.path.join(cropped_folder, cropped_file_name)
+
+    cropped_img.save(cropped_file_path)
+
+    return cropped_file_path
+
+
+def crop_image_files(image_paths, crop_box, workers=None, size=None):
+    """Crop several image files using a pool of processes, without the GUI.
+
+    Args:
+        image_paths (list): The paths of the images to be cropped.
+        crop_box (tuple or list): The (left, upper, right, lower) box to crop all images to, or a list of one box per image.
+        workers (int): The number of processes. Defaults to the number of CPUs.
+        size (tuple): The (width, height) to resize the cropped images to. Defaults to the size of the boxes.
+
+    Returns:
+        list: The paths of the cropped images, in the same order.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    crop_boxes = crop_box if isinstance(crop_box, list) else [crop_box] * len(image_paths)
+    if workers == 1 or len(image_paths) <= 1:
+        return [
+            crop_image_file(image_path, box, size)
+            for image_path, box in zip(image_paths, crop_boxes)
+        ]
+
+    # Spawn the workers so they do not inherit the state of this process, like the Tk window of the UI
+    chunksize = max(len(image_paths) // (workers * 4), 1)
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        return list(
+            executor.map(
+                crop_image_file,
+                image_paths,
+                crop_boxes,
+                [size] * len(image_paths),
+                chunksize=chunksize,
+            )
+        )
+
+
+def auto_crop_images(
+    image_dir: Path,
+    per_frame: bool = False,
+    resolution: Optional[Resolution] = None,
+    workers: Optional[int] = None,
+    margin: float = FACE_MARGIN,
+    batch_size: int = 32,
+) -> List[Path]:
+    """
+    This function crops all images in the directory around the participant's face, without the UI.
+    By default, the face is detected in a sample of the frames and the median region is used for the whole video,
+    like a box chosen in the UI. If per_frame is set, the face is detected in every frame,
+    and frames without a face use the region of the whole video.
+    The region of the whole video is stored next to the directory, so later runs can reuse it (see load_crop_region).
+    The faces are detected in batches on a pool of processes, and the frames are cropped with the same cropper
+    as the UI (see crop_image_files).\n
+    It returns the paths to the cropped images.
+    """
+
+    image_paths = list_images(image_dir)
+    if not image_paths:
+        logging.error("Error: Directory is empty")
+        return []
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # Find the region of the whole video from frames spread evenly over it
+        step = max(len(image_paths) // SAMPLE_FRAMES, 1)
+        samples = image_paths[::step][:SAMPLE_FRAMES]
+        sample_batches = [samples[i::workers] for i in range(min(workers, len(samples)))]
+        video_region = median_region(
+            [
+                region
+                for regions in executor.map(detect_faces, sample_batches, [margin] * len(sample_batches))
+                for region in regions
+            ]
+        )
+        if video_region is None:
+            logging.error("Error: No face found in %s", image_dir)
+            return []
+        logging.debug("Crop region for %s: %s", image_dir, video_region)
+        save_crop_region(image_dir, video_region)
+
+        if per_frame:
+            # Frames where no face is found use the region of the whole video
+            batches = [image_paths[i : i + batch_size] for i in range(0, len(image_paths), batch_size)]
+            regions = [
+                region or video_region
+                for regions in executor.map(detect_faces, batches, [margin] * len(batches))
+                for region in regions
+            ]
+        else:
+            regions = [video_region] * len(image_paths)
+
+    return [
+        Path(cropped_image_path)
+        for cropped_image_path in crop_image_files(
+            image_paths,
+            [region.to_box() for region in regions],
+            workers,
+            (resolution.width, resolution.height) if resolution else None,
+        )
+    ]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.DEBUG)
+    auto_crop_images(Path(sys.argv[1]), per_frame=len(sys.argv) > 2 and sys.argv[2].lower() == "true")
@@ -3,24 +3,25 @@
 # TODO: Delete this
 
 import cv2
+from moviepy.editor import VideoFileClip
+import numpy as np
 import os
 from pathlib import Path
 from typing import List, Optional
 
-from data_processing.utils import Point, Region, Resolution
+from data_processing.face.video_to_images import iter_frames, video_formats, write_frames
+from data_processing.utils import load_crop_region, Point, Region, Resolution
 
 
-def crop_and_resize_image(
-    image_path: Path, crop_region: Optional[Region], resolution: Resolution
-) -> Path:
+def crop_and_resize(
+    image: np.ndarray, crop_region: Optional[Region], resolution: Resolution
+) -> np.ndarray:
     """
-    This function crops an image using the specified crop region.
-    It expects a region to be defined.\n
-    It returns the path to the cropped image.
+    This function crops an image array using the specified crop region and resizes it.
+    If no region is defined, the center of the image is used.\n
+    It returns the cropped and resized image array.
     """
 
-    image = cv2.imread(str(image_path))
-
     if not crop_region:
         height, width, _ = image.shape
         top_left = Point(
@@ -35,7 +36,20 @@ def crop_and_resize_image(
         crop_region.top_left.y : crop_region.bottom_right.y,
         crop_region.top_left.x : crop_region.bottom_right.x,
     ]
-    resized_image = cv2.resize(cropped_image, (resolution.width, resolution.height))
+    return cv2.resize(cropped_image, (resolution.width, resolution.height))
+
+
+def crop_and_resize_image(
+    image_path: Path, crop_region: Optional[Region], resolution: Resolution
+) -> Path:
+    """
+    This function crops an image using the specified crop region.
+    It expects a region to be defined.\n
+    It returns the path to the cropped image.
+    """
+
+    image = cv2.imread(str(image_path))
+    resized_image = crop_and_resize(image, crop_region, resolution)
 
     cropped_dir = image_path.parent / "cropped"
     if not cropped_dir.exists():
@@ -53,12 +67,63 @@ def crop_and_resize_images(
 ) -> List[Path]:
     """
     This function crops a series of images using the specified crop region.
-    It expects a region to be defined.\n
+    If no region is defined, the region stored for each image's directory is used (see save_crop_region),
+    or the center of the image if there is none.\n
     It returns the paths to the cropped images.
     """
 
+    stored_regions = {}
     clipped_image_paths = []
     for image_path in image_paths:
-        clipped_image_path = crop_and_resize_image(image_path, crop_region, resolution)
+        region = crop_region
+        if region is None:
+            if image_path.parent not in stored_regions:
+                stored_regions[image_path.parent] = load_crop_region(image_path.parent)
+            region = stored_regions[image_path.parent]
+
+        clipped_image_path = crop_and_resize_image(image_path, region, resolution)
         clipped_image_paths.append(clipped_image_path)
     return clipped_image_paths
+
+
+def extract_cropped_frames(
+    video: Path,
+    rate: int,
+    crop_region: Optional[Region],
+    resolution: Resolution,
+    image_dir: Path,
+    keep_frames: bool = False,
+    workers: Optional[int] = None,
+) -> List[Path]:
+    """
+    This function extracts, crops and resizes the frames of the specified video in a single pass.
+    The decoded frames are cropped in memory, so only the cropped images are written,
+    unless keep_frames is set.\n
+    It returns the paths to the cropped images, named as crop_and_resize_image would name them.
+    """
+
+    if not video.exists():
+        raise Exception("Error: video does not exist")
+
+    if not video.is_file() and video.suffix in video_formats:
+        raise Exception("Error: video is not a video file")
+
+    cropped_dir = image_dir / "cropped"
+    if not cropped_dir.exists():
+        os.makedirs(cropped_dir)
+
+    def frames():
+        for time, frame in iter_frames(clip, rate):
+            if keep_frames:
+                yield image_dir / Path(f"{video.stem}_{time}.png"), frame
+            yield cropped_dir / Path(f"{video.stem}_{time}_c.png"), crop_and_resize(
+                frame, crop_region, resolution
+            )
+
+    clip = VideoFileClip(video.absolute().as_posix())
+    try:
+        image_paths = write_frames(frames(), workers)
+    finally:
+        clip.close()
+
+    return [image_path for image_path in image_paths if image_path.parent == cropped_dir]
@@ -3,6 +3,11 @@ from tkinter import Tk, Canvas, Button, filedialog, Scrollbar, Toplevel, Label
 from PIL import Image, ImageTk
 import logging
 
+from data_processing.face.auto_crop import crop_image_file, crop_image_files
+from data_processing.utils import Region, save_crop_region
+
+IMAGE_FORMATS = (".png", ".jpg", ".jpeg", ".gif")
+
 
 class ImageCropper:
     """A class for cropping images using a Tkinter GUI."""
@@ -110,32 +115,28 @@ class ImageCropper:
             tags="crop_rect",
         )
 
-    def crop_image(self):
-        """Crop the selected region of the image"""
+    def get_crop_box(self):
+        """Get the (left, upper, right, lower) box of the selected region"""
 
-        try:
-            # Define the cropping box based on the selected region
-            crop_box = (
-                min(self.start_x, self.end_x),
-                min(self.start_y, self.end_y),
-                max(self.start_x, self.end_x),
-                max(self.start_y, self.end_y),
-            )
-            # Crop the image using the defined box
-            cropped_img = self.img.crop(crop_box)
+        return (
+            min(self.start_x, self.end_x),
+            min(self.start_y, self.end_y),
+            max(self.start_x, self.end_x),
+            max(self.start_y, self.end_y),
+        )
 
-            # Save the cropped image in a new cropped folder
-            cropped_folder = os.path.join(os.path.dirname(self.image_path), "cropped")
-            if not os.path.exists(cropped_folder):
-                os.makedirs(cropped_folder)
+    def save_crop_region(self):
+        """Store the selected region for the image's directory, so later runs can reuse it without the GUI"""
 
-            base_name = os.path.basename(self.image_path)
-            file_name_without_extension, file_extension = os.path.splitext(base_name)
+        save_crop_region(os.path.dirname(self.image_path), Region.from_box(self.get_crop_box()))
 
-            cropped_file_name = f"{file_name_without_extension}_c{file_extension}"
-            cropped_file_path = os.path.join(cropped_folder, cropped_file_name)
+    def crop_image(self):
+        """Crop the selected region of the image"""
 
-            cropped_img.save(cropped_file_path)
+        try:
+            # Crop the image using the selected box and save it in the cropped folder
+            crop_image_file(self.image_path, self.get_crop_box())
+            self.save_crop_region()
 
             # Increment the count of images cropped
             self.images_cropped += 1
@@ -157,19 +158,18 @@ class ImageCropper:
             image_files = [
                 filename
                 for filename in os.listdir(folder_path)
-                if filename.lower().endswith((".png", ".jpg", ".jpeg", ".gif"))
+                if filename.lower().endswith(IMAGE_FORMATS)
             ]
             # Set the total number of images to be cropped
             self.total_images = len(image_files)
 
-            # Crop each image in the directory
-            for filename in image_files:
-                # Construct the path to the image file
-                image_path = os.path.join(folder_path, filename)
-                # Load and display the image
-                self.image_path = image_path
-                self.load_image()
-                self.crop_image()
+            # Crop every image with the selected box in a batch, without displaying them
+            cropped_files = crop_image_files(
+                [os.path.join(folder_path, filename) for filename in image_files],
+                self.get_crop_box(),
+            )
+            self.images_cropped = len(cropped_files)
+            self.save_crop_region()
 
             # Show success message when done
             if self.images_cropped == self.total_images:
@@ -0,0 +1,88 @@
+import cv2
+import numpy as np
+from pathlib import Path
+import pytest
+import shutil
+import subprocess
+import sys
+
+from data_processing.face.auto_crop import auto_crop_images, detect_face, median_region
+from data_processing.utils import Point, Region, Resolution
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+@pytest.mark.parametrize(
+    "test_image, face_center,",
+    [
+        (test_files_dir / "happy_man.png", Point(310, 230)),
+        (test_files_dir / "excited_woman.png", Point(326, 126)),
+    ],
+)
+def test_detect_face(test_image, face_center):
+    image = cv2.imread(str(test_image))
+    region = detect_face(image)
+    assert region is not None
+
+    # The region should be square, inside the image and around the face
+    width = region.bottom_right.x - region.top_left.x
+    height = region.bottom_right.y - region.top_left.y
+    assert width == height > 0
+    assert region.top_left.x >= 0 and region.top_left.y >= 0
+    assert region.bottom_right.x <= image.shape[1] and region.bottom_right.y <= image.shape[0]
+    assert region.top_left.x < face_center.x < region.bottom_right.x
+    assert region.top_left.y < face_center.y < region.bottom_right.y
+
+
+def test_detect_no_face():
+    assert detect_face(np.zeros((200, 200, 3), dtype=np.uint8)) is None
+
+
+def test_median_region():
+    regions = [
+        Region(Point(0, 0), Point(10, 10)),
+        None,
+        Region(Point(2, 2), Point(14, 14)),
+        Region(Point(4, 4), Point(20, 20)),
+    ]
+    assert median_region(regions) == Region(Point(2, 2), Point(14, 14))
+    assert median_region([None]) is None
+
+
+@pytest.mark.parametrize(
+    "per_frame, resolution,",
+    [(False, None), (True, None), (False, Resolution(64, 64))],
+)
+def test_auto_crop_images(per_frame, resolution, tmp_path):
+    for i in range(4):
+        shutil.copy(test_files_dir / "happy_man.png", tmp_path / f"cs_happy_{i}.0.png")
+
+    cropped_image_paths = auto_crop_images(tmp_path, per_frame, resolution, workers=2)
+    assert cropped_image_paths == [
+        tmp_path / "cropped" / f"cs_happy_{i}.0_c.png" for i in range(4)
+    ]
+
+    for cropped_image_path in cropped_image_paths:
+        height, width, _ = cv2.imread(str(cropped_image_path)).shape
+        assert height == width
+        if resolution:
+            assert (height, width) == (resolution.height, resolution.width)
+
+
+def test_auto_crop_no_face(tmp_path):
+    cv2.imwrite(str(tmp_path / "cs_happy_0.0.png"), np.zeros((200, 200, 3), dtype=np.uint8))
+    assert auto_crop_images(tmp_path, workers=1) == []
+
+
+def test_auto_crop_without_tk(tmp_path):
+    shutil.copy(test_files_dir / "happy_man.png", tmp_path / "cs_happy_0.0.png")
+
+    # Run the headless cropper in a process where tkinter cannot be imported, as on a machine without Tk
+    code = (
+        "import sys; from pathlib import Path; sys.modules['tkinter'] = None; "
+        "import data_processing.process_data; "
+        "from data_processing.face.auto_crop import auto_crop_images; "
+        f"assert auto_crop_images(Path({str(tmp_path)!r}), workers=1)"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+    assert (tmp_path / "cropped" / "cs_happy_0.0_c.png").exists()
@@ -1,9 +1,15 @@
 # TODO: Delete this
 
+import cv2
 from pathlib import Path
 import pytest
 
-from data_processing.face.crop_and_resize_images import crop_and_resize_image, crop_and_resize_images
+from data_processing.face.crop_and_resize_images import (
+    crop_and_resize_image,
+    crop_and_resize_images,
+    extract_cropped_frames,
+)
+from data_processing.face.video_to_images import extract_frames
 from data_processing.utils import Point, Region, Resolution
 
 test_files_dir = Path(__file__).parent / "test_files"
@@ -71,3 +77,50 @@ def test_crop_and_resize_images(
     for i, image_path in enumerate(image_paths):
         assert image_path.exists() and image_path.is_file()
         assert image_path == expected_images[i]
+
+
+@pytest.mark.parametrize(
+    "test_video, test_rate, test_region, test_resolution, keep_frames,",
+    [
+        (
+            test_files_dir / "keyboard_cat.mp4",
+            1,
+            Region(Point(100, 50), Point(300, 250)),
+            Resolution(224, 224),
+            False,
+        ),
+        (
+            test_files_dir / "keyboard_cat.mp4",
+            2,
+            None,
+            Resolution(128, 128),
+            True,
+        ),
+    ],
+)
+def test_extract_cropped_frames(
+    test_video, test_rate, test_region, test_resolution, keep_frames, tmp_path
+):
+    expected_images = crop_and_resize_images(
+        extract_frames(test_video, test_rate, tmp_path / "expected"),
+        test_region,
+        test_resolution,
+    )
+    image_paths = extract_cropped_frames(
+        test_video,
+        test_rate,
+        test_region,
+        test_resolution,
+        tmp_path / "fused",
+        keep_frames=keep_frames,
+    )
+    assert [path.name for path in image_paths] == [path.name for path in expected_images]
+
+    # Only the cropped images should be written unless the frames are kept
+    assert len(list((tmp_path / "fused").glob("*.png"))) == (
+        len(image_paths) if keep_frames else 0
+    )
+
+    for image_path, expected_image in zip(image_paths, expected_images):
+        assert image_path.parent == tmp_path / "fused" / "cropped"
+        assert (cv2.imread(str(image_path)) == cv2.imread(str(expected_image))).all()
@@ -0,0 +1,69 @@
+import cv2
+from pathlib import Path
+import shutil
+
+from data_processing.face.auto_crop import auto_crop_images, crop_image_files
+from data_processing.face.crop_and_resize_images import crop_and_resize_images
+from data_processing.utils import (
+    crop_region_path,
+    load_crop_region,
+    Point,
+    Region,
+    Resolution,
+    save_crop_region,
+)
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def setup_images(image_dir, num_images):
+    """
+    Create an image directory with copies of a test image.
+    """
+    image_dir.mkdir()
+    image_paths = []
+    for i in range(num_images):
+        image_paths.append(image_dir / f"cs_happy_{i}.0.png")
+        shutil.copy(test_files_dir / "happy_man.png", image_paths[-1])
+    return image_paths
+
+
+def test_save_and_load_crop_region(tmp_path):
+    image_dir = tmp_path / "cs_happy"
+    assert load_crop_region(image_dir) is None
+
+    region = Region.from_box((200.4, 99.6, 500.0, 400.0))
+    assert region == Region(Point(200, 100), Point(500, 400))
+
+    save_crop_region(image_dir, region)
+    assert crop_region_path(image_dir) == tmp_path / "cs_happy_crop.json"
+    assert load_crop_region(image_dir) == region
+
+
+def test_stored_region_is_applied(tmp_path):
+    image_paths = setup_images(tmp_path / "cs_happy", 3)
+    save_crop_region(tmp_path / "cs_happy", Region(Point(200, 100), Point(500, 400)))
+
+    # crop_and_resize_images uses the stored region when no region is given
+    expected_paths = crop_and_resize_images(image_paths, None, Resolution(100, 100))
+    expected_images = [cv2.imread(str(path)) for path in expected_paths]
+    stored_images = [
+        cv2.imread(str(path))
+        for path in crop_and_resize_images(
+            image_paths, Region(Point(200, 100), Point(500, 400)), Resolution(100, 100)
+        )
+    ]
+    for expected_image, stored_image in zip(expected_images, stored_images):
+        assert (expected_image == stored_image).all()
+
+    # crop_image_files applies the stored region without resizing
+    cropped_paths = crop_image_files(image_paths, load_crop_region(tmp_path / "cs_happy").to_box(), workers=2)
+    assert len(cropped_paths) == 3
+    for cropped_path in cropped_paths:
+        assert cv2.imread(str(cropped_path)).shape == (300, 300, 3)
+
+
+def test_auto_crop_stores_region(tmp_path):
+    setup_images(tmp_path / "cs_happy", 2)
+    auto_crop_images(tmp_path / "cs_happy", workers=1)
+    assert load_crop_region(tmp_path / "cs_happy") is not None
@@ -0,0 +1,44 @@
+import numpy as np
+from pathlib import Path
+from PIL import Image
+import pytest
+import shutil
+
+from data_processing.face.crop_ui import crop_image_file, crop_image_files
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+@pytest.mark.parametrize(
+    "test_image, crop_box,",
+    [
+        (test_files_dir / "happy_man.png", (200.0, 100.0, 500.0, 400.0)),
+        (test_files_dir / "excited_woman.png", (150.4, 50.6, 400.4, 300.6)),
+    ],
+)
+def test_crop_image_file(test_image, crop_box, tmp_path):
+    image_path = tmp_path / test_image.name
+    shutil.copy(test_image, image_path)
+
+    cropped_path = crop_image_file(str(image_path), crop_box)
+    assert Path(cropped_path) == tmp_path / "cropped" / f"{test_image.stem}_c.png"
+
+    with Image.open(test_image) as img, Image.open(cropped_path) as cropped_img:
+        assert (np.asarray(cropped_img) == np.asarray(img.crop(crop_box))).all()
+
+
+@pytest.mark.parametrize("workers,", [1, 2])
+def test_crop_image_files(workers, tmp_path):
+    image_paths = []
+    for i in range(5):
+        image_paths.append(str(tmp_path / f"cs_happy_{i}.0.png"))
+        shutil.copy(test_files_dir / "happy_man.png", image_paths[-1])
+
+    cropped_paths = crop_image_files(image_paths, (200, 100, 500, 400), workers)
+    assert cropped_paths == [
+        str(tmp_path / "cropped" / f"cs_happy_{i}.0_c.png") for i in range(5)
+    ]
+
+    for cropped_path in cropped_paths:
+        with Image.open(cropped_path) as cropped_img:
+            assert cropped_img.size == (300, 300)
@@ -0,0 +1,27 @@
+from pathlib import Path
+import shutil
+
+from data_processing.process_data import extract_videos
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def test_extract_videos(tmp_path):
+    """
+    Test that videos are extracted in parallel and that a bad video does not stop the batch.
+    """
+    shutil.copy(test_files_dir / "keyboard_cat.mp4", tmp_path / "cs_happy.mp4")
+    shutil.copy(test_files_dir / "keyboard_cat.mp4", tmp_path / "cs_sad.mp4")
+    with open(tmp_path / "cs_fear.mp4", "w") as f:
+        f.write("Not a video")
+
+    videos = [tmp_path / "cs_happy.mp4", tmp_path / "cs_fear.mp4", tmp_path / "cs_sad.mp4"]
+    results = extract_videos(videos, 1, workers=2)
+
+    assert [result.video for result in results] == videos
+    assert results[1].error and results[1].image_paths == []
+
+    for result in (results[0], results[2]):
+        assert result.error is None
+        assert len(result.image_paths) == 54
+        assert len(list(result.image_dir.iterdir())) == 54
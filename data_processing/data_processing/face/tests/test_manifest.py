@@ -0,0 +1,73 @@
+import os
+
+from data_processing.manifest import Manifest
+
+
+def setup_video(tmp_path):
+    """
+    Create a dummy video and the frames that were extracted from it.
+    """
+    video = tmp_path / "cs_happy.mp4"
+    with open(video, "wb") as f:
+        f.write(b"Dummy video data")
+
+    image_dir = tmp_path / "cs_happy"
+    os.makedirs(image_dir)
+    image_paths = [image_dir / f"cs_happy_{i}.0.png" for i in range(3)]
+    for image_path in image_paths:
+        with open(image_path, "w") as f:
+            f.write("Dummy image data")
+
+    return video, image_dir, image_paths
+
+
+def test_manifest_round_trip(tmp_path):
+    video, image_dir, image_paths = setup_video(tmp_path)
+
+    manifest = Manifest(tmp_path / "output")
+    assert not manifest.is_current(video, 1, image_dir)
+
+    manifest.record(video, 1, image_dir, image_paths)
+    manifest.save()
+
+    # A new manifest loaded from disk should see the same video as up to date
+    manifest = Manifest(tmp_path / "output")
+    assert manifest.is_current(video, 1, image_dir)
+
+    # A different rate requires the video to be extracted again
+    assert not manifest.is_current(video, 2, image_dir)
+
+    # Sampling adaptively requires the video to be extracted again
+    assert not manifest.is_current(video, 1, image_dir, adaptive=True)
+    manifest.record(video, 1, image_dir, image_paths, adaptive=True)
+    assert manifest.is_current(video, 1, image_dir, adaptive=True)
+    assert not manifest.is_current(video, 1, image_dir)
+
+
+def test_manifest_changes(tmp_path):
+    video, image_dir, image_paths = setup_video(tmp_path)
+
+    manifest = Manifest(tmp_path)
+    manifest.record(video, 1, image_dir, image_paths)
+
+    # Touching the video without changing its contents keeps it up to date
+    stat = os.stat(video)
+    os.utime(video, (stat.st_atime, stat.st_mtime + 10))
+    assert manifest.is_current(video, 1, image_dir)
+
+    # A missing frame requires the video to be extracted again
+    os.remove(image_paths[0])
+    assert not manifest.is_current(video, 1, image_dir)
+
+    # Changing the contents of the video requires the video to be extracted again
+    manifest.record(video, 1, image_dir, image_paths[1:])
+    with open(video, "wb") as f:
+        f.write(b"Other video data")
+    assert not manifest.is_current(video, 1, image_dir)
+
+
+def test_manifest_unreadable(tmp_path):
+    with open(tmp_path / "manifest.json", "w") as f:
+        f.write("{")
+
+    assert Manifest(tmp_path).videos == {}
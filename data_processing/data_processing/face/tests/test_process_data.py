@@ -0,0 +1,30 @@
+import os
+from pathlib import Path
+import shutil
+
+from data_processing.manifest import Manifest
+from data_processing.process_data import process_data
+from data_processing.utils import Point, Region, save_crop_region
+
+test_files_dir = Path(__file__).parent / "test_files"
+
+
+def test_process_data_stored_region(tmp_path):
+    """
+    Test that a video with a stored crop region is cropped to it without the UI, including after it changes.
+    """
+    video_dir = tmp_path / "videos"
+    video_dir.mkdir()
+    shutil.copy(test_files_dir / "keyboard_cat.mp4", video_dir / "cs_happy.mp4")
+    save_crop_region(video_dir / "cs_happy", Region(Point(10, 20), Point(110, 120)))
+
+    for _ in range(2):
+        process_data(video_dir, tmp_path / "output", binary=True, workers=1)
+
+        cropped_files = os.listdir(video_dir / "cs_happy" / "cropped")
+        assert len(cropped_files) == 54
+        assert Manifest(tmp_path / "output").is_current(video_dir / "cs_happy.mp4", 1, video_dir / "cs_happy")
+
+        # Change the video, so it is extracted and cropped again on the next run
+        with open(video_dir / "cs_happy.mp4", "ab") as f:
+            f.write(b"\0")
@@ -1,9 +1,13 @@
+import cv2
+import numpy as np
 import os
 import pytest
 from pathlib import Path
 import logging
 
-from data_processing.process_data import separate_images
+from data_processing.dataset_index import read_dataset_index, read_split_images
+from data_processing.process_data import BINARY_EMOTIONS, separate_images
+from data_processing.shards import iter_shards, read_index
 
 TEST_FILES_DIR = Path(__file__).parent / "test_files" / "separate_images"
 TEAR_DOWN = True
@@ -275,3 +279,216 @@ def test_separate_no_cropped_dir(
 
     if TEAR_DOWN:
         teardown_test_folders(setup_folders, output_folders)
+
+
+def setup_test_images(setup_folders, num_images, image_size):
+    """
+    Create test directories and populate them with real images, since shards decode each image.
+    """
+    for folder in setup_folders:
+        os.makedirs(folder / "cropped", exist_ok=True)
+        emotion_name = folder.stem.split("_")[1]
+        for i in range(num_images):
+            image = np.full((*image_size, 3), i, dtype=np.uint8)
+            cv2.imwrite(str(folder / f"cropped/image_{i}_{emotion_name}_{i}.{i}_c.png"), image)
+
+
+@pytest.mark.parametrize(
+    "setup_folders, output_folders, num_images, shard_size",
+    [
+        (
+            [
+                TEST_FILES_DIR / "cs_happy",
+                TEST_FILES_DIR / "cs_sad",
+                TEST_FILES_DIR / "cs_fear",
+            ],
+            TEST_FILES_DIR / "shards",
+            10,
+            4,
+        ),
+    ],
+)
+def test_separate_images_shards(setup_folders, output_folders, num_images, shard_size):
+    """
+    Test that separate_images packs each dataset into shards with an index of the labels and times.
+    """
+    setup_test_images(setup_folders, num_images, (40, 30))
+
+    destination_paths = separate_images(
+        setup_folders,
+        output_folders,
+        binary=True,
+        output_format="shards",
+        image_size=(16, 16),
+        shard_size=shard_size,
+    )
+
+    num_rows = 0
+    for dataset in ("train", "val", "test"):
+        rows = read_index(output_folders / dataset)
+        num_rows += len(rows)
+
+        # The images are packed instead of copied, but the times files are still written
+        for path in destination_paths[dataset].values():
+            assert not list(path.glob("*.png"))
+        assert (destination_paths[dataset]["positive"] / "times_cs_happy.csv").exists()
+
+        for images, shard_rows in iter_shards(output_folders / dataset):
+            assert images.shape[1:] == (16, 16, 3) and images.dtype == np.uint8
+            assert len(images) == len(shard_rows) <= shard_size
+
+            for image, row in zip(images, shard_rows):
+                i = int(row["filename"].split("_")[1])
+                assert (image == i).all()
+                assert float(row["time"]) == float(f"{i}.{i}")
+                assert row["inits"] == "cs"
+                assert row["label"] == BINARY_EMOTIONS[row["emotion"]]
+
+    assert num_rows == len(setup_folders) * num_images
+
+    # The test images are also packed for each participant
+    assert read_index(output_folders / "cs") == read_index(output_folders / "test")
+
+    if TEAR_DOWN:
+        teardown_test_folders(setup_folders, output_folders)
+
+
+@pytest.mark.parametrize(
+    "setup_folders, output_folders, num_images, copy_mode, copy_workers",
+    [
+        (
+            [TEST_FILES_DIR / "cs_happy", TEST_FILES_DIR / "cs_sad"],
+            TEST_FILES_DIR / "links",
+            5,
+            copy_mode,
+            copy_workers,
+        )
+        for copy_mode, copy_workers in (
+            ("copy", 1),
+            ("link", 1),
+            ("symlink", 1),
+            ("reflink", 1),
+            ("copy", 4),
+            ("link", 4),
+        )
+    ],
+)
+def test_separate_images_copy_mode(
+    setup_folders, output_folders, num_images, copy_mode, copy_workers
+):
+    """
+    Test that separate_images links or copies every image to the datasets and the participant's directory.
+    """
+    setup_test_folders(setup_folders, num_images)
+
+    separate_images(
+        setup_folders,
+        output_folders,
+        binary=True,
+        copy_mode=copy_mode,
+        copy_workers=copy_workers,
+    )
+
+    num_files = 0
+    for dataset in ("train", "val", "test", "cs"):
+        for file in output_folders.glob(f"{dataset}/*/*.jpg"):
+            source = next(
+                folder / "cropped" / file.name
+                for folder in setup_folders
+                if (folder / "cropped" / file.name).exists()
+            )
+            num_files += 1
+
+            assert file.read_text() == "Dummy image data"
+            assert file.is_symlink() == (copy_mode == "symlink")
+            if copy_mode in ("link", "symlink"):
+                assert os.path.samefile(file, source)
+            else:
+                assert not os.path.samefile(file, source)
+
+    # Each image is in one of train/val/test, and the test images are also in the participant's directory
+    assert num_files == len(setup_folders) * num_images + len(
+        list((output_folders / "test").glob("*/*.jpg"))
+    )
+
+    # Running again keeps the same files
+    separate_images(
+        setup_folders,
+        output_folders,
+        binary=True,
+        copy_mode=copy_mode,
+        copy_workers=copy_workers,
+    )
+
+    if TEAR_DOWN:
+        teardown_test_folders(setup_folders, output_folders)
+
+
+@pytest.mark.parametrize(
+    "setup_folders, output_folders, num_images, split_files",
+    [
+        ([TEST_FILES_DIR / "cs_happy", TEST_FILES_DIR / "cs_sad"], TEST_FILES_DIR, 6, True),
+        ([TEST_FILES_DIR / "cs_happy", TEST_FILES_DIR / "cs_sad"], TEST_FILES_DIR, 3, False),
+    ],
+)
+def test_separate_images_index(setup_folders, output_folders, num_images, split_files):
+    """
+    Test that the dataset index lists the same images and times as the folders and times files.
+    """
+    setup_test_folders(setup_folders, num_images)
+
+    separate_images(setup_folders, output_folders, binary=True, split_files=split_files)
+
+    for split in ("train", "val", "test", "cs") if split_files else ("",):
+        split_dir = output_folders / split
+        index = read_dataset_index(split_dir)
+        for label, emotion in (("positive", "happy"), ("negative", "sad")):
+            images = read_split_images(split_dir, label, "cs", emotion, index)
+
+            # The index has the times of the times file, and points at the copied images
+            assert [time for time, _ in images] == [
+                time for time, _ in read_split_images(split_dir, label, "cs", emotion)
+            ]
+            assert sorted(image_path.name for _, image_path in images) == sorted(
+                file.name for file in (split_dir / label).glob("*.jpg")
+            )
+
+    if TEAR_DOWN:
+        teardown_test_folders(setup_folders, output_folders)
+
+
+@pytest.mark.parametrize(
+    "setup_folders, output_folders",
+    [([TEST_FILES_DIR / "cs_happy", TEST_FILES_DIR / "cs_sad"], TEST_FILES_DIR)],
+)
+def test_separate_images_rerun(setup_folders, output_folders):
+    """
+    Test that the images of a previous run are removed when the frames change, so no image is in two splits.
+    """
+    setup_test_folders(setup_folders, 20)
+    separate_images(setup_folders, output_folders, binary=True)
+
+    # The frames are extracted again at another rate, with other times
+    for folder in setup_folders:
+        for file in (folder / "cropped").iterdir():
+            file.unlink()
+    setup_test_folders(setup_folders, 40)
+    separate_images(setup_folders, output_folders, binary=True)
+
+    names = {}
+    for split in ("train", "val", "test"):
+        split_dir = output_folders / split
+        index = read_dataset_index(split_dir)
+        for label, emotion in (("positive", "happy"), ("negative", "sad")):
+            files = sorted(file.name for file in (split_dir / label).glob("*.jpg"))
+            assert files == sorted(
+                image_path.name for _, image_path in read_split_images(split_dir, label, "cs", emotion, index)
+            )
+            names[split, label] = set(files)
+
+    for label in ("positive", "negative"):
+        assert sum(len(names[split, label]) for split in ("train", "val", "test")) == 40
+        assert not names["train", label] & names["test", label]
+
+    if TEAR_DOWN:
+        teardown_test_folders(setup_folders, output_folders)
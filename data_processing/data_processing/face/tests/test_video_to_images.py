@@ -1,7 +1,12 @@
+import csv
+import cv2
+from moviepy.editor import VideoFileClip
+import numpy as np
 from pathlib import Path
 import pytest
 
-from data_processing.face.video_to_images import extract_frames
+from data_processing.face.video_to_images import extract_frames, iter_adaptive_frames, iter_frames
+from data_processing.utils import Point, Region
 
 test_files_dir = Path(__file__).parent / "test_files"
 
@@ -28,3 +33,113 @@ def test_extract_frames(test_video, test_rate, expected_num_images):
 def test_nonexistent_video(test_video):
     with pytest.raises(Exception):
         extract_frames(test_video, 1, test_files_dir / "images")
+
+
+@pytest.mark.parametrize(
+    "test_video, test_rate, test_workers,",
+    [
+        (test_files_dir / "keyboard_cat.mp4", 1, 1),
+        (test_files_dir / "keyboard_cat.mp4", 3, 4),
+    ],
+)
+def test_extract_frames_stream(test_video, test_rate, test_workers):
+    expected_paths = extract_frames(test_video, test_rate, test_files_dir / "images")
+    image_paths = extract_frames(
+        test_video,
+        test_rate,
+        test_files_dir / "stream_images",
+        stream=True,
+        workers=test_workers,
+    )
+    assert [path.name for path in image_paths] == [path.name for path in expected_paths]
+
+    for image_path, expected_path in zip(image_paths, expected_paths):
+        assert image_path.exists() and image_path.is_file()
+        assert (cv2.imread(str(image_path)) == cv2.imread(str(expected_path))).all()
+
+
+@pytest.mark.parametrize("test_rate", [0.1, 3])
+def test_iter_frames(test_rate):
+    clip = VideoFileClip(str(test_files_dir / "keyboard_cat.mp4"))
+    try:
+        # Count the restarts of ffmpeg, which a rate of 0.1 (150 frames per sample) caused with get_frame
+        restarts = []
+        initialize = clip.reader.initialize
+        clip.reader.initialize = lambda *args: restarts.append(args) or initialize(*args)
+
+        frames = list(iter_frames(clip, test_rate))
+        assert len(restarts) == 0
+        assert [time for time, _ in frames] == [i / test_rate for i in range(int(test_rate * clip.duration))]
+    finally:
+        clip.close()
+
+    # The frames are those get_frame returns for the same times, when it reads every frame without seeking
+    clip = VideoFileClip(str(test_files_dir / "keyboard_cat.mp4"))
+    try:
+        fps = clip.reader.fps
+        expected = {int(fps * time + 0.00001): time for time, _ in frames}
+        expected_frames = {}
+        for position in range(max(expected) + 1):
+            frame = clip.get_frame(position / fps)
+            if position in expected:
+                expected_frames[expected[position]] = frame
+
+        for time, frame in frames:
+            assert (frame == expected_frames[time]).all()
+    finally:
+        clip.close()
+
+
+def test_iter_adaptive_frames():
+    # Static frames, then a change inside the region, then a change outside it
+    frames = [np.zeros((40, 40, 3), dtype=np.uint8) for _ in range(16)]
+    for frame in frames[4:]:
+        frame[:20, :20] = 255
+    for frame in frames[8:]:
+        frame[30:, 30:] = 255
+    times = [i / 4 for i in range(len(frames))]
+
+    kept = list(
+        iter_adaptive_frames(
+            zip(times, frames), threshold=10, min_rate=0.5, region=Region(Point(0, 0), Point(20, 20))
+        )
+    )
+
+    # The first frame, the change in the region, and one frame every 2 s otherwise
+    assert [time for time, _, _ in kept] == [0.0, 1.0, 3.0]
+    assert kept[1][2] == 255
+
+
+@pytest.mark.parametrize(
+    "test_video, test_rate, threshold, min_rate",
+    [
+        (test_files_dir / "keyboard_cat.mp4", 3, 4.0, 0.5),
+        (test_files_dir / "keyboard_cat.mp4", 2, 1000.0, 1),
+    ],
+)
+def test_extract_frames_adaptive(test_video, test_rate, threshold, min_rate, tmp_path):
+    image_paths = extract_frames(
+        test_video,
+        test_rate,
+        tmp_path / "keyboard_cat",
+        adaptive=True,
+        threshold=threshold,
+        min_rate=min_rate,
+    )
+    fixed_paths = extract_frames(test_video, test_rate, tmp_path / "fixed")
+
+    # The kept frames are a subset of the frames at the highest rate, with the same names
+    fixed_names = [path.name for path in fixed_paths]
+    assert 0 < len(image_paths) <= len(fixed_paths)
+    assert set(path.name for path in image_paths) <= set(fixed_names)
+    for image_path in image_paths:
+        assert image_path.exists() and image_path.is_file()
+
+    with open(tmp_path / "keyboard_cat_sampled_times.csv", "r") as f:
+        times = [float(row["time"]) for row in csv.DictReader(f)]
+    assert [f"keyboard_cat_{time}.png" for time in times] == [path.name for path in image_paths]
+
+    # Frames are never further apart than the lowest rate allows
+    assert np.all(np.diff(times) <= 1 / min_rate + 1e-9)
+    if threshold > 255:
+        assert len(image_paths) == len(fixed_paths[:: int(test_rate / min_rate)])
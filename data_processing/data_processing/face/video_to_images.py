@@ -1,20 +1,144 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import cv2
 from moviepy.editor import VideoFileClip
+import numpy as np
 import os
 from pathlib import Path
 import sys
-from typing import List
+from typing import Iterator, List, Optional, Tuple
+
+from data_processing.utils import Region
 
 video_formats = (".mov", ".mp4", ".wav")
 
+# Adaptive sampling keeps a frame when its mean absolute difference from the last kept frame,
+# in grey levels of the downscaled face region, is above the threshold
+MOTION_THRESHOLD = 4.0
+MOTION_SIZE = (64, 64)
+# Lowest rate of the adaptive sampling, in frames per second, so static stretches are still sampled
+MIN_RATE = 0.5
+SAMPLED_TIMES_FILE_FORMAT = "{}_sampled_times.csv"
+
+
+def iter_frames(clip: VideoFileClip, rate: float) -> Iterator[Tuple[float, np.ndarray]]:
+    """
+    This function decodes the clip once from front to back at the specified rate.
+    It yields the same sample times and frames as extract_frames, so the frame names match.\n
+    It yields (time, RGB frame) tuples.
+    """
+
+    # clip.get_frame restarts ffmpeg when the next sample is more than 100 frames ahead, so the frames are read
+    # from the reader directly, skipping the frames in between, whatever the ratio of the fps to the rate
+    reader = clip.reader
+    if not reader.proc or reader.pos != 1:
+        reader.initialize()
+        reader.pos = 1
+        reader.lastread = reader.read_frame()
+
+    for i in range(int(rate * clip.duration)):
+        time = i / rate
+        # The frame get_frame would return for this time
+        position = int(reader.fps * time + 0.00001) + 1
+        if position > reader.pos:
+            reader.skip_frames(position - reader.pos - 1)
+            reader.read_frame()
+            reader.pos = position
+        yield time, reader.lastread
+
+
+def motion_image(frame: np.ndarray, region: Optional[Region] = None) -> np.ndarray:
+    """
+    This function converts the region of an RGB frame (or the whole frame) to a small greyscale image,
+    which is cheap to compare between frames.
+    """
+
+    if region:
+        frame = frame[region.top_left.y : region.bottom_right.y, region.top_left.x : region.bottom_right.x]
+    grey = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+    return cv2.resize(grey, MOTION_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+
+
+def iter_adaptive_frames(
+    frames: Iterator[Tuple[float, np.ndarray]],
+    threshold: float = MOTION_THRESHOLD,
+    min_rate: float = MIN_RATE,
+    region: Optional[Region] = None,
+) -> Iterator[Tuple[float, np.ndarray, float]]:
+    """
+    This function keeps the frames where the face region changed, out of frames decoded at the highest rate.
+    A frame is kept when its motion score (the mean absolute difference from the last kept frame)
+    is above the threshold, or when no frame was kept for 1 / min_rate seconds. The first frame is always kept.\n
+    It yields (time, RGB frame, motion score) tuples for the kept frames.
+    """
+
+    last_time, last_image = None, None
+    for time, frame in frames:
+        image = motion_image(frame, region)
+        score = float(np.mean(np.abs(image - last_image))) if last_image is not None else 0.0
+
+        if last_image is None or score > threshold or time - last_time >= 1 / min_rate - 1e-9:
+            last_time, last_image = time, image
+            yield time, frame, score
+
+
+def write_frames(
+    frames: Iterator[Tuple[Path, np.ndarray]], workers: Optional[int] = None
+) -> List[Path]:
+    """
+    This function encodes RGB frames to their image paths using a bounded thread pool.
+    At most two frames per worker are held in memory while waiting to be encoded.\n
+    It returns the list of written paths, in order.
+    """
+
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    def write_frame(image_path: Path, frame: np.ndarray) -> Path:
+        # OpenCV releases the GIL while encoding, so the threads run in parallel
+        if not cv2.imwrite(str(image_path), cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)):
+            raise Exception(f"Error: could not write {image_path}")
+        return image_path
+
+    image_paths = []
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for image_path, frame in frames:
+            pending.append(executor.submit(write_frame, image_path, frame))
+
+            # Wait for the oldest frame so decoding cannot outrun encoding
+            if len(pending) >= 2 * workers:
+                image_paths.append(pending.popleft().result())
+
+        while pending:
+            image_paths.append(pending.popleft().result())
+
+    return image_paths
+
 
 def extract_frames(
-    video: Path, rate: int, image_dir: Path = Path(__file__).parent / "images"
+    video: Path,
+    rate: int,
+    image_dir: Path = Path(__file__).parent / "images",
+    stream: bool = False,
+    workers: Optional[int] = None,
+    adaptive: bool = False,
+    threshold: float = MOTION_THRESHOLD,
+    min_rate: float = MIN_RATE,
+    region: Optional[Region] = None,
 ) -> List[Path]:
     """
     This function extracts the frames of the specified video.
     It expects a rate in frames per second.\n
+    If stream is set, the video is decoded once and the frames are encoded by a pool of workers.\n
+    If adaptive is set, the rate is the highest rate, and only the frames where the face region (or the whole
+    frame, without a region) changed are kept, with at least min_rate frames per second (see iter_adaptive_frames).
+    The frames are streamed, and the kept times and motion scores are written next to the image directory
+    (e.g. 'cs_happy_sampled_times.csv'). The frame names carry their times as with the fixed rate,
+    so the pupil data is aligned the same way.\n
     It returns a list of paths to the extracted frames.
     """
 
@@ -28,6 +152,40 @@ def extract_frames(
         os.makedirs(image_dir)
 
     clip = VideoFileClip(video.absolute().as_posix())
+
+    if adaptive:
+        sampled_times = []
+
+        def kept_frames():
+            for time, frame, score in iter_adaptive_frames(iter_frames(clip, rate), threshold, min_rate, region):
+                sampled_times.append({"time": time, "score": score})
+                yield image_dir / Path(f"{video.stem}_{time}.png"), frame
+
+        try:
+            image_paths = write_frames(kept_frames(), workers)
+        finally:
+            clip.close()
+
+        # Record the chosen times, for checking the sampling against the pupil data
+        with open(image_dir.parent / SAMPLED_TIMES_FILE_FORMAT.format(image_dir.name), "w", newline="") as f:
+            writer = csv.DictWriter(f, ["time", "score"])
+            writer.writeheader()
+            writer.writerows(sampled_times)
+
+        return image_paths
+
+    if stream:
+        try:
+            return write_frames(
+                (
+                    (image_dir / Path(f"{video.stem}_{time}.png"), frame)
+                    for time, frame in iter_frames(clip, rate)
+                ),
+                workers,
+            )
+        finally:
+            clip.close()
+
     image_paths = []
     for i in range(int(rate * clip.duration)):
         time = i / rate
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+from dataclasses import asdict, dataclass, field
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List
+
+MANIFEST_FILE = "manifest.json"
+MANIFEST_VERSION = 1
+HASH_CHUNK_SIZE = 1 << 20
+
+
+@dataclass
+class VideoRecord:
+    size: int
+    mtime: float
+    sha256: str
+    rate: int
+    image_dir: str
+    frames: List[str] = field(default_factory=list)
+    adaptive: bool = False
+
+
+def hash_file(path: Path) -> str:
+    """
+    This function computes the SHA-256 hash of a file, reading it in chunks.\n
+    It returns the hex digest.
+    """
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+class Manifest:
+    """A record of the videos that have already been extracted, stored as JSON in the output directory."""
+
+    def __init__(self, output_dir: Path):
+        """Load the manifest from the output directory, or start an empty one.
+
+        Args:
+            output_dir (Path): The directory the manifest file is stored in.
+        """
+
+        self.path = Path(output_dir) / MANIFEST_FILE
+        self.videos: Dict[str, VideoRecord] = {}
+
+        if self.path.exists():
+            try:
+                with open(self.path, "r") as f:
+                    contents = json.load(f)
+                if contents.get("version") == MANIFEST_VERSION:
+                    self.videos = {
+                        video: VideoRecord(**record)
+                        for video, record in contents["videos"].items()
+                    }
+            except (ValueError, TypeError, KeyError) as e:
+                logging.error("Ignoring unreadable manifest %s: %s", self.path, e)
+
+    def is_current(self, video: Path, rate: int, image_dir: Path, adaptive: bool = False) -> bool:
+        """Check whether the video was already extracted at this rate (adaptively or not) and its frames still exist.
+
+        The size and modification time are checked first, and the file is only
+        hashed when the size matches but the modification time does not.
+        """
+
+        record = self.videos.get(str(Path(video).absolute()))
+        if (
+            record is None
+            or record.rate != rate
+            or record.adaptive != adaptive
+            or record.image_dir != str(Path(image_dir).absolute())
+        ):
+            return False
+
+        stat = os.stat(video)
+        if stat.st_size != record.size:
+            return False
+        if stat.st_mtime != record.mtime:
+            if hash_file(video) != record.sha256:
+                return False
+            # The contents are unchanged, so only the modification time needs updating
+            record.mtime = stat.st_mtime
+
+        return all((image_dir / frame).exists() for frame in record.frames)
+
+    def record(
+        self, video: Path, rate: int, image_dir: Path, image_paths: List[Path], adaptive: bool = False
+    ):
+        """Record that the video was extracted at this rate (adaptively or not) into the given frames."""
+
+        stat = os.stat(video)
+        self.videos[str(Path(video).absolute())] = VideoRecord(
+            stat.st_size,
+            stat.st_mtime,
+            hash_file(video),
+            rate,
+            str(Path(image_dir).absolute()),
+            [image_path.name for image_path in image_paths],
+            adaptive,
+        )
+
+    def save(self):
+        """Write the manifest to disk, replacing the previous file atomically."""
+
+        os.makedirs(self.path.parent, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(
+                {
+                    "version": MANIFEST_VERSION,
+                    "videos": {video: asdict(record) for video, record in self.videos.items()},
+                },
+                f,
+                indent=2,
+            )
+        os.replace(tmp_path, self.path)
@@ -1,6 +1,10 @@
 #!/usr/bin/env python3
 
+from collections import deque
+from concurrent.futures import as_completed, ProcessPoolExecutor, ThreadPoolExecutor
 import csv
+from dataclasses import dataclass, field
+import errno
 import logging
 import os
 from pathlib import Path
@@ -8,12 +12,34 @@ import re
 import shutil
 from sklearn.model_selection import train_test_split
 import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple
 
-from data_processing.face.crop_ui import run_image_cropper_with_image
+try:
+    import fcntl
+except ImportError:
+    # fcntl is not available on Windows, where reflinks fall back to copies
+    fcntl = None
+
+from data_processing.face.auto_crop import auto_crop_images, crop_image_files, list_images
+from data_processing.dataset_index import read_indexed_paths, write_dataset_index
 from data_processing.face.video_to_images import extract_frames
+from data_processing.manifest import Manifest
+from data_processing.shards import ShardWriter
+from data_processing.utils import load_crop_region
 
 RATE = 1
+# Highest rate of the adaptive sampling, which keeps the frames where the face moves
+ADAPTIVE_RATE = 5
 TIMES_FILE_FORMAT = "times_{}_{}.csv"
+OUTPUT_FORMATS = ("images", "shards")
+COPY_MODES = ("copy", "link", "symlink", "reflink")
+
+# Matches the timestamp in the name of a cropped image
+TIMESTAMP_PATTERN = re.compile(r".+_(?P<time>\d+.\d+)_c.(png|jpg)")
+
+# Linux ioctl that clones a file's extents (btrfs, XFS) without copying its data
+FICLONE = 0x40049409
 
 BINARY_EMOTIONS = {
     "anger": "negative",
@@ -35,6 +61,126 @@ MULTICLASS_EMOTIONS = {
 }
 
 
+def is_up_to_date(source_file_path: Path, destination_file_path: Path) -> bool:
+    """
+    Checks whether the destination file is a copy of the source file made after the source was last modified.
+    """
+    if not os.path.exists(destination_file_path):
+        return False
+
+    source_stat = os.stat(source_file_path)
+    destination_stat = os.stat(destination_file_path)
+    return (
+        source_stat.st_size == destination_stat.st_size
+        and source_stat.st_mtime <= destination_stat.st_mtime
+    )
+
+
+def copy_file(source_file_path: Path, destination_file_path: Path, copy_mode: str = "copy"):
+    """
+    Copies a file using the copy mode:
+    'copy' copies the data, 'link' creates a hard link (or a symbolic link if the files are on different devices),
+    'symlink' creates a symbolic link, and 'reflink' clones the file if the filesystem supports it, otherwise copies it.
+    """
+    if copy_mode == "copy":
+        shutil.copy(source_file_path, destination_file_path)
+        return
+
+    # Links cannot replace an existing file
+    if os.path.lexists(destination_file_path):
+        os.remove(destination_file_path)
+
+    if copy_mode == "link":
+        try:
+            os.link(source_file_path, destination_file_path)
+            return
+        except OSError as e:
+            logging.debug("Could not hard link %s (%s), using a symbolic link", source_file_path, e)
+        copy_mode = "symlink"
+
+    if copy_mode == "symlink":
+        os.symlink(os.path.abspath(source_file_path), destination_file_path)
+    elif copy_mode == "reflink" and fcntl:
+        with open(source_file_path, "rb") as source, open(destination_file_path, "wb") as destination:
+            try:
+                fcntl.ioctl(destination.fileno(), FICLONE, source.fileno())
+                return
+            except OSError as e:
+                if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL):
+                    raise
+        shutil.copy(source_file_path, destination_file_path)
+    else:
+        shutil.copy(source_file_path, destination_file_path)
+
+
+class CopyEngine:
+    """Copies files on a pool of threads, with a bounded number of copies waiting at a time."""
+
+    def __init__(self, copy_mode: str = "copy", workers: Optional[int] = None, batch_size: int = 64):
+        """
+        Creates the thread pool. With a single worker, files are copied in the calling thread instead.
+        By default, one worker per CPU plus four is used (at most 32), since copying is bound by I/O.
+        Files are handed to the workers in batches to keep the overhead per file low.
+        """
+        if workers is None:
+            workers = min(32, (os.cpu_count() or 1) + 4)
+
+        self.copy_mode = copy_mode
+        self.workers = workers
+        self.batch_size = batch_size
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.batch = []
+        self.pending = deque()
+
+    def copy(self, files: List[Tuple[Path, Path]]):
+        """
+        Copies each (source, destination) pair, unless the destination is already an up-to-date copy.
+        """
+        for source_file_path, destination_file_path in files:
+            if is_up_to_date(source_file_path, destination_file_path):
+                continue
+
+            copy_file(source_file_path, destination_file_path, self.copy_mode)
+            logging.debug("Copied %s to %s", source_file_path.name, destination_file_path.parent)
+
+    def submit(self, source_file_path: Path, destination_file_path: Path):
+        """
+        Queues a file to be copied. Any error from an earlier copy is raised here or in close.
+        """
+        if not self.executor:
+            self.copy([(source_file_path, destination_file_path)])
+            return
+
+        self.batch.append((source_file_path, destination_file_path))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """
+        Hands the queued files to the thread pool.
+        """
+        if self.batch:
+            self.pending.append(self.executor.submit(self.copy, self.batch))
+            self.batch = []
+
+        # Wait for the oldest batch so the queue does not grow without bound
+        while len(self.pending) >= 2 * self.workers:
+            self.pending.popleft().result()
+
+    def close(self):
+        """
+        Waits for all of the queued copies to finish.
+        """
+        if self.executor:
+            self.flush()
+
+        while self.pending:
+            self.pending.popleft().result()
+
+        if self.executor:
+            self.executor.shutdown()
+
+
 def separate_images(
     source_dirs,
     output_dir,
@@ -43,12 +189,30 @@ def separate_images(
     test_split=0.2,
     val_split=0.2,
     split_participants=True,
+    output_format="images",
+    image_size: Tuple[int, int] = (224, 224),
+    shard_size=1000,
+    copy_mode="copy",
+    copy_workers: Optional[int] = 1,
 ):
     """
     Takes in a list of source folders and separates the images into folders based on emotions.
     Each source folder should contain a 'cropped' directory with the images to be copied.
+    If the output format is 'shards', the images of each dataset are instead resized to image_size and packed
+    into uint8 .npy shards of up to shard_size images, with an index of their labels, participants and times.
+    The times files are written to the emotion folders in both formats, and an index of every image's split, label,
+    participant, emotion, timestamp and path is written to the output directory (see write_dataset_index).
+    On a rerun, the images listed in the previous index that are not in the current splits are removed.
+    The copy mode sets how images are copied (see copy_file); linking the images makes building the folders
+    near instant and uses no extra space. The files are copied by copy_workers threads (see CopyEngine),
+    which helps most on network filesystems where each file operation has a high latency.
     """
 
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError("Unknown output format {}".format(output_format))
+    if copy_mode not in COPY_MODES:
+        raise ValueError("Unknown copy mode {}".format(copy_mode))
+
     # Checks that source_dirs exist
     for source_dir in source_dirs:
         if not os.path.exists(source_dir):
@@ -78,7 +242,21 @@ def separate_images(
             if not os.path.exists(destination_path):
                 os.makedirs(destination_path)
 
+    # Create a shard writer for each dataset when the images are packed into shards
+    shard_writers: Dict[str, ShardWriter] = {}
+
+    def get_shard_writer(dataset):
+        if dataset not in shard_writers:
+            shard_writers[dataset] = ShardWriter(
+                Path(output_dir) / dataset, image_size, shard_size
+            )
+        return shard_writers[dataset]
+
+    # Rows of the index of all separated images
+    index_rows = []
+
     # Copy the files for each source directory
+    copy_engine = CopyEngine(copy_mode, copy_workers)
     for source_dir in source_dirs:
         logging.debug("Source folder: %s", source_dir)
 
@@ -122,21 +300,44 @@ def separate_images(
                 files["train"], test_size=val_split, random_state=496
             )
 
-        # Copy all of the files into the dest_path
-        def copy_files(files, dest_path):
+        # Copy all of the files into the dest_path, or add them to the dataset's shards
+        def copy_files(files, dest_path, dataset):
             times = []
             for filename in files:
                 source_file_path = crop_dir / filename
                 destination_file_path = dest_path / filename
 
                 # Get the timestamp from the image name
-                if match := re.search(".+_(?P<time>\d+.\d+)_c.(png|jpg)", filename):
+                if match := TIMESTAMP_PATTERN.search(filename):
                     times.append({"times": float(match["time"])})
                 else:
                     raise ValueError("No timestamp in filename")
 
-                shutil.copy(source_file_path, destination_file_path)
-                logging.debug("Copied %s to %s", filename, dest_path)
+                index_rows.append(
+                    {
+                        "split": dataset,
+                        "label": matched_emotion,
+                        "inits": inits,
+                        "emotion": emotion,
+                        "time": times[-1]["times"],
+                        "path": ""
+                        if output_format == "shards"
+                        else destination_file_path.relative_to(output_dir).as_posix(),
+                    }
+                )
+
+                if output_format == "shards":
+                    get_shard_writer(dataset).add(
+                        source_file_path,
+                        matched_emotion,
+                        inits,
+                        emotion,
+                        times[-1]["times"],
+                    )
+                    continue
+
+                # Only new or changed files are copied
+                copy_engine.submit(source_file_path, destination_file_path)
 
             # Save a list of times for data synchronization
             with open(dest_path / TIMES_FILE_FORMAT.format(inits, emotion), "w") as f:
@@ -146,7 +347,7 @@ def separate_images(
 
         # Copy all of the files in source_dir into the correct directories
         for dataset, emotion_path in emotion_paths.items():
-            copy_files(files[dataset], emotion_path)
+            copy_files(files[dataset], emotion_path, dataset)
 
         # Copy each individual's files into the individual's directory
         if split_files and split_participants:
@@ -156,7 +357,21 @@ def separate_images(
             if not os.path.exists(individual_path):
                 os.makedirs(individual_path)
 
-            copy_files(files["test"], individual_path)
+            copy_files(files["test"], individual_path, inits)
+
+    copy_engine.close()
+    for shard_writer in shard_writers.values():
+        shard_writer.close()
+
+    # Remove the images of a previous run that are no longer in their split, for example after the frames of
+    # a video changed, so an image is never left in both the train and test sets
+    image_paths = {Path(output_dir) / row["path"] for row in index_rows if row["path"]}
+    for image_path in read_indexed_paths(output_dir):
+        if image_path not in image_paths and image_path.exists():
+            logging.debug("Removing stale image %s", image_path)
+            os.remove(image_path)
+
+    write_dataset_index(output_dir, index_rows)
 
     if split_files:
         return destination_paths
@@ -164,35 +379,235 @@ def separate_images(
         return destination_paths[""]
 
 
+@dataclass
+class ExtractionResult:
+    video: Path
+    image_dir: Path
+    image_paths: List[Path] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def extract_video(video: Path, rate: int, adaptive: bool = False) -> ExtractionResult:
+    """
+    Extracts the frames of a single video into a directory named after the video.
+    If adaptive is set, only the frames where the face moves are kept, up to the rate (see extract_frames),
+    using the crop region stored for the video, if there is one, as the face region.
+    Any error is caught and returned in the result so that one bad video does not stop a batch.
+    """
+    result = ExtractionResult(video, video.parent / video.stem)
+    try:
+        result.image_paths = extract_frames(
+            video,
+            rate,
+            result.image_dir,
+            adaptive=adaptive,
+            region=load_crop_region(result.image_dir) if adaptive else None,
+        )
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    return result
+
+
+def extract_videos(
+    videos: List[Path],
+    rate: int,
+    workers: Optional[int] = None,
+    on_result: Optional[Callable[[ExtractionResult], None]] = None,
+    adaptive: bool = False,
+) -> List[ExtractionResult]:
+    """
+    Extracts the frames of several videos concurrently using a pool of processes.
+    Progress is logged as each video finishes, followed by a summary of the batch.
+    If on_result is given, it is called with each result as soon as that video finishes.
+    Returns one result per video, in the same order as the videos.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(extract_video, video, rate, adaptive): video for video in videos}
+        for future in as_completed(futures):
+            result = future.result()
+            results[futures[future]] = result
+
+            if result.error:
+                logging.error("Error extracting frames from %s: %s", result.video, result.error)
+            elif on_result:
+                on_result(result)
+            logging.info(
+                "Extracted %d/%d videos (%s: %d frames)",
+                len(results),
+                len(videos),
+                result.video.name,
+                len(result.image_paths),
+            )
+
+    elapsed = time.perf_counter() - start
+    failed = [result for result in results.values() if result.error]
+    num_frames = sum(len(result.image_paths) for result in results.values())
+    logging.info(
+        "Extracted %d frames from %d/%d videos in %.1f s (%.1f frames/s) using %d workers",
+        num_frames,
+        len(videos) - len(failed),
+        len(videos),
+        elapsed,
+        num_frames / elapsed if elapsed > 0 else 0.0,
+        workers,
+    )
+    for result in failed:
+        logging.error("Failed video: %s", result.video)
+
+    return [results[video] for video in videos]
+
+
+def clear_frames(manifest: Manifest, video: Path):
+    """
+    Removes the frames recorded in the manifest for a video, along with their cropped images.
+    """
+    record = manifest.videos.pop(str(video.absolute()), None)
+    if record is None:
+        return
+
+    image_dir = Path(record.image_dir)
+    for frame in record.frames:
+        if (image_dir / frame).exists():
+            os.remove(image_dir / frame)
+    shutil.rmtree(image_dir / "cropped", ignore_errors=True)
+    manifest.save()
+
+
+def is_cropped(image_dir: Path) -> bool:
+    """
+    Checks whether every image in the directory has a cropped image in its 'cropped' directory.
+    """
+    cropped_dir = image_dir / "cropped"
+    if not cropped_dir.exists():
+        return False
+
+    cropped_files = set(os.listdir(cropped_dir))
+    image_files = [entry.name for entry in os.scandir(image_dir) if entry.is_file()]
+    return len(image_files) > 0 and all(
+        f"{Path(image_file).stem}_c{Path(image_file).suffix}" in cropped_files
+        for image_file in image_files
+    )
+
+
 def process_data(
     video_dir: Path,
     output_path: Path,
     binary: bool,
     get_frames: bool = True,
     crop_images: bool = True,
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    output_format: str = "images",
+    copy_mode: str = "copy",
+    copy_workers: Optional[int] = 1,
+    auto_crop: bool = False,
+    adaptive: bool = False,
 ) -> Path:
     """
     Extracts frames from all videos, then crops them and separates them to the correct directory in the output path.
+    If parallel is set, the videos are extracted concurrently by a pool of workers (one per CPU by default),
+    and videos that fail to extract are logged and left out instead of stopping the run.
+    A manifest in the output path records every extracted video, so that reruns only extract and crop
+    the videos that are new or have changed, and an interrupted run resumes where it stopped.
+    The output format ('images' or 'shards'), copy mode ('copy', 'link', 'symlink' or 'reflink')
+    and number of copy workers are passed to separate_images.
+    If auto_crop is set, the images are cropped around the detected face without the UI (see auto_crop_images),
+    using the same number of workers, so the pipeline can run on a headless machine.
+    The region chosen for each video (in the UI or automatically) is stored next to its image directory,
+    and is applied without the UI when the video is cropped again.
+    If adaptive is set, the frames are sampled where the face moves, at up to ADAPTIVE_RATE frames per second,
+    instead of at the fixed RATE (see extract_frames).
     """
     logging.basicConfig(level=logging.DEBUG)
 
     # Get all the video files in the directory
     video_files = [file for file in os.listdir(video_dir) if file.endswith(".mp4")]
-
-    # Extract the frames from each video and get the list of image directories
-    image_dirs = []
-    for video_file in video_files:
-        video_file_path = video_dir / video_file
-        image_dir = video_file_path.parent / video_file_path.stem
-        if get_frames:
-            extract_frames(video_file_path, RATE, image_dir)
-        image_dirs.append(image_dir)
-
-    # Crop the images using the UI
+    video_file_paths = [video_dir / video_file for video_file in video_files]
+
+    # Extract the frames from each new or changed video
+    manifest = Manifest(output_path)
+    rate = ADAPTIVE_RATE if adaptive else RATE
+    extracted = set(video_file_paths)
+    failed = set()
+    if get_frames:
+        extracted = {
+            video_file_path
+            for video_file_path in video_file_paths
+            if not manifest.is_current(
+                video_file_path, rate, video_file_path.parent / video_file_path.stem, adaptive
+            )
+        }
+        for video_file_path in set(video_file_paths) - extracted:
+            logging.info("Skipping %s, frames are up to date", video_file_path)
+
+        # Remove the frames and crops of a previous extraction so they are not mixed with the new ones
+        for video_file_path in extracted:
+            clear_frames(manifest, video_file_path)
+
+        # Save the manifest after each video so that an interrupted run can be resumed
+        def record(result: ExtractionResult):
+            manifest.record(result.video, rate, result.image_dir, result.image_paths, adaptive)
+            manifest.save()
+
+        pending = [video_file_path for video_file_path in video_file_paths if video_file_path in extracted]
+        if parallel:
+            results = extract_videos(pending, rate, workers, on_result=record, adaptive=adaptive)
+            failed = {result.video for result in results if result.error}
+        else:
+            for video_file_path in pending:
+                image_dir = video_file_path.parent / video_file_path.stem
+                record(
+                    ExtractionResult(
+                        video_file_path,
+                        image_dir,
+                        extract_frames(
+                            video_file_path,
+                            rate,
+                            image_dir,
+                            adaptive=adaptive,
+                            region=load_crop_region(image_dir) if adaptive else None,
+                        ),
+                    )
+                )
+
+    # Get the list of image directories
+    sources = [
+        (video_file_path, video_file_path.parent / video_file_path.stem)
+        for video_file_path in video_file_paths
+        if video_file_path not in failed
+    ]
+    image_dirs = [image_dir for _, image_dir in sources]
+
+    # Crop the images using the UI, or automatically around the detected face
     if crop_images:
-        for image_dir in image_dirs:
+        for video_file_path, image_dir in sources:
+            # Unchanged videos that were already cropped do not need to be cropped again
+            if video_file_path not in extracted and is_cropped(image_dir):
+                logging.debug("Skipping %s, images are already cropped", image_dir)
+                continue
+
             logging.debug("Cropping images in %s", image_dir)
 
+            # Reuse the region chosen in a previous run, so the video does not need to be cropped again
+            crop_region = load_crop_region(image_dir)
+            if crop_region:
+                logging.debug("Using the stored crop region %s", crop_region)
+
+                crop_image_files(list_images(image_dir), crop_region.to_box(), workers)
+                continue
+
+            if auto_crop:
+                auto_crop_images(image_dir, workers=workers)
+                continue
+
+            # The UI is only imported when it is used, since Tk is not available on headless machines
+            from data_processing.face.crop_ui import run_image_cropper_with_image
+
             files = sorted(
                 [entry.path for entry in os.scandir(image_dir) if entry.is_file()]
             )
@@ -215,7 +630,14 @@ def process_data(
                 logging.error("Error: Directory is empty")
 
     try:
-        separate_images(image_dirs, output_path, binary)
+        separate_images(
+            image_dirs,
+            output_path,
+            binary,
+            output_format=output_format,
+            copy_mode=copy_mode,
+            copy_workers=copy_workers,
+        )
     except FileNotFoundError as e:
         logging.error("Error separating images: %s", e)
     return output_path
@@ -227,5 +649,25 @@ if __name__ == "__main__":
     get_frames = sys.argv[4].lower() == "true"
     crop_images = sys.argv[5].lower() == "true"
 
+    # Optional arguments for extracting the videos in parallel
+    parallel = len(sys.argv) > 6 and sys.argv[6].lower() == "true"
+    workers = int(sys.argv[7]) if len(sys.argv) > 7 and sys.argv[7].lower() != "none" else None
+
+    # Optional argument for cropping the images without the UI
+    auto_crop = len(sys.argv) > 8 and sys.argv[8].lower() == "true"
+
+    # Optional argument for sampling the frames where the face moves
+    adaptive = len(sys.argv) > 9 and sys.argv[9].lower() == "true"
+
     # Call the function with converted boolean values
-    process_data(Path(sys.argv[1]), Path(sys.argv[2]), binary, get_frames, crop_images)
+    process_data(
+        Path(sys.argv[1]),
+        Path(sys.argv[2]),
+        binary,
+        get_frames,
+        crop_images,
+        parallel,
+        workers,
+        auto_crop=auto_crop,
+        adaptive=adaptive,
+    )
@@ -1,17 +1,27 @@
 #!/usr/bin/env python3
 
+from concurrent.futures import as_completed, ProcessPoolExecutor
 import csv
-from dataclasses import asdict, dataclass
+from dataclasses import asdict, dataclass, field
+from itertools import islice
+import logging
+import numpy as np
 import os
 from pathlib import Path
 import pickle
 import re
-from scipy.interpolate import CubicSpline
+from scipy.interpolate import CubicSpline, make_lsq_spline, PPoly
 import sys
-from typing import Dict, List
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from data_processing.pupil.splines import save_splines, SPLINES_FILE
 
 EXCLUSION_WORDS = ("transition",)
 OUTPUT_FILE_FORMAT = "pupil_{}_{}.pkl"
+SPLINE_FORMATS = ("pkl", "npz")
+# Number of rows read at a time by the streaming reader
+CHUNK_SIZE = 8192
 
 SEG_NAME_TO_EMOTION = {
     "1.mp4": "joy",
@@ -31,12 +41,20 @@ class Segment:
     end: float
 
 
-def process_participant(
-    data_dir: Path, data_file: Path, segments_file: Path, inits: str
-):
-    # TODO: Call process_data.m from python
+@dataclass
+class ParticipantResult:
+    inits: str
+    splines: Dict[str, PPoly] = field(default_factory=dict)
+    num_samples: int = 0
+    num_segments: int = 0
+    elapsed: float = 0.0
+    error: Optional[str] = None
+
 
-    # Read the segments csv file
+def read_segments(segments_file: Path) -> List[Segment]:
+    """
+    Read the segments csv file, converting the start and end times to ms.
+    """
     segments: List[Segment] = []
     with open(segments_file, "r") as f:
         reader = csv.DictReader(f)
@@ -48,10 +66,115 @@ def process_participant(
                     float(row["segmentEnd"]) * 1000,
                 )
             )
+    return segments
 
-    # Read the data csv file
+
+def read_data(data_file: Path) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Read the times and diameters columns of the data csv file in bulk.
+    """
+    with open(data_file, "r") as f:
+        header = next(csv.reader(f))
+        columns = np.loadtxt(
+            f,
+            delimiter=",",
+            usecols=(header.index("times"), header.index("diameters")),
+            ndmin=2,
+        )
+    return columns[:, 0], columns[:, 1]
+
+
+def stream_segments(
+    data_file: Path, segments: List[Segment], chunk_size: int = CHUNK_SIZE
+) -> Iterator[Tuple[str, np.ndarray, np.ndarray]]:
+    """
+    Read the data csv file in blocks of chunk_size rows and yield each segment as soon as a sample
+    after its end is read, so only the current segment and one block are held in memory.
+    Samples are assigned to segments as in split_segments, and samples after the last segment are dropped.
+
+    Yields (segment name, times relative to the segment's start, diameters) tuples.
+    """
+    segment_ends = np.array([segment.end for segment in segments])
+
+    # Parts of the current segment read so far
+    curr_seg_idx = None
+    times_parts: List[np.ndarray] = []
+    diameters_parts: List[np.ndarray] = []
+
+    def flush():
+        segment = segments[curr_seg_idx]
+        return (
+            segment.name,
+            np.concatenate(times_parts) - segment.start,
+            np.concatenate(diameters_parts),
+        )
+
+    with open(data_file, "r") as f:
+        header = next(csv.reader(f))
+        usecols = (header.index("times"), header.index("diameters"))
+
+        while lines := list(islice(f, chunk_size)):
+            block = np.loadtxt(lines, delimiter=",", usecols=usecols, ndmin=2)
+            times, diameters = block[:, 0], block[:, 1]
+
+            # The samples are sorted by time, so each segment is a contiguous slice of the block
+            segment_indices = np.searchsorted(segment_ends, times, side="left")
+            block_segments = np.unique(segment_indices)
+            bounds = np.searchsorted(segment_indices, np.append(block_segments, len(segments) + 1))
+
+            for i, seg_idx in enumerate(block_segments):
+                if seg_idx >= len(segments):
+                    break
+
+                # A sample after the current segment's end means it is complete
+                if seg_idx != curr_seg_idx:
+                    if curr_seg_idx is not None:
+                        yield flush()
+                    curr_seg_idx = seg_idx
+                    times_parts, diameters_parts = [], []
+
+                times_parts.append(times[bounds[i] : bounds[i + 1]])
+                diameters_parts.append(diameters[bounds[i] : bounds[i + 1]])
+
+    if curr_seg_idx is not None:
+        yield flush()
+
+
+def split_segments(
+    segments: List[Segment], times: np.ndarray, diameters: np.ndarray
+) -> Dict[str, Dict[str, np.ndarray]]:
+    """
+    Assign each sample to the first segment that has not ended before it, using the sorted segment ends.
+    The times of each segment are made relative to the segment's start.
+    Samples after the last segment are dropped.
+    """
+    segment_ends = np.array([segment.end for segment in segments])
+    segment_indices = np.searchsorted(segment_ends, times, side="left")
+
+    # The samples are sorted by time, so each segment is a contiguous slice
+    bounds = np.searchsorted(segment_indices, np.arange(len(segments) + 1), side="left")
+
+    data: Dict[str, Dict[str, np.ndarray]] = {}
+    for i, segment in enumerate(segments):
+        start, end = bounds[i], bounds[i + 1]
+        if start == end:
+            continue
+        data[segment.name] = {
+            "times": times[start:end] - segment.start,
+            "diameters": diameters[start:end],
+        }
+    return data
+
+
+def read_participant_rows(
+    data_file: Path, segments: List[Segment]
+) -> Dict[str, Dict[str, List[float]]]:
+    """
+    Read the data csv file row by row, assigning each sample to the current segment.
+    This is slower than read_data and split_segments, and is kept for comparison.
+    """
     curr_seg_idx = 0
-    data: Dict[Dict[List[float], List[float]]] = {segments[0].name: {"times": [], "diameters": []}}
+    data: Dict[str, Dict[str, List[float]]] = {segments[0].name: {"times": [], "diameters": []}}
     with open(data_file, "r") as f:
         reader = csv.DictReader(f)
         for row in reader:
@@ -64,55 +187,365 @@ def process_participant(
             # Add the data point to the current segment
             data[segments[curr_seg_idx].name]["times"].append(time - segments[curr_seg_idx].start)
             data[segments[curr_seg_idx].name]["diameters"].append(float(row["diameters"]))
+    return data
+
+
+def decimate(times: np.ndarray, diameters: np.ndarray, target_rate: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decimate the samples of a segment to the target rate (in Hz) by averaging the samples in each period.
+    Averaging acts as a low-pass filter, which reduces the aliasing of frequencies above the target rate,
+    and keeps working across the gaps left by removed outliers, where a period with no samples is skipped.
+    """
+    bins = np.floor(times / (1000 / target_rate)).astype(np.int64)
+    bins -= bins[0]
+    counts = np.bincount(bins)
+    kept = counts > 0
+    return (
+        np.bincount(bins, times)[kept] / counts[kept],
+        np.bincount(bins, diameters)[kept] / counts[kept],
+    )
+
+
+def fit_smoothing_spline(times: np.ndarray, diameters: np.ndarray, max_knots: int) -> PPoly:
+    """
+    Fit a least-squares cubic spline with at most max_knots interior knots to the samples of a segment.
+    The knots are placed at quantiles of the times, so every interval between knots has samples even
+    across gaps in the data.
+    """
+    interior = np.unique(np.quantile(times, np.linspace(0, 1, max_knots + 2)[1:-1]))
+    interior = interior[(interior > times[0]) & (interior < times[-1])]
+    knots = np.concatenate([[times[0]] * 4, interior, [times[-1]] * 4])
+    spline = PPoly.from_spline(make_lsq_spline(times, diameters, knots, k=3))
+
+    # Drop the empty intervals between the repeated knots at each end
+    return PPoly.construct_fast(np.ascontiguousarray(spline.c[:, 3:-3]), spline.x[3:-3])
+
+
+def fit_spline(
+    times: np.ndarray,
+    diameters: np.ndarray,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> PPoly:
+    """
+    Fit a spline to the samples of a segment. By default, an interpolating cubic spline goes through every sample.
+    If a target rate is given, the samples are first decimated to that rate (see decimate).
+    If a maximum number of knots is given, a smoothing spline with that many knots is fitted instead
+    (see fit_smoothing_spline), falling back to the interpolating spline if there are too few samples for it.
+    """
+    times, diameters = np.asarray(times, dtype=float), np.asarray(diameters, dtype=float)
+    if target_rate:
+        times, diameters = decimate(times, diameters, target_rate)
+
+    if max_knots and len(times) > max_knots + 4:
+        try:
+            return fit_smoothing_spline(times, diameters, max_knots)
+        except (ValueError, np.linalg.LinAlgError) as e:
+            logging.warning("Could not fit a smoothing spline, using an interpolating spline: %s", e)
+
+    # Cubic smoothing
+    return CubicSpline(times, diameters)
+
+
+def write_segment(
+    data_dir: Path,
+    inits: str,
+    seg_name: str,
+    times,
+    diameters,
+    save_pkl: bool = True,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> Optional[PPoly]:
+    """
+    Fit a spline to the pupil diameters of a segment (see fit_spline) and save it as a .pkl file
+    (if save_pkl is set), unless the segment is excluded.
+    Returns the spline, or None if the segment is excluded.
+    """
+    exclude = False
+    for word in EXCLUSION_WORDS:
+        if word in seg_name:
+            exclude = True
+            break
+
+    if not exclude:
+        output_file = data_dir / OUTPUT_FILE_FORMAT.format(
+            inits, SEG_NAME_TO_EMOTION[seg_name.strip()]
+        )
+
+        cspline = fit_spline(times, diameters, target_rate, max_knots)
+
+        '''
+        TODO: Implement option to graph the data and save it in a separate directory
+
+        import matplotlib.pyplot as plt
+        import numpy as np
+        plt.clf()
+        xnew = np.linspace(0, times[-1], num=1001)
+        plt.plot(xnew, cspline(xnew), 'o', label='spline')
+        plt.plot(times, diameters, 'k', label='discrete')
+        plt.savefig(f'./{output_file}.png')
+        '''
+
+        if save_pkl:
+            with open(output_file, 'wb') as f:
+                pickle.dump(cspline, f)
+
+        return cspline
+
+    return None
+
+
+def process_participant(
+    data_dir: Path,
+    data_file: Path,
+    segments_file: Path,
+    inits: str,
+    vectorized: bool = True,
+    chunk_size: Optional[int] = None,
+    save_pkl: bool = True,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> Tuple[Dict[str, PPoly], int]:
+    """
+    Fit a spline to the pupil diameters of each segment of a participant and save it as a .pkl file
+    (if save_pkl is set). The target rate and maximum number of knots are passed to fit_spline.
+    If vectorized is set, the data file is read with NumPy and split with a binary search over the
+    segment ends, instead of row by row.
+    If a chunk size is given, the data file is instead streamed in blocks of that many rows, and each segment
+    is written as soon as it ends, so the memory used does not grow with the size of the file.
+    Returns the splines of the participant by emotion, and the number of samples they were fitted to.
+    """
+    # TODO: Call process_data.m from python
+
+    segments = read_segments(segments_file)
+    splines: Dict[str, PPoly] = {}
+    num_samples = 0
+
+    def add_segment(seg_name, times, diameters):
+        nonlocal num_samples
+        spline = write_segment(
+            data_dir, inits, seg_name, times, diameters, save_pkl, target_rate, max_knots
+        )
+        if spline is not None:
+            splines[SEG_NAME_TO_EMOTION[seg_name.strip()]] = spline
+            num_samples += len(times)
+
+    # Stream the data csv file, writing each segment as soon as it is complete
+    if chunk_size:
+        for seg_name, times, diameters in stream_segments(data_file, segments, chunk_size):
+            add_segment(seg_name, times, diameters)
+        return splines, num_samples
+
+    # Read the data csv file
+    if vectorized:
+        data = split_segments(segments, *read_data(data_file))
+    else:
+        data = read_participant_rows(data_file, segments)
 
     # Write the output csv files
     for seg_name, seg_data in data.items():
-        exclude = False
-        for word in EXCLUSION_WORDS:
-            if word in seg_name:
-                exclude = True
-                break
-
-        if not exclude:
-            output_file = data_dir / OUTPUT_FILE_FORMAT.format(
-                inits, SEG_NAME_TO_EMOTION[seg_name.strip()]
+        add_segment(seg_name, seg_data["times"], seg_data["diameters"])
+
+    return splines, num_samples
+
+
+def find_participants(data_dir: Path) -> Dict[str, List[Optional[Path]]]:
+    """
+    Find the data and segments csv files of every participant in the data directory.
+    Returns the [data file, segments file] of each participant, with None for a missing file.
+    """
+    csv_files: Dict[str, List[Optional[Path]]] = {}
+    for file in sorted(os.listdir(data_dir)):
+        # If a matching data csv file is found add it to the list for that participant
+        if match := re.search(r"data_(?P<inits>\w+)\.csv", Path(file).name):
+            csv_files.setdefault(match["inits"], [None, None])[0] = data_dir / file
+        # If a matching segments csv file is found add it to the list for that participant
+        elif match := re.search(r"segments_(?P<inits>\w+)\.csv", Path(file).name):
+            csv_files.setdefault(match["inits"], [None, None])[1] = data_dir / file
+    return csv_files
+
+
+def run_participant(
+    data_dir: Path,
+    inits: str,
+    data_file: Optional[Path],
+    segments_file: Optional[Path],
+    chunk_size: Optional[int] = None,
+    save_pkl: bool = True,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> ParticipantResult:
+    """
+    Process the pupillometry data of a single participant.
+    Any error is caught and returned in the result so that one bad participant does not stop the others.
+    The splines are only kept in the result if they are not saved as .pkl files.
+    """
+    result = ParticipantResult(inits)
+    start = time.perf_counter()
+    try:
+        if data_file is None:
+            raise FileNotFoundError(f"No data_{inits}.csv file")
+        if segments_file is None:
+            raise FileNotFoundError(f"No segments_{inits}.csv file")
+
+        splines, result.num_samples = process_participant(
+            data_dir,
+            data_file,
+            segments_file,
+            inits,
+            chunk_size=chunk_size,
+            save_pkl=save_pkl,
+            target_rate=target_rate,
+            max_knots=max_knots,
+        )
+        result.num_segments = len(splines)
+        if not save_pkl:
+            result.splines = splines
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+    result.elapsed = time.perf_counter() - start
+    return result
+
+
+def process_participants(
+    data_dir: Path,
+    participants: Dict[str, List[Optional[Path]]],
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    chunk_size: Optional[int] = None,
+    save_pkl: bool = True,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> List[ParticipantResult]:
+    """
+    Process the pupillometry data of several participants, concurrently on a pool of processes if parallel is set.
+    Progress is logged as each participant finishes, followed by a summary of the samples and segments per second.
+    Returns one result per participant, in the same order as the participants.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+
+    start = time.perf_counter()
+    results: Dict[str, ParticipantResult] = {}
+
+    def log_result(result: ParticipantResult):
+        results[result.inits] = result
+        if result.error:
+            logging.error("Error processing participant %s: %s", result.inits, result.error)
+        logging.info(
+            "Processed %d/%d participants (%s: %d segments, %d samples in %.1f s)",
+            len(results),
+            len(participants),
+            result.inits,
+            result.num_segments,
+            result.num_samples,
+            result.elapsed,
+        )
+
+    if parallel:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(
+                    run_participant, data_dir, inits, *files, chunk_size, save_pkl, target_rate, max_knots
+                )
+                for inits, files in participants.items()
+            ]
+            for future in as_completed(futures):
+                log_result(future.result())
+    else:
+        for inits, files in participants.items():
+            log_result(
+                run_participant(data_dir, inits, *files, chunk_size, save_pkl, target_rate, max_knots)
             )
 
-            # Cubic smoothing
-            cspline = CubicSpline(seg_data["times"], seg_data["diameters"])
+    elapsed = time.perf_counter() - start
+    failed = [result for result in results.values() if result.error]
+    num_samples = sum(result.num_samples for result in results.values())
+    num_segments = sum(result.num_segments for result in results.values())
+    logging.info(
+        "Processed %d segments (%d samples) from %d/%d participants in %.1f s "
+        "(%.1f segments/s, %.0f samples/s) using %d workers",
+        num_segments,
+        num_samples,
+        len(participants) - len(failed),
+        len(participants),
+        elapsed,
+        num_segments / elapsed if elapsed > 0 else 0.0,
+        num_samples / elapsed if elapsed > 0 else 0.0,
+        workers if parallel else 1,
+    )
+    if failed:
+        logging.error(
+            "Failed to process %d participants: %s",
+            len(failed),
+            ", ".join(result.inits for result in failed),
+        )
 
-            '''
-            TODO: Implement option to graph the data and save it in a separate directory
+    return [results[inits] for inits in participants]
 
-            import matplotlib.pyplot as plt
-            import numpy as np
-            plt.clf()
-            xnew = np.linspace(0, seg_data["times"][-1], num=1001)
-            plt.plot(xnew, cspline(xnew), 'o', label='spline')
-            plt.plot(seg_data["times"], seg_data["diameters"], 'k', label='discrete')
-            plt.savefig(f'./{output_file}.png')
-            '''
 
-            with open(output_file, 'wb') as f:
-                pickle.dump(cspline, f)
+def process_data(
+    data_dir: Path,
+    chunk_size: Optional[int] = None,
+    spline_format: str = "pkl",
+    parallel: bool = False,
+    workers: Optional[int] = None,
+    target_rate: Optional[float] = None,
+    max_knots: Optional[int] = None,
+) -> List[ParticipantResult]:
+    """
+    Process the pupillometry data of every participant in the data directory.
+    If a chunk size is given, each data file is streamed in blocks of that many rows (see process_participant).
+    If a target rate (in Hz) or a maximum number of knots is given, the splines are fitted to the decimated
+    samples or are smoothing splines, which are smaller and faster to evaluate than the exact fit (see fit_spline).
+    The splines are saved as one .pkl file per participant and emotion, or if the spline format is "npz",
+    all together in a single splines.npz file (see save_splines).
+    If parallel is set, the participants are processed concurrently on a pool of processes.
+    A participant that cannot be processed (for example, with a missing segments file) is reported and skipped.
+    Returns the result of each participant.
+    """
+    if spline_format not in SPLINE_FORMATS:
+        raise ValueError(f"Unknown spline format {spline_format}, expected one of {SPLINE_FORMATS}")
 
+    # Process each participant's pupillometry data
+    results = process_participants(
+        data_dir,
+        find_participants(data_dir),
+        parallel,
+        workers,
+        chunk_size,
+        save_pkl=spline_format == "pkl",
+        target_rate=target_rate,
+        max_knots=max_knots,
+    )
 
-def process_data(data_dir: Path):
-    # Iterate over all csv files in the data_dir
-    csv_files = {}
-    for file in os.listdir(data_dir):
-        # If a matching data csv file is found add a new tuple for that participant
-        if match := re.search("data_(?P<inits>\w+)\.csv", Path(file).name):
-            csv_files[match["inits"]] = [data_dir / file, ""]
-        # If a matching segments csv file is found add it to the tuple for that participant
-        elif match := re.search("segments_(?P<inits>\w+)\.csv", Path(file).name):
-            csv_files[match["inits"]][1] = data_dir / file
+    if spline_format == "npz":
+        save_splines(
+            data_dir / SPLINES_FILE,
+            {result.inits: result.splines for result in results if not result.error},
+        )
 
-    # Iterate over all found csv files
-    for inits, files in csv_files.items():
-        # Process each participants pupillometry data
-        process_participant(data_dir, files[0], files[1], inits)
+    return results
 
 
 if __name__ == "__main__":
-    process_data(Path(sys.argv[1]))
+    logging.basicConfig(level=logging.INFO)
+
+    # Optional arguments for processing the participants in parallel
+    parallel = len(sys.argv) > 4 and sys.argv[4].lower() == "true"
+    workers = int(sys.argv[5]) if len(sys.argv) > 5 and sys.argv[5].lower() != "none" else None
+
+    # Optional arguments for decimating the samples and fitting smoothing splines
+    target_rate = float(sys.argv[6]) if len(sys.argv) > 6 and sys.argv[6].lower() != "none" else None
+    max_knots = int(sys.argv[7]) if len(sys.argv) > 7 and sys.argv[7].lower() != "none" else None
+
+    process_data(
+        Path(sys.argv[1]),
+        int(sys.argv[2]) if len(sys.argv) > 2 and sys.argv[2].lower() != "none" else None,
+        sys.argv[3] if len(sys.argv) > 3 else "pkl",
+        parallel,
+        workers,
+        target_rate,
+        max_knots,
+    )
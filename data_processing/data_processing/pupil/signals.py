@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+
+import hashlib
+import numpy as np
+import os
+from pathlib import Path
+from scipy.interpolate import PPoly
+from typing import Optional
+
+GRID_FILE_FORMAT = "grid_{}_{}_{}.npy"
+
+
+def grid_length(duration: float, period: float) -> int:
+    """
+    Get the number of samples on a grid of the period that covers times 0 to duration.
+    """
+    # The small tolerance keeps times that are multiples of the period on the grid
+    return int(np.floor(duration / period + 1e-6)) + 1
+
+
+def resample_spline(spline: PPoly, duration: float, period: float) -> np.ndarray:
+    """
+    Evaluate the spline once on the uniform grid of the period, from time 0 to duration.
+    Sample i of the grid is the value of the spline at time i * period.
+    """
+    return spline(np.arange(grid_length(duration, period)) * period)
+
+
+def spline_key(spline: PPoly, period: float) -> str:
+    """
+    Get a short hash of the spline's breakpoints and coefficients and the period,
+    which changes whenever the grid would.
+    """
+    sha1 = hashlib.sha1(np.float64(period).tobytes())
+    sha1.update(np.ascontiguousarray(spline.x).tobytes())
+    sha1.update(np.ascontiguousarray(spline.c).tobytes())
+    return sha1.hexdigest()[:12]
+
+
+def load_grid(
+    grid_dir: Optional[Path],
+    inits: str,
+    emotion: str,
+    spline: PPoly,
+    duration: float,
+    period: float,
+) -> np.ndarray:
+    """
+    Get the spline of a participant and emotion resampled onto the uniform grid of the period, up to duration.
+    If a grid directory is given, the grid is stored there as a .npy file named after the spline,
+    and reused (memory-mapped) while the spline is unchanged and the stored grid is long enough.
+    """
+    if grid_dir is None:
+        return resample_spline(spline, duration, period)
+
+    grid_dir = Path(grid_dir)
+    grid_path = grid_dir / GRID_FILE_FORMAT.format(inits, emotion, spline_key(spline, period))
+    if grid_path.exists():
+        grid = np.load(grid_path, mmap_mode="r")
+        if len(grid) >= grid_length(duration, period):
+            return grid
+
+    os.makedirs(grid_dir, exist_ok=True)
+
+    # Remove the grids of previous versions of the spline
+    prefix = GRID_FILE_FORMAT.format(inits, emotion, "").rsplit(".", 1)[0]
+    for file in os.listdir(grid_dir):
+        if file.startswith(prefix) and file.endswith(".npy"):
+            os.remove(grid_dir / file)
+
+    grid = resample_spline(spline, duration, period)
+    tmp_path = grid_path.with_suffix(".tmp.npy")
+    np.save(tmp_path, grid)
+    os.replace(tmp_path, grid_path)
+    return grid
+
+
+def window_times(end_times: np.ndarray, window_size: int, period: float) -> np.ndarray:
+    """
+    Get the times of the window of window_size samples, one period apart, ending at each of the end times.
+    Returns a (len(end_times), window_size) matrix of times.
+    """
+    offsets = period * np.arange(window_size - 1, -1, -1)
+    return np.asarray(end_times, dtype=float)[:, np.newaxis] - offsets[np.newaxis, :]
+
+
+def spline_windows(
+    spline: PPoly,
+    end_times: np.ndarray,
+    window_size: int,
+    period: float,
+    out: Optional[np.ndarray] = None,
+) -> np.ndarray:
+    """
+    Evaluate the spline on the windows ending at each of the end times in a single call,
+    with the same samples as grid_windows.
+    If an output array is given, the windows are written into it (for example, a slice of a larger array).
+    """
+    windows = spline(window_times(end_times, window_size, period))
+    if out is None:
+        return windows
+    out[...] = windows
+    return out
+
+
+def grid_windows(grid: np.ndarray, end_times: np.ndarray, window_size: int, period: float) -> np.ndarray:
+    """
+    Get the window of window_size grid samples ending at each of the end times.
+    The windows are strided views of the grid, gathered into one array.
+    Every end time must be at least (window_size - 1) * period and within the grid.
+    """
+    end_indices = np.rint(np.asarray(end_times) / period).astype(int)
+    windows = np.lib.stride_tricks.sliding_window_view(grid, window_size)
+    return windows[end_indices - (window_size - 1)]
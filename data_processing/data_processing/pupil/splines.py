@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import pickle
+import re
+from scipy.interpolate import PPoly
+import sys
+from typing import Dict
+
+SPLINES_FILE = "splines.npz"
+SPLINE_FILE_PATTERN = r"pupil_(?P<inits>\w+)_(?P<emotion>\w+)\.pkl$"
+
+
+def save_splines(path: Path, splines: Dict[str, Dict[str, PPoly]]):
+    """
+    Save the splines of every participant and emotion to a single uncompressed .npz file.
+    The breakpoints and coefficients of all splines are concatenated, and the offsets
+    of each spline's breakpoints are stored with its participant and emotion.
+    """
+    names = [(inits, emotion) for inits, emotions in splines.items() for emotion in emotions]
+    polys = [splines[inits][emotion] for inits, emotion in names]
+
+    # Each spline has one more breakpoint than it has intervals
+    offsets = np.cumsum([0] + [len(poly.x) for poly in polys])
+    order = max((poly.c.shape[0] for poly in polys), default=4)
+
+    # Lower order splines are padded with leading zero coefficients
+    coefficients = np.zeros((order, offsets[-1] - len(polys)))
+    start = 0
+    for poly in polys:
+        end = start + poly.c.shape[1]
+        coefficients[order - poly.c.shape[0] :, start:end] = poly.c
+        start = end
+
+    tmp_path = Path(path).with_suffix(".tmp.npz")
+    np.savez(
+        tmp_path,
+        inits=np.array([inits for inits, _ in names], dtype=str),
+        emotions=np.array([emotion for _, emotion in names], dtype=str),
+        offsets=offsets,
+        breakpoints=np.concatenate([poly.x for poly in polys]) if polys else np.zeros(0),
+        coefficients=coefficients,
+    )
+    os.replace(tmp_path, path)
+
+
+def load_splines(path: Path) -> Dict[str, Dict[str, PPoly]]:
+    """
+    Load the splines saved by save_splines with a single read, without unpickling.
+    The splines share the loaded arrays, and evaluate the same as the CubicSplines they were saved from.\n
+    It returns the splines by participant and emotion.
+    """
+    with np.load(path, allow_pickle=False) as f:
+        inits, emotions, offsets = f["inits"], f["emotions"], f["offsets"]
+        breakpoints, coefficients = f["breakpoints"], f["coefficients"]
+
+    splines: Dict[str, Dict[str, PPoly]] = {}
+    for i, (init, emotion) in enumerate(zip(inits, emotions)):
+        x = breakpoints[offsets[i] : offsets[i + 1]]
+        # The coefficients of spline i start after the intervals of the previous splines
+        start = offsets[i] - i
+        c = coefficients[:, start : start + len(x) - 1]
+        splines.setdefault(str(init), {})[str(emotion)] = PPoly.construct_fast(c, x)
+    return splines
+
+
+def load_pickled_splines(pkl_dir: Path) -> Dict[str, Dict[str, PPoly]]:
+    """
+    Load the splines from the pupil_<inits>_<emotion>.pkl files in the directory.\n
+    It returns the splines by participant and emotion.
+    """
+    splines: Dict[str, Dict[str, PPoly]] = {}
+    for file in sorted(os.listdir(pkl_dir)):
+        # Check if the file is a pkl with the correct format
+        if match := re.search(SPLINE_FILE_PATTERN, str(file)):
+            with open(Path(pkl_dir) / file, "rb") as f:
+                splines.setdefault(match["inits"], {})[match["emotion"]] = pickle.load(f)
+    return splines
+
+
+def read_splines(pupil_dir: Path) -> Dict[str, Dict[str, PPoly]]:
+    """
+    Read the splines of a pupil data directory, from the compact splines.npz file if there is one,
+    and from the .pkl files otherwise.\n
+    It returns the splines by participant and emotion.
+    """
+    if (Path(pupil_dir) / SPLINES_FILE).exists():
+        return load_splines(Path(pupil_dir) / SPLINES_FILE)
+    return load_pickled_splines(pupil_dir)
+
+
+if __name__ == "__main__":
+    # Convert the .pkl files of a directory to a splines.npz file
+    logging.basicConfig(level=logging.INFO)
+    pkl_dir = Path(sys.argv[1])
+    splines = load_pickled_splines(pkl_dir)
+    save_splines(pkl_dir / SPLINES_FILE, splines)
+    logging.info(
+        "Saved %d splines to %s",
+        sum(len(emotions) for emotions in splines.values()),
+        pkl_dir / SPLINES_FILE,
+    )
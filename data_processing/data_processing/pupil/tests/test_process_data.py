@@ -0,0 +1,184 @@
+import csv
+import numpy as np
+import pickle
+import pytest
+from scipy.interpolate import CubicSpline
+
+from data_processing.pupil.process_data import (
+    decimate,
+    fit_spline,
+    process_data,
+    process_participant,
+    read_data,
+    read_segments,
+    Segment,
+    split_segments,
+    stream_segments,
+)
+
+SEGMENTS = [
+    {"segmentName": "transition", "segmentStart": 0.0, "segmentEnd": 1.0},
+    {"segmentName": "1.mp4", "segmentStart": 1.0, "segmentEnd": 3.0},
+    {"segmentName": "transition", "segmentStart": 3.0, "segmentEnd": 4.0},
+    {"segmentName": "2.mp4", "segmentStart": 4.0, "segmentEnd": 6.5},
+]
+
+
+def write_participant(directory, rate):
+    """
+    Write the data and segments csv files of a participant sampled at the rate (in Hz).
+    """
+    with open(directory / "segments_cs.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, SEGMENTS[0].keys())
+        writer.writeheader()
+        writer.writerows(SEGMENTS)
+
+    times = np.arange(0, SEGMENTS[-1]["segmentEnd"] * 1000, 1000 / rate).round(3)
+    diameters = (15 + np.sin(times / 500)).round(6)
+    with open(directory / "data_cs.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["times", "diameters"])
+        writer.writerows(zip(times, diameters))
+
+
+def read_segments_from(rows):
+    """
+    Convert segment rows to segments, as read_segments does.
+    """
+    return [
+        Segment(row["segmentName"], row["segmentStart"] * 1000, row["segmentEnd"] * 1000)
+        for row in rows
+    ]
+
+
+def test_split_segments():
+    segments = read_segments_from(SEGMENTS)
+    times = np.array([0.0, 1000.0, 1000.5, 3000.0, 3500.0, 4200.0])
+    diameters = np.arange(len(times), dtype=float)
+
+    data = split_segments(segments, times, diameters)
+
+    # A sample exactly at the end of a segment belongs to that segment
+    assert list(data) == ["transition", "1.mp4", "2.mp4"]
+    assert np.array_equal(data["1.mp4"]["times"], [0.5, 2000.0])
+    assert np.array_equal(data["1.mp4"]["diameters"], [2.0, 3.0])
+    assert np.array_equal(data["2.mp4"]["times"], [200.0])
+
+    # The last transition overwrites the first one, as in the row by row reader
+    assert np.array_equal(data["transition"]["times"], [500.0])
+
+
+@pytest.mark.parametrize("rate", [60, 120])
+def test_vectorized_matches_rows(rate, tmp_path):
+    write_participant(tmp_path, rate)
+
+    times, diameters = read_data(tmp_path / "data_cs.csv")
+    assert len(times) == len(diameters) == int(SEGMENTS[-1]["segmentEnd"] * rate)
+    assert read_segments(tmp_path / "segments_cs.csv") == read_segments_from(SEGMENTS)
+
+    for vectorized in (False, True):
+        output_dir = tmp_path / str(vectorized)
+        output_dir.mkdir()
+        process_participant(
+            output_dir, tmp_path / "data_cs.csv", tmp_path / "segments_cs.csv", "cs", vectorized
+        )
+
+    for file in ("pupil_cs_joy.pkl", "pupil_cs_anger.pkl"):
+        with open(tmp_path / "False" / file, "rb") as f:
+            expected = pickle.load(f)
+        with open(tmp_path / "True" / file, "rb") as f:
+            actual = pickle.load(f)
+        assert np.array_equal(expected.x, actual.x)
+        assert np.array_equal(expected.c, actual.c)
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1000])
+def test_streaming_matches_vectorized(chunk_size, tmp_path):
+    write_participant(tmp_path, 120)
+    segments = read_segments(tmp_path / "segments_cs.csv")
+
+    expected = split_segments(segments, *read_data(tmp_path / "data_cs.csv"))
+    streamed = list(stream_segments(tmp_path / "data_cs.csv", segments, chunk_size))
+
+    # Every segment is yielded in order, including both transitions
+    assert [name for name, _, _ in streamed] == [segment.name for segment in segments]
+    for name, times, diameters in streamed[1:]:
+        assert np.array_equal(times, expected[name]["times"])
+        assert np.array_equal(diameters, expected[name]["diameters"])
+
+    output_dir = tmp_path / "streamed"
+    output_dir.mkdir()
+    process_participant(
+        output_dir, tmp_path / "data_cs.csv", tmp_path / "segments_cs.csv", "cs", chunk_size=chunk_size
+    )
+    assert sorted(file.name for file in output_dir.iterdir()) == [
+        "pupil_cs_anger.pkl",
+        "pupil_cs_joy.pkl",
+    ]
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_process_data_reports_errors(parallel, tmp_path):
+    write_participant(tmp_path, 60)
+    # A second participant is missing its segments file, and a third has an unreadable data file
+    (tmp_path / "data_mf.csv").write_bytes((tmp_path / "data_cs.csv").read_bytes())
+    (tmp_path / "data_ab.csv").write_text("times,diameters\nnot,numbers\n")
+    (tmp_path / "segments_ab.csv").write_bytes((tmp_path / "segments_cs.csv").read_bytes())
+
+    results = process_data(tmp_path, parallel=parallel, workers=2)
+
+    assert [result.inits for result in results] == ["ab", "cs", "mf"]
+    assert results[0].error.startswith("ValueError")
+    assert results[1].error is None
+    assert results[1].num_segments == 2
+    data = split_segments(read_segments(tmp_path / "segments_cs.csv"), *read_data(tmp_path / "data_cs.csv"))
+    assert results[1].num_samples == len(data["1.mp4"]["times"]) + len(data["2.mp4"]["times"])
+    assert results[2].error == "FileNotFoundError: No segments_mf.csv file"
+
+    # The other participants are still processed
+    assert sorted(file.name for file in tmp_path.glob("*.pkl")) == [
+        "pupil_cs_anger.pkl",
+        "pupil_cs_joy.pkl",
+    ]
+
+
+def test_decimate():
+    # 4 samples per 10 ms period at 400 Hz, with a gap in the third period
+    times = np.array([0.0, 2.5, 5.0, 7.5, 10.0, 12.5, 15.0, 17.5, 30.0, 32.5])
+    diameters = np.arange(len(times), dtype=float)
+
+    decimated_times, decimated_diameters = decimate(times, diameters, 100)
+
+    assert np.allclose(decimated_times, [3.75, 13.75, 31.25])
+    assert np.allclose(decimated_diameters, [1.5, 5.5, 8.5])
+
+
+@pytest.mark.parametrize(
+    "target_rate, max_knots, max_error",
+    [
+        (None, None, 1e-9),
+        (30, None, 0.01),
+        (None, 50, 0.01),
+        (30, 50, 0.01),
+    ],
+)
+def test_fit_spline(target_rate, max_knots, max_error):
+    # A 10 s segment sampled at 120 Hz, with a gap where outliers were removed
+    times = np.arange(0, 10000, 1000 / 120)
+    times = times[(times < 4000) | (times > 4500)]
+    diameters = 15 + np.sin(times / 500)
+
+    spline = fit_spline(times, diameters, target_rate, max_knots)
+
+    assert np.max(np.abs(spline(times) - diameters)) < max_error
+    if target_rate:
+        assert len(spline.x) <= 10 * target_rate + 1
+    if max_knots:
+        assert len(spline.x) <= max_knots + 2
+
+
+def test_fit_spline_few_samples():
+    # With fewer samples than knots, the samples are interpolated
+    times = np.array([0.0, 10.0, 20.0, 30.0])
+    spline = fit_spline(times, np.array([1.0, 2.0, 0.0, 1.0]), max_knots=50)
+    assert isinstance(spline, CubicSpline)
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from scipy.interpolate import CubicSpline
+
+from data_processing.pupil.signals import (
+    grid_length,
+    grid_windows,
+    load_grid,
+    resample_spline,
+    spline_windows,
+)
+
+PERIOD = 0.01
+
+
+def make_spline(scale=1.0):
+    times = np.linspace(0, 20, 201)
+    return CubicSpline(times, scale * (15 + np.sin(times)))
+
+
+@pytest.mark.parametrize(
+    "duration, expected",
+    [
+        (1.0, 101),
+        (2.5, 251),
+        (2.505, 251),
+    ],
+)
+def test_grid_length(duration, expected):
+    assert grid_length(duration, PERIOD) == expected
+
+
+@pytest.mark.parametrize("window_size", [1, 10, 100])
+def test_grid_windows(window_size):
+    spline = make_spline()
+    end_times = np.array([1.0, 2.5, 4.0, 10.0])
+    grid = resample_spline(spline, end_times.max(), PERIOD)
+
+    windows = grid_windows(grid, end_times, window_size, PERIOD)
+
+    assert windows.shape == (len(end_times), window_size)
+    for window, end_time in zip(windows, end_times):
+        times = end_time - PERIOD * np.arange(window_size - 1, -1, -1)
+        assert np.allclose(window, spline(times))
+
+
+def test_load_grid(tmp_path):
+    spline = make_spline()
+    grid = load_grid(tmp_path, "cs", "joy", spline, 5.0, PERIOD)
+    assert len(grid) == grid_length(5.0, PERIOD)
+    assert len(list(tmp_path.glob("grid_cs_joy_*.npy"))) == 1
+
+    # A stored grid that is long enough is reused
+    stored = load_grid(tmp_path, "cs", "joy", spline, 2.0, PERIOD)
+    assert isinstance(stored, np.memmap)
+    assert np.array_equal(stored, grid)
+
+    # A longer grid replaces the stored one
+    longer = load_grid(tmp_path, "cs", "joy", spline, 8.0, PERIOD)
+    assert len(longer) == grid_length(8.0, PERIOD)
+    assert len(list(tmp_path.glob("grid_cs_joy_*.npy"))) == 1
+
+    # A changed spline is resampled again
+    changed = load_grid(tmp_path, "cs", "joy", make_spline(2.0), 2.0, PERIOD)
+    assert np.allclose(changed, 2 * grid[: len(changed)])
+    assert len(list(tmp_path.glob("grid_cs_joy_*.npy"))) == 1
+
+
+@pytest.mark.parametrize("window_size", [1, 10, 100])
+def test_spline_windows_match_grid(window_size):
+    spline = make_spline()
+    end_times = np.array([1.0, 2.5, 4.0, 10.0])
+    expected = grid_windows(resample_spline(spline, end_times.max(), PERIOD), end_times, window_size, PERIOD)
+
+    assert np.allclose(spline_windows(spline, end_times, window_size, PERIOD), expected)
+
+    # The windows can be written into a slice of a larger array
+    out = np.zeros((len(end_times) + 2, window_size), dtype=np.float32)
+    spline_windows(spline, end_times, window_size, PERIOD, out[1:-1])
+    assert np.allclose(out[1:-1], expected)
+    assert not out[0].any() and not out[-1].any()
@@ -0,0 +1,64 @@
+import numpy as np
+import pickle
+import pytest
+from scipy.interpolate import CubicSpline
+
+from data_processing.pupil.process_data import process_data
+from data_processing.pupil.splines import (
+    load_pickled_splines,
+    load_splines,
+    read_splines,
+    save_splines,
+    SPLINES_FILE,
+)
+from data_processing.pupil.tests.test_process_data import write_participant
+
+
+@pytest.mark.parametrize("lengths", [[2], [5, 3], [40, 2, 17]])
+def test_save_and_load_splines(lengths, tmp_path):
+    rng = np.random.default_rng(0)
+    splines = {}
+    for i, length in enumerate(lengths):
+        times = np.sort(rng.choice(10000, length, replace=False)).astype(float)
+        splines.setdefault(f"p{i % 2}", {})[f"emotion{i}"] = CubicSpline(times, rng.random(length))
+
+    save_splines(tmp_path / SPLINES_FILE, splines)
+    loaded = load_splines(tmp_path / SPLINES_FILE)
+
+    assert loaded.keys() == splines.keys()
+    for inits, emotions in splines.items():
+        assert loaded[inits].keys() == emotions.keys()
+        for emotion, spline in emotions.items():
+            # Evaluate inside and past the ends of the spline
+            times = np.linspace(spline.x[0] - 100, spline.x[-1] + 100, 101)
+            assert np.array_equal(loaded[inits][emotion](times), spline(times))
+
+
+def test_process_data_npz(tmp_path):
+    write_participant(tmp_path, 120)
+    pkl_dir = tmp_path / "pkl"
+    npz_dir = tmp_path / "npz"
+    for directory in (pkl_dir, npz_dir):
+        directory.mkdir()
+        for file in ("data_cs.csv", "segments_cs.csv"):
+            (directory / file).write_bytes((tmp_path / file).read_bytes())
+
+    process_data(pkl_dir)
+    process_data(npz_dir, spline_format="npz")
+
+    # The npz format replaces the pkl files
+    assert not list(npz_dir.glob("*.pkl"))
+    assert (npz_dir / SPLINES_FILE).exists()
+
+    expected = load_pickled_splines(pkl_dir)
+    actual = read_splines(npz_dir)
+    assert expected.keys() == actual.keys() == {"cs"}
+    assert expected["cs"].keys() == actual["cs"].keys() == {"joy", "anger"}
+    for emotion, spline in expected["cs"].items():
+        times = np.linspace(0, 2000, 201)
+        assert np.array_equal(actual["cs"][emotion](times), spline(times))
+
+    # Without a splines.npz file, the pkl files are read
+    assert read_splines(pkl_dir).keys() == {"cs"}
+    with open(pkl_dir / "pupil_cs_joy.pkl", "rb") as f:
+        assert np.array_equal(pickle.load(f).c, read_splines(pkl_dir)["cs"]["joy"].c)
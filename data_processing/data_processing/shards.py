@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+import csv
+import cv2
+import numpy as np
+import os
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+SHARD_FILE_FORMAT = "shard-{:05d}.npy"
+SHARD_INDEX_FILE = "index.csv"
+SHARD_INDEX_FIELDS = ["shard", "offset", "label", "inits", "emotion", "time", "filename"]
+
+
+class ShardWriter:
+    """Packs images into a few large uint8 .npy shards with a CSV index, instead of one file per image."""
+
+    def __init__(self, output_dir: Path, image_size: Tuple[int, int], shard_size: int = 1000):
+        """Initialize the ShardWriter object.
+
+        Args:
+            output_dir (Path): The directory the shards and index are written to.
+            image_size (Tuple[int, int]): The (height, width) every image is resized to.
+            shard_size (int): The maximum number of images in each shard.
+        """
+
+        self.output_dir = Path(output_dir)
+        self.image_size = image_size
+        self.shard_size = shard_size
+        # Images and index rows of the shard currently being filled
+        self.images: List[np.ndarray] = []
+        self.rows: List[Dict[str, str]] = []
+        self.num_shards = 0
+
+        if not self.output_dir.exists():
+            os.makedirs(self.output_dir)
+
+        # Remove the shards of a previous run so the index stays consistent
+        for file in os.listdir(self.output_dir):
+            if file == SHARD_INDEX_FILE or (file.startswith("shard-") and file.endswith(".npy")):
+                os.remove(self.output_dir / file)
+
+        self.index_file = open(self.output_dir / SHARD_INDEX_FILE, "w", newline="")
+        self.index_writer = csv.DictWriter(self.index_file, SHARD_INDEX_FIELDS)
+        self.index_writer.writeheader()
+
+    def add(self, image_path: Path, label: str, inits: str, emotion: str, time: float):
+        """Read an image, resize it and add it to the current shard along with its labels."""
+
+        image = cv2.imread(str(image_path))
+        if image is None:
+            raise ValueError(f"Could not read image {image_path}")
+
+        height, width = self.image_size
+        image = cv2.resize(cv2.cvtColor(image, cv2.COLOR_BGR2RGB), (width, height))
+
+        self.rows.append(
+            {
+                "shard": SHARD_FILE_FORMAT.format(self.num_shards),
+                "offset": len(self.images),
+                "label": label,
+                "inits": inits,
+                "emotion": emotion,
+                "time": time,
+                "filename": Path(image_path).name,
+            }
+        )
+        self.images.append(image)
+
+        if len(self.images) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        """Write the current shard and its index rows to disk."""
+
+        if not self.images:
+            return
+
+        np.save(self.output_dir / SHARD_FILE_FORMAT.format(self.num_shards), np.stack(self.images))
+        self.index_writer.writerows(self.rows)
+        self.index_file.flush()
+
+        self.num_shards += 1
+        self.images = []
+        self.rows = []
+
+    def close(self):
+        """Write the last shard and close the index."""
+
+        self.flush()
+        self.index_file.close()
+
+
+def is_sharded(dataset_dir: Path) -> bool:
+    """Check whether a dataset directory was written as shards."""
+
+    return (Path(dataset_dir) / SHARD_INDEX_FILE).exists()
+
+
+def read_index(dataset_dir: Path) -> List[Dict[str, str]]:
+    """Read the index rows of a sharded dataset directory."""
+
+    with open(Path(dataset_dir) / SHARD_INDEX_FILE, "r") as f:
+        return list(csv.DictReader(f))
+
+
+def iter_shards(dataset_dir: Path) -> Iterator[Tuple[np.ndarray, List[Dict[str, str]]]]:
+    """
+    Iterate over the shards of a dataset directory in order.
+    Each shard is memory-mapped, so it is read sequentially as it is used.\n
+    Yields (images, index rows) tuples, with the rows in the same order as the images.
+    """
+
+    shards: Dict[str, List[Dict[str, str]]] = {}
+    for row in read_index(dataset_dir):
+        shards.setdefault(row["shard"], []).append(row)
+
+    for shard, rows in shards.items():
+        images = np.load(Path(dataset_dir) / shard, mmap_mode="r")
+        yield images, sorted(rows, key=lambda row: int(row["offset"]))
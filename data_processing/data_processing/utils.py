@@ -1,7 +1,12 @@
 # TODO: Delete this
 
-from dataclasses import dataclass
-from typing import Tuple
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+from typing import Optional, Tuple
+
+CROP_REGION_FILE_FORMAT = "{}_crop.json"
 
 @dataclass
 class Point:
@@ -13,7 +18,43 @@ class Region:
     top_left: Point
     bottom_right: Point
 
+    @classmethod
+    def from_box(cls, box: Tuple[float, float, float, float]) -> "Region":
+        """Create a region from a (left, upper, right, lower) box, rounding it to pixels."""
+        left, upper, right, lower = (int(round(value)) for value in box)
+        return cls(Point(left, upper), Point(right, lower))
+
+    def to_box(self) -> Tuple[int, int, int, int]:
+        """Get the (left, upper, right, lower) box of the region, as used by the cropper UI."""
+        return (self.top_left.x, self.top_left.y, self.bottom_right.x, self.bottom_right.y)
+
 @dataclass
 class Resolution:
     height: int
     width: int
+
+
+def crop_region_path(image_dir: Path) -> Path:
+    """Get the path of the file storing the crop region of an image directory, next to the directory."""
+    image_dir = Path(image_dir)
+    return image_dir.parent / CROP_REGION_FILE_FORMAT.format(image_dir.name)
+
+
+def save_crop_region(image_dir: Path, region: Region):
+    """Store the crop region chosen for an image directory so it can be reused."""
+    path = crop_region_path(image_dir)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(asdict(region), f)
+    os.replace(tmp_path, path)
+
+
+def load_crop_region(image_dir: Path) -> Optional[Region]:
+    """Load the crop region stored for an image directory, or None if there is none."""
+    path = crop_region_path(image_dir)
+    if not path.exists():
+        return None
+
+    with open(path, "r") as f:
+        region = json.load(f)
+    return Region(Point(**region["top_left"]), Point(**region["bottom_right"]))
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+"""
+Compare the latency of the pupil models when a live stream gets a new sample.
+
+The windowed models (the bidirectional model of create_model, and the causal model of create_causal_model)
+are run on the whole window of the last window_size samples for each new sample, while the stateful copies of
+the causal model (StatefulPupilModel) are only fed the new sample.
+The models are untrained, which does not change their cost.
+
+Usage: python3 bench_pupil_stream.py [samples] [window_size]
+"""
+
+from collections import deque
+import numpy as np
+import sys
+import tensorflow as tf
+import time
+
+from models.pupil.train import create_causal_model, create_model, StatefulPupilModel
+
+WARMUP_SAMPLES = 10
+
+
+def run(predict, samples: np.ndarray) -> np.ndarray:
+    """
+    Feeds the samples to the predict function one at a time and returns the latency of each call in ms.
+    """
+    latencies = []
+    for i, sample in enumerate(samples):
+        start = time.perf_counter()
+        predict(sample)
+        if i >= WARMUP_SAMPLES:
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies) * 1000
+
+
+def windowed(model, window_size: int):
+    """
+    Returns a function that adds a sample to the window and runs the model on the whole window.
+    """
+    window = deque(np.zeros(window_size, dtype=np.float32), maxlen=window_size)
+    call = tf.function(lambda windows: model(windows, training=False))
+
+    def predict(sample):
+        window.append(sample)
+        return call(np.array(window, dtype=np.float32)[np.newaxis, :, np.newaxis]).numpy()
+
+    return predict
+
+
+if __name__ == "__main__":
+    num_samples = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    window_size = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+
+    rng = np.random.default_rng(496)
+    samples = rng.uniform(10, 20, num_samples + WARMUP_SAMPLES).astype(np.float32)
+
+    causal_model = create_causal_model(2, (window_size, 1))
+    results = {
+        "bidirectional": run(windowed(create_model(2, (window_size, 1)), window_size), samples),
+        "causal window": run(windowed(causal_model, window_size), samples),
+        "stateful": run(StatefulPupilModel(causal_model, window_size).push, samples),
+    }
+
+    print(f"{num_samples} samples, window of {window_size}")
+    baseline = np.median(results["bidirectional"])
+    for name, latencies in results.items():
+        print(
+            f"{name + ':':15}median {np.median(latencies):6.2f} ms, p95 {np.percentile(latencies, 95):6.2f} ms "
+            f"({baseline / np.median(latencies):.1f}x), {1000 / np.median(latencies):7.0f} samples/s"
+        )
@@ -0,0 +1,57 @@
+import cv2
+import numpy as np
+import os
+import pytest
+
+from data_processing.shards import ShardWriter
+from models.face.train import get_data
+
+
+@pytest.mark.parametrize(
+    "num_images, shard_size, image_size",
+    [
+        (10, 4, (16, 16)),
+        (5, 10, (8, 8)),
+    ],
+)
+def test_get_shard_data(num_images, shard_size, image_size, tmp_path):
+    # Write shards with alternating labels, where each image is filled with its index
+    writer = ShardWriter(tmp_path / "train", (16, 16), shard_size)
+    for label in ("negative", "positive"):
+        os.makedirs(tmp_path / "train" / label)
+    for i in range(num_images):
+        image_path = tmp_path / f"cs_joy_{i}.0_c.png"
+        cv2.imwrite(str(image_path), np.full((20, 20, 3), i, dtype=np.uint8))
+        writer.add(image_path, ("negative", "positive")[i % 2], "cs", "joy", float(i))
+    writer.close()
+
+    dataset, classes = get_data(tmp_path / "train", image_size, batch_size=4)
+    assert classes == ["negative", "positive"]
+
+    samples = 0
+    for images, labels in dataset:
+        assert images.shape[1:] == (*image_size, 3)
+        for image, label in zip(images.numpy(), labels.numpy()):
+            assert label == int(image[0, 0, 0]) % 2
+            samples += 1
+
+    assert samples == num_images
+
+
+def test_get_shard_data_shuffled(tmp_path):
+    # The shards are written with all the images of a label together
+    writer = ShardWriter(tmp_path / "train", (8, 8), 8)
+    for label in ("negative", "positive"):
+        os.makedirs(tmp_path / "train" / label)
+    for i in range(20):
+        image_path = tmp_path / f"cs_joy_{i}.0_c.png"
+        cv2.imwrite(str(image_path), np.full((8, 8, 3), i, dtype=np.uint8))
+        writer.add(image_path, "negative" if i < 10 else "positive", "cs", "joy", float(i))
+    writer.close()
+
+    dataset, _ = get_data(tmp_path / "train", (8, 8), batch_size=10)
+
+    # The images are shuffled before they are batched, so the batches mix the labels
+    batches = [labels.numpy() for _, labels in dataset]
+    assert sorted(np.concatenate(batches)) == [0] * 10 + [1] * 10
+    assert any(len(set(labels)) == 2 for labels in batches)
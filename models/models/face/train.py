@@ -1,7 +1,9 @@
+import numpy as np
+import os
 from pathlib import Path
 import sys
 import tensorflow as tf
-from tensorflow.data import AUTOTUNE
+from tensorflow.data import AUTOTUNE, Dataset
 from tensorflow.keras.callbacks import ModelCheckpoint
 from tensorflow.keras.models import Sequential
 from tensorflow.keras.layers import (
@@ -15,6 +17,7 @@ from tensorflow.keras.layers import (
 from tensorflow.keras.utils import image_dataset_from_directory
 from typing import Optional, Tuple
 
+from data_processing.shards import is_sharded, iter_shards, read_index
 
 BINARY_CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/binary-{epoch:03d}.ckpt"
 MULTICLASS_CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/multiclass-{epoch:03d}.ckpt"
@@ -32,6 +35,9 @@ def get_data(image_dir: Path, image_size: Tuple[int, int], batch_size: int = 32)
     Returns:
         The dataset, as well as the classes present in the image directory.
     """
+    if is_sharded(image_dir):
+        return get_shard_data(image_dir, image_size, batch_size)
+
     # Generate train and val set from directory
     dataset = image_dataset_from_directory(
         image_dir,
@@ -48,6 +54,59 @@ def get_data(image_dir: Path, image_size: Tuple[int, int], batch_size: int = 32)
     return dataset, classes
 
 
+def get_shard_data(image_dir: Path, image_size: Tuple[int, int], batch_size: int = 32):
+    """
+    Get the data from the shards written by separate_images and create the dataset.
+    The shards are read one at a time from start to end, instead of opening every image.
+
+    Args:
+        image_dir: The directory containing the shards and their index.
+        image_size: The size of the images in pixels (e.g. (224, 224)).
+        batch_size: The batch size to be used in the training.
+
+    Returns:
+        The dataset, as well as the classes present in the image directory.
+    """
+    # The classes are the emotion directories, in the same order as image_dataset_from_directory
+    classes = sorted(entry.name for entry in os.scandir(image_dir) if entry.is_dir())
+    class_indices = {label: i for i, label in enumerate(classes)}
+
+    # Get the shape of the images from the first shard
+    first_shard = next(iter_shards(image_dir), None)
+    if first_shard is None:
+        raise ValueError(f"No shards in {image_dir}")
+    shape = first_shard[0].shape[1:]
+
+    def generate_shards():
+        for images, rows in iter_shards(image_dir):
+            labels = np.array([class_indices[row["label"]] for row in rows], dtype=np.int32)
+            yield np.asarray(images), labels
+
+    dataset = Dataset.from_generator(
+        generate_shards,
+        output_signature=(
+            tf.TensorSpec(shape=(None, *shape), dtype=tf.uint8),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        ),
+    ).unbatch()
+
+    # Resize the images if the shards were written at a different size
+    if tuple(shape[0:2]) != tuple(image_size):
+        dataset = dataset.map(
+            lambda image, label: (tf.image.resize(image, image_size), label),
+            num_parallel_calls=AUTOTUNE,
+        )
+    else:
+        dataset = dataset.map(lambda image, label: (tf.cast(image, tf.float32), label))
+
+    # The shards are written in label and participant order, so the images are shuffled across the whole
+    # dataset before they are batched, instead of shuffling whole batches
+    num_images = len(read_index(image_dir))
+    dataset = dataset.cache().shuffle(num_images).batch(batch_size).prefetch(AUTOTUNE)
+
+    return dataset, classes
+
+
 def create_model(num_classes: int, input_shape: Optional[Tuple[int, int, int]] = None):
     """
     Create the CNN model for the facial expression images.
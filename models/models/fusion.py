@@ -1,92 +1,214 @@
-import csv
 import matplotlib.pyplot as plt
 import numpy as np
-import os
 from pathlib import Path
-import pickle
-from PIL import Image
-import re
 from sklearn.metrics import confusion_matrix, ConfusionMatrixDisplay
 import sys
-from tensorflow import convert_to_tensor, random
+import tensorflow as tf
+from tensorflow import random
 from tensorflow.data import AUTOTUNE, Dataset
-from tensorflow.keras.utils import img_to_array
-from typing import Tuple
-
-from data_processing.process_data import BINARY_EMOTIONS, TIMES_FILE_FORMAT
+from tensorflow.keras import Model
+from tensorflow.keras.layers import Add, Dense, Input, Reshape
+from typing import List, Tuple
+
+from data_processing.dataset_index import list_labels, read_dataset_index, read_split_images
+from data_processing.process_data import BINARY_EMOTIONS
+from data_processing.pupil.signals import spline_windows
+from data_processing.pupil.splines import read_splines
+from data_processing.shards import is_sharded
 import models.face as face
 import models.pupil as pupil
 
-def get_data(pkl_dir: Path, face_dir: Path, image_shape: Tuple[int, int], window_size: int = 100):
+EVALUATION_BATCH_SIZE = 256
+
+def load_image(image_path: tf.Tensor, image_shape: Tuple[int, int]) -> tf.Tensor:
+    """
+    Read and decode an image, and resize it as image_dataset_from_directory does for the face model.
+    The pixels are kept as uint8, since the face model rescales them itself.
+
+    Args:
+        image_path: The path to the image, as a string tensor.
+        image_shape: The size the image is resized to.
+
+    Returns:
+        The (height, width, 3) uint8 image.
     """
-    Get the functions from the .pkl files and timestamps from the face directories, then create the dataset.
+    image = tf.io.decode_image(tf.io.read_file(image_path), channels=3, expand_animations=False)
+    image = tf.image.resize(image, image_shape)
+    return tf.cast(tf.clip_by_value(tf.round(image), 0, 255), tf.uint8)
+
+def get_data(
+    pkl_dir: Path,
+    face_dir: Path,
+    image_shape: Tuple[int, int],
+    window_size: int = 100,
+    batch_size: int = EVALUATION_BATCH_SIZE,
+):
+    """
+    Get the functions from the .pkl or .npz files and timestamps from the face directories, then create the dataset.
 
     Args:
-        pkl_dir: The path to the directory of .pkl files containing the pupillometry splines.
+        pkl_dir: The path to the directory of .pkl files (or splines.npz file) containing the pupillometry splines.
         face_dir: The path to the directory of face images (for getting the times files)
+        image_shape: The size the face images are resized to.
         window_size: The number of data samples to be considered at a time.
-        batch_size: The batch size to be used in the training.
+        batch_size: The number of samples the models are run on at a time.
 
     Returns:
-        The dataset and the label classes.
+        The dataset and the label classes, in sorted order.
     """
-    # Read the splines from the pkl files
-    splines = {}
-    for file in os.listdir(pkl_dir):
-        # Check if the file is a pkl with the correct format
-        if match := re.search(r"pupil_(?P<inits>\w+)_(?P<emotion>\w+).pkl$", str(file)):
-            emotion = match["emotion"]
-            inits = match["inits"]
-
-            if match["inits"] not in splines:
-                splines[match["inits"]] = {}
-
-            with open(pkl_dir / file, 'rb') as f:
-                splines[inits][emotion] = pickle.load(f)
-
-    # Generate the dilations_windows, labels, and classes
-    images = []
-    dilation_windows = []
-    labels = []
-    classes = []
-    for i, label in enumerate(os.listdir(face_dir)):
-        classes.append(label)
+    # The images are streamed from their files, which a sharded split does not have
+    if is_sharded(face_dir):
+        raise ValueError(
+            f"The images of {face_dir} are packed into shards, "
+            "separate them with output_format='images' to evaluate the fusion model"
+        )
+
+    # Read the splines from the splines.npz file, or the pkl files if there is none
+    splines = read_splines(pkl_dir)
+
+    # Read the times and paths of every image in one pass, if separate_images wrote an index
+    index = read_dataset_index(face_dir)
+
+    # Get the times and images of the windows for each label, participant and emotion
+    # The labels are numbered in sorted order, as image_dataset_from_directory numbers the outputs of the face model
+    end_times = []
+    classes = sorted(list_labels(face_dir))
+    for i, label in enumerate(classes):
         for inits, init_splines in splines.items():
-            for emotion, spline in init_splines.items():
-                # Get the times file for this inits + emotion combination
-                times_path = face_dir / label / TIMES_FILE_FORMAT.format(inits, emotion)
-                if not os.path.isfile(times_path):
-                    continue
-
-                with open(times_path, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Check if a window can be generated for this time
-                        end_time = float(row["times"])
-                        if end_time < pupil.PERIOD * window_size:
-                            continue
-
-                        # Get the image for the time
-                        image = Image.open(face_dir / label / f"{inits}_{emotion}_{end_time}_c.png")
-                        image = image.resize(image_shape)
-                        images.append(img_to_array(image))
-
-                        # Generate a window for this time
-                        times = np.linspace(end_time - pupil.PERIOD * window_size, end_time, window_size)
-                        dilation_windows.append(spline(times))
-                        labels.append(i)
-
-    # Convert the dilations and labels to a tensor dataset
-    images_t = convert_to_tensor(images)
-    dilations_t = convert_to_tensor(dilation_windows)
-    labels_t = convert_to_tensor(labels)
-    dataset = Dataset.from_tensor_slices((images_t, dilations_t, labels_t))
-
-    # Prefetch datasets
-    dataset = dataset.batch(1).cache().shuffle(1000).prefetch(AUTOTUNE)
+            for emotion in init_splines:
+                # Get the images for this inits + emotion combination, from the index or the times file
+                # Check if a window can be generated for each time
+                split_images = [
+                    (end_time, image_path)
+                    for end_time, image_path in read_split_images(face_dir, label, inits, emotion, index)
+                    if end_time >= pupil.PERIOD * window_size
+                ]
+
+                if split_images:
+                    end_times.append((i, inits, emotion, split_images))
+
+    # Generate the image paths, dilation windows and labels, with the windows written into a preallocated array
+    num_windows = sum(len(split_images) for *_, split_images in end_times)
+    image_paths = []
+    dilation_windows = np.empty((num_windows, window_size), dtype=np.float32)
+    labels = np.empty(num_windows, dtype=np.int32)
+    start = 0
+    for i, inits, emotion, split_images in end_times:
+        image_paths += [str(image_path) for _, image_path in split_images]
+
+        # Generate the windows for all times of this participant and emotion at once
+        end = start + len(split_images)
+        spline_windows(
+            splines[inits][emotion],
+            np.array([end_time for end_time, _ in split_images]),
+            window_size,
+            pupil.PERIOD,
+            dilation_windows[start:end],
+        )
+        labels[start:end] = i
+        start = end
+
+    # Stream the images from their paths, decoding them in parallel as the batches are needed
+    dataset = Dataset.from_tensor_slices((image_paths, dilation_windows, labels))
+    dataset = dataset.map(
+        lambda image_path, dilations, label: (load_image(image_path, image_shape), dilations, label),
+        num_parallel_calls=AUTOTUNE,
+    )
+
+    # Prefetch datasets, in order since the samples are only evaluated
+    dataset = dataset.batch(batch_size).prefetch(AUTOTUNE)
 
     return dataset, classes
 
+def pupil_expansion(classes: List[str]) -> np.ndarray:
+    """
+    Get the matrix that expands the binary (negative, positive) pupil probabilities to the label classes,
+    giving each emotion the probability of its binary emotion.
+
+    Args:
+        classes: The label classes.
+
+    Returns:
+        The (2, classes) expansion matrix.
+    """
+    if len(classes) == 2:
+        return np.eye(2, dtype=np.float32)
+    columns = [int(BINARY_EMOTIONS[emotion] == "positive") for emotion in classes]
+    return np.eye(2, dtype=np.float32)[:, columns]
+
+def create_fusion_model(face_model: Model, pupil_model: Model, classes: List[str]) -> Model:
+    """
+    Compose the face and pupil models into a single model, which takes a batch of (image, pupil window)
+    and sums the probabilities of both models.
+    For more than 2 classes, the pupil probabilities are expanded to the classes by a fixed layer (see pupil_expansion).
+    The classes are sorted, since the face model numbers its outputs in sorted order.
+
+    Args:
+        face_model: The face model, created with its input shape.
+        pupil_model: The pupil model, created with its input shape.
+        classes: The label classes.
+
+    Returns:
+        The fusion model.
+    """
+    classes = sorted(classes)
+    image = Input(face_model.input_shape[1:], name="image")
+    pupil_window = Input(pupil_model.input_shape[1:2], name="pupil_window")
+
+    face_scores = face_model(image)
+    pupil_scores = pupil_model(Reshape(pupil_model.input_shape[1:])(pupil_window))
+
+    if len(classes) != 2:
+        expansion = Dense(len(classes), use_bias=False, trainable=False, name="binary_emotions")
+        pupil_scores = expansion(pupil_scores)
+        expansion.set_weights([pupil_expansion(classes)])
+
+    scores = Add(name="scores")([face_scores, pupil_scores])
+    return Model([image, pupil_window], scores, name="fusion")
+
+def load_fusion_model(classes: List[str], image_shape: Tuple[int, int, int], window_size: int = 100) -> Model:
+    """
+    Create the face and pupil models, load the weights of their best checkpoints and compose them.
+    The scores are in the sorted order of the classes, as the face model is trained.
+
+    Args:
+        classes: The label classes.
+        image_shape: The shape of the face images (e.g. (224, 224, 3)).
+        window_size: The number of data samples in a pupil window.
+
+    Returns:
+        The fusion model.
+    """
+    face_model = face.create_model(len(classes), image_shape)
+    pupil_model = pupil.create_model(2, (window_size, 1))
+
+    face_model.load_weights(face.BINARY_CHECKPOINT_PATH if len(classes) == 2 else face.MULTICLASS_CHECKPOINT_PATH)
+    pupil_model.load_weights(pupil.CHECKPOINT_PATH)
+
+    return create_fusion_model(face_model, pupil_model, classes)
+
+def evaluate(model: Model, dataset) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run the fusion model on each batch of the dataset.
+
+    Args:
+        model: The fusion model.
+        dataset: The dataset of batched (images, dilation windows, labels).
+
+    Returns:
+        The labels and the predicted classes of all the samples.
+    """
+    labels = []
+    predictions = []
+    for face_images, pupil_windows, batch_labels in dataset:
+        scores = model.predict_on_batch((face_images, pupil_windows))
+        labels.append(batch_labels.numpy())
+        predictions.append(np.argmax(scores, axis=1))
+
+    if not labels:
+        return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int64)
+    return np.concatenate(labels), np.concatenate(predictions)
+
 def create_confusion_matrix(labels, predictions, classes):
     cm = confusion_matrix(labels, predictions)
     disp = ConfusionMatrixDisplay(cm, display_labels=classes)
@@ -103,40 +225,15 @@ if __name__ == "__main__":
     # Get the dataset and classes
     test_set, classes = get_data(Path(sys.argv[1]), Path(sys.argv[2]), image_shape[0:2], window_size)
 
-    input_shape = (window_size, 1)
-    num_classes = len(classes)
+    # Create the fusion model from the face and pupil checkpoints
+    model = load_fusion_model(classes, image_shape, window_size)
 
-    # Create the models
-    face_model = face.create_model(num_classes, image_shape)
-    pupil_model = pupil.create_model(2, input_shape)
-
-    # Load the weights
-    face_model.load_weights(face.BINARY_CHECKPOINT_PATH if len(classes) == 2 else face.MULTICLASS_CHECKPOINT_PATH)
-    pupil_model.load_weights(pupil.CHECKPOINT_PATH)
+    # Optionally export the fusion model as a SavedModel, to run it with one call per batch
+    if len(sys.argv) > 3:
+        model.export(sys.argv[3])
 
     # Get the accuracy on the test set
-    correct = 0
-    labels = []
-    predictions = []
-    for face_image, pupil_window, label in test_set:
-        face_prediction = face_model.predict(face_image)
-        pupil_prediction = pupil_model.predict(pupil_window)
-
-        if len(classes) != 2:
-            multiclass_pupil_prediction = []
-            for v in BINARY_EMOTIONS.values():
-                if v == "negative":
-                    multiclass_pupil_prediction.append(pupil_prediction[0][0])
-                else:
-                    multiclass_pupil_prediction.append(pupil_prediction[0][1])
-            pupil_prediction = multiclass_pupil_prediction
-
-        # Check that the label matches the emotion with the highest probability
-        prediction = np.argmax(face_prediction + pupil_prediction)
-        labels.append(label)
-        predictions.append(prediction)
-        if prediction == label:
-            correct += 1
-
-    print(f"Test accuracy: {correct/len(test_set)}")
+    labels, predictions = evaluate(model, test_set)
+
+    print(f"Test accuracy: {np.mean(predictions == labels)}")
     create_confusion_matrix(labels, predictions, classes)
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import re
+import shutil
+from typing import List, Optional, Tuple
+
+from data_processing.dataset_index import dataset_index_path, list_labels
+from data_processing.manifest import hash_file
+from data_processing.process_data import TIMES_FILE_FORMAT
+from data_processing.pupil.splines import SPLINE_FILE_PATTERN, SPLINES_FILE
+
+CACHE_VERSION = 1
+WINDOWS_FILE = "windows.npy"
+LABELS_FILE = "labels.npy"
+CLASSES_FILE = "classes.json"
+HASHES_FILE = "hashes.json"
+TIMES_FILE_PATTERN = "^" + re.escape(TIMES_FILE_FORMAT).replace(r"\{\}", r"\w+") + "$"
+
+
+def input_files(pkl_dir: Path, face_dir: Path) -> List[Path]:
+    """
+    Get the files the windows of a split are generated from: the splines, and the dataset index
+    or the times files of each label.
+    """
+    if (pkl_dir / SPLINES_FILE).exists():
+        files = [pkl_dir / SPLINES_FILE]
+    else:
+        files = [pkl_dir / file for file in sorted(os.listdir(pkl_dir)) if re.search(SPLINE_FILE_PATTERN, file)]
+
+    if dataset_index_path(face_dir).exists():
+        return files + [dataset_index_path(face_dir)]
+
+    for label in sorted(list_labels(face_dir)):
+        files += [
+            face_dir / label / file
+            for file in sorted(os.listdir(face_dir / label))
+            if re.search(TIMES_FILE_PATTERN, file)
+        ]
+    return files
+
+
+def file_hashes(cache_dir: Path, files: List[Path]) -> List[str]:
+    """
+    Get the SHA-256 hash of each file. As in the manifest, a hash stored in the cache directory
+    is reused while the size and modification time of the file are unchanged.
+    """
+    hashes_path = cache_dir / HASHES_FILE
+    hashes = {}
+    if hashes_path.exists():
+        try:
+            with open(hashes_path, "r") as f:
+                hashes = json.load(f)
+        except ValueError as e:
+            logging.error("Ignoring unreadable hashes %s: %s", hashes_path, e)
+
+    updated = False
+    file_hashes = []
+    for file in files:
+        stat = os.stat(file)
+        path = str(file.absolute())
+        if hashes.get(path, [None, None])[:2] != [stat.st_size, stat.st_mtime]:
+            hashes[path] = [stat.st_size, stat.st_mtime, hash_file(file)]
+            updated = True
+        file_hashes.append(hashes[path][2])
+
+    if updated:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = hashes_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(hashes, f)
+        os.replace(tmp_path, hashes_path)
+
+    return file_hashes
+
+
+def dataset_key(pkl_dir: Path, face_dir: Path, window_size: int, period: float, cache_dir: Path) -> str:
+    """
+    Get a key for the windows of a split, which changes whenever the contents of an input file,
+    the labels, the window size or the period change.
+    """
+    files = input_files(pkl_dir, face_dir)
+    contents = {
+        "version": CACHE_VERSION,
+        "window_size": window_size,
+        "period": period,
+        # The labels are numbered in the order they are listed
+        "labels": list_labels(face_dir),
+        "files": [
+            [str(file.relative_to(file.parents[1])), sha256]
+            for file, sha256 in zip(files, file_hashes(cache_dir, files))
+        ],
+    }
+    return hashlib.sha256(json.dumps(contents).encode()).hexdigest()[:16]
+
+
+def split_name(face_dir: Path) -> str:
+    """
+    Get the name the windows of a split are stored under: the name of its directory, with a hash of its path
+    so splits of different datasets with the same name (e.g. 'train') do not replace each other.
+    """
+    path_hash = hashlib.sha256(str(face_dir.resolve()).encode()).hexdigest()[:8]
+    return f"{face_dir.name}-{path_hash}"
+
+
+def load_windows(
+    cache_dir: Path, split: str, key: str
+) -> Optional[Tuple[np.ndarray, np.ndarray, List[str]]]:
+    """
+    Load the cached windows of a split, memory-mapped, if they were stored with this key.
+    Returns the windows, labels and classes, or None if there is no cached copy.
+    """
+    entry = cache_dir / f"{split}-{key}"
+    if not (entry / CLASSES_FILE).exists():
+        return None
+
+    with open(entry / CLASSES_FILE, "r") as f:
+        classes = json.load(f)
+    return (
+        np.load(entry / WINDOWS_FILE, mmap_mode="r"),
+        np.load(entry / LABELS_FILE, mmap_mode="r"),
+        classes,
+    )
+
+
+def save_windows(
+    cache_dir: Path, split: str, key: str, windows: np.ndarray, labels: np.ndarray, classes: List[str]
+):
+    """
+    Store the windows of a split under this key, replacing the copies stored for the split with other keys.
+    The entry is written to a temporary directory first, so an interrupted run never leaves a partial entry.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = cache_dir / f"{split}-{key}"
+    tmp_entry = cache_dir / f".{split}-{key}.tmp"
+    shutil.rmtree(tmp_entry, ignore_errors=True)
+    os.makedirs(tmp_entry)
+
+    np.save(tmp_entry / WINDOWS_FILE, windows)
+    np.save(tmp_entry / LABELS_FILE, labels)
+    # The classes are written last, since they mark the entry as complete
+    with open(tmp_entry / CLASSES_FILE, "w") as f:
+        json.dump(classes, f)
+
+    for file in os.listdir(cache_dir):
+        if file.startswith(f"{split}-") and (cache_dir / file).is_dir():
+            logging.debug("Removing stale cached windows %s", cache_dir / file)
+            shutil.rmtree(cache_dir / file)
+    os.replace(tmp_entry, entry)
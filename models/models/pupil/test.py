@@ -13,7 +13,13 @@ if __name__ == "__main__":
     window_size = 100
     batch_size = 32
 
-    test_set, classes = get_data(Path(sys.argv[1]), Path(sys.argv[2]) / "test", window_size, batch_size)
+    # Optional directories to store the resampled splines and the windows in, as in train.py
+    grid_dir = Path(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3].lower() != "none" else None
+    cache_dir = Path(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4].lower() != "none" else None
+
+    test_set, classes = get_data(
+        Path(sys.argv[1]), Path(sys.argv[2]) / "test", window_size, batch_size, grid_dir, cache_dir
+    )
 
     input_shape = (window_size, 1)
     num_classes = len(classes)
@@ -0,0 +1,102 @@
+import numpy as np
+import os
+import pickle
+import pytest
+from scipy.interpolate import CubicSpline
+
+import models.pupil.train as train
+from models.pupil.tests.test_get_data import write_times
+
+
+@pytest.fixture
+def inputs(tmp_path):
+    pkl_dir = tmp_path / "pupil"
+    face_dir = tmp_path / "train"
+    os.makedirs(pkl_dir)
+    os.makedirs(face_dir / "positive")
+
+    times = np.linspace(0, 20, 201)
+    with open(pkl_dir / "pupil_cs_joy.pkl", "wb") as f:
+        pickle.dump(CubicSpline(times, 15 + np.sin(times)), f)
+    write_times(face_dir / "positive" / "times_cs_joy.csv", [1.0, 2.0])
+
+    return pkl_dir, face_dir
+
+
+def test_get_data_cache(inputs, tmp_path, monkeypatch):
+    pkl_dir, face_dir = inputs
+    cache_dir = tmp_path / "cache"
+
+    calls = []
+    get_windows = train.get_windows
+
+    def counting_get_windows(*args):
+        calls.append(args)
+        return get_windows(*args)
+
+    monkeypatch.setattr(train, "get_windows", counting_get_windows)
+
+    def windows(window_size=10):
+        dataset, classes = train.get_data(pkl_dir, face_dir, window_size, batch_size=8, cache_dir=cache_dir)
+        assert classes == ["positive"]
+        return np.concatenate([dilations.numpy() for dilations, _ in dataset])
+
+    first = windows()
+    assert len(calls) == 1
+    assert sorted(os.listdir(cache_dir))[0] == "hashes.json"
+    assert len(os.listdir(cache_dir)) == 2
+
+    # The cached windows are reused while the inputs are unchanged
+    assert np.array_equal(windows(), first)
+    assert len(calls) == 1
+
+    # Changing a times file, the window size or a spline generates the windows again
+    write_times(face_dir / "positive" / "times_cs_joy.csv", [1.0, 2.0, 3.0])
+    assert len(windows()) == 3
+    assert len(calls) == 2
+
+    previous = windows(20)
+    assert previous.shape == (3, 20)
+    assert len(calls) == 3
+
+    times = np.linspace(0, 20, 201)
+    with open(pkl_dir / "pupil_cs_joy.pkl", "wb") as f:
+        pickle.dump(CubicSpline(times, 16 + np.sin(times)), f)
+    assert np.allclose(windows(20), previous + 1)
+    assert len(calls) == 4
+
+    # Only the latest windows of the split are kept
+    assert len(os.listdir(cache_dir)) == 2
+
+
+def test_get_data_cache_same_split_name(inputs, tmp_path, monkeypatch):
+    pkl_dir, face_dir = inputs
+    cache_dir = tmp_path / "cache"
+
+    # A split of another dataset with the same name
+    other_face_dir = tmp_path / "other" / "train"
+    os.makedirs(other_face_dir / "positive")
+    write_times(other_face_dir / "positive" / "times_cs_joy.csv", [1.0, 2.0, 3.0])
+
+    calls = []
+    get_windows = train.get_windows
+
+    def counting_get_windows(*args):
+        calls.append(args)
+        return get_windows(*args)
+
+    monkeypatch.setattr(train, "get_windows", counting_get_windows)
+
+    def windows(split_dir):
+        dataset, _ = train.get_data(pkl_dir, split_dir, 10, batch_size=8, cache_dir=cache_dir)
+        return np.concatenate([dilations.numpy() for dilations, _ in dataset])
+
+    assert len(windows(face_dir)) == 2
+    assert len(windows(other_face_dir)) == 3
+    assert len(calls) == 2
+
+    # Both splits stay cached
+    assert len(windows(face_dir)) == 2
+    assert len(windows(other_face_dir)) == 3
+    assert len(calls) == 2
+    assert len(os.listdir(cache_dir)) == 3
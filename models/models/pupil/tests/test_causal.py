@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from models.pupil.train import create_causal_model, StatefulPupilModel
+
+
+@pytest.mark.parametrize("num_classes, num_copies", [(2, 1), (2, 4), (7, 2)])
+def test_stateful_model(num_classes, num_copies):
+    window_size = 20
+    model = create_causal_model(num_classes, (window_size, 1))
+    stateful_model = StatefulPupilModel(model, window_size, num_copies)
+
+    # A stream several windows long, so the states would drift if they were never reset
+    rng = np.random.default_rng(496)
+    samples = rng.uniform(10, 20, 3 * window_size + 7).astype(np.float32)
+
+    outputs = {}
+    for _ in range(2):
+        stateful_model.reset()
+        outputs = {i: stateful_model.push(sample) for i, sample in enumerate(samples)}
+
+    # Every window_size / num_copies samples, the output is that of the causal model on the last window
+    hop = window_size // num_copies
+    ends = [i for i, probabilities in outputs.items() if probabilities is not None]
+    assert ends == list(range(window_size - 1, len(samples), hop))
+
+    windows = np.stack([samples[end - window_size + 1 : end + 1] for end in ends])
+    expected = model.predict_on_batch(windows)
+    for end, window_expected in zip(ends, expected):
+        assert np.allclose(outputs[end], window_expected, atol=1e-5)
+
+
+def test_stateful_model_copies():
+    with pytest.raises(ValueError):
+        StatefulPupilModel(create_causal_model(2, (20, 1)), 20, 3)
@@ -0,0 +1,87 @@
+import csv
+import cv2
+import numpy as np
+import os
+import pickle
+import pytest
+from scipy.interpolate import CubicSpline
+
+from data_processing.shards import ShardWriter
+from models.pupil.train import get_data, get_windows, PERIOD
+
+
+def write_times(path, times):
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, ["times"])
+        writer.writeheader()
+        writer.writerows({"times": time} for time in times)
+
+
+@pytest.mark.parametrize("window_size", [10, 100])
+def test_get_data(window_size, tmp_path):
+    # One spline per emotion, each with a different offset
+    pkl_dir = tmp_path / "pupil"
+    os.makedirs(pkl_dir)
+    splines = {}
+    for offset, emotion in enumerate(("joy", "anger")):
+        times = np.linspace(0, 20, 201)
+        splines[emotion] = CubicSpline(times, 15 + offset + np.sin(times))
+        with open(pkl_dir / f"pupil_cs_{emotion}.pkl", "wb") as f:
+            pickle.dump(splines[emotion], f)
+
+    face_dir = tmp_path / "train"
+    os.makedirs(face_dir / "positive")
+    os.makedirs(face_dir / "negative")
+    write_times(face_dir / "positive" / "times_cs_joy.csv", [0.0, 1.0, 2.0, 3.5])
+    write_times(face_dir / "negative" / "times_cs_anger.csv", [1.0, 4.0])
+
+    # Times before the first full window are skipped
+    expected = [
+        (splines[emotion](end_time - PERIOD * np.arange(window_size - 1, -1, -1)), label)
+        for label, emotion, end_times in (
+            ("positive", "joy", [1.0, 2.0, 3.5]),
+            ("negative", "anger", [1.0, 4.0]),
+        )
+        for end_time in end_times
+    ]
+
+    for grid_dir in (None, tmp_path / "grid", tmp_path / "grid"):
+        dataset, classes = get_data(pkl_dir, face_dir, window_size, batch_size=2, grid_dir=grid_dir)
+
+        # The batches are shuffled, so match each window to the expected ones
+        windows = [
+            (window, classes[label])
+            for dilations, labels in dataset
+            for window, label in zip(dilations.numpy(), labels.numpy())
+        ]
+        assert len(windows) == len(expected)
+        for window, label in windows:
+            assert any(
+                label == expected_label and np.allclose(window, expected_window)
+                for expected_window, expected_label in expected
+            )
+
+
+def test_get_windows_sharded(tmp_path):
+    pkl_dir = tmp_path / "pupil"
+    os.makedirs(pkl_dir)
+    times = np.linspace(0, 20, 201)
+    with open(pkl_dir / "pupil_cs_joy.pkl", "wb") as f:
+        pickle.dump(CubicSpline(times, 15 + np.sin(times)), f)
+
+    # Sharded output has the shards and their index next to the label directories
+    face_dir = tmp_path / "train"
+    writer = ShardWriter(face_dir, (8, 8))
+    os.makedirs(face_dir / "negative")
+    os.makedirs(face_dir / "positive")
+    write_times(face_dir / "positive" / "times_cs_joy.csv", [1.0, 2.0])
+    for time in (1.0, 2.0):
+        image_path = tmp_path / f"cs_joy_{time}_c.png"
+        cv2.imwrite(str(image_path), np.zeros((8, 8, 3), dtype=np.uint8))
+        writer.add(image_path, "positive", "cs", "joy", time)
+    writer.close()
+
+    windows, labels, classes = get_windows(pkl_dir, face_dir, 10)
+    assert sorted(classes) == ["negative", "positive"]
+    assert windows.shape == (2, 10)
+    assert [classes[label] for label in labels] == ["positive", "positive"]
@@ -1,9 +1,6 @@
-import csv
+import logging
 import numpy as np
-import os
 from pathlib import Path
-import pickle
-import re
 import sys
 import tensorflow as tf
 from tensorflow.data import AUTOTUNE, Dataset
@@ -18,69 +15,121 @@ from tensorflow.keras.layers import (
     LSTM,
     Rescaling,
 )
-from typing import Optional, Tuple
+from typing import List, Optional, Tuple
 
 
-from data_processing.process_data import TIMES_FILE_FORMAT
+from data_processing.dataset_index import list_labels, read_dataset_index, read_split_images
+from data_processing.pupil.signals import grid_windows, load_grid
+from data_processing.pupil.splines import read_splines
+from models.pupil.cache import dataset_key, load_windows, save_windows, split_name
 
 
 CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/binary-{epoch:03d}.ckpt"
+CAUSAL_CHECKPOINT_PATH = Path(__file__).parent / "checkpoints/causal-{epoch:03d}.ckpt"
 MAX_PUPIL_DILATION = 30
 PERIOD = 0.01 #s
 
 
-def get_data(pkl_dir: Path, face_dir: Path, window_size: int = 100, batch_size: int = 32):
+def get_windows(
+    pkl_dir: Path, face_dir: Path, window_size: int = 100, grid_dir: Optional[Path] = None
+) -> Tuple[np.ndarray, np.ndarray, List[str]]:
     """
-    Get the functions from the .pkl files and timestamps from the face directories, then create the dataset.
+    Get the functions from the .pkl or .npz files and timestamps from the face directories, then create the windows.
+    The timestamps are read from the dataset index when there is one, and from the times files otherwise.
+    Each spline is resampled once onto a uniform grid of the period, and the windows are slices of the grid.
 
     Args:
-        pkl_dir: The path to the directory of .pkl files containing the pupillometry splines.
+        pkl_dir: The path to the directory of .pkl files (or splines.npz file) containing the pupillometry splines.
         face_dir: The path to the directory of face images (for getting the times files)
         window_size: The number of data samples to be considered at a time.
-        batch_size: The batch size to be used in the training.
+        grid_dir: The path to a directory to store the resampled splines in, so later runs can reuse them.
 
     Returns:
-        The dataset and the label classes.
+        The dilation windows, their labels, and the label classes.
     """
-    # Read the splines from the pkl files
-    splines = {}
-    for file in os.listdir(pkl_dir):
-        # Check if the file is a pkl with the correct format
-        if match := re.search(r"pupil_(?P<inits>\w+)_(?P<emotion>\w+).pkl$", str(file)):
-            emotion = match["emotion"]
-            inits = match["inits"]
-
-            if match["inits"] not in splines:
-                splines[match["inits"]] = {}
-
-            with open(pkl_dir / file, 'rb') as f:
-                splines[inits][emotion] = pickle.load(f)
-
-    # Generate the dilations_windows, labels, and classes
-    dilation_windows = []
-    labels = []
+    # Read the splines from the splines.npz file, or the pkl files if there is none
+    splines = read_splines(pkl_dir)
+
+    # Read the times of every image in one pass, if separate_images wrote an index
+    index = read_dataset_index(face_dir)
+
+    # Get the times of the windows for each label, participant and emotion
+    end_times = []
+    durations = {}
     classes = []
-    for i, label in enumerate(os.listdir(face_dir)):
+    for i, label in enumerate(list_labels(face_dir)):
         classes.append(label)
         for inits, init_splines in splines.items():
-            for emotion, spline in init_splines.items():
-                # Get the times file for this inits + emotion combination
-                times_path = face_dir / label / TIMES_FILE_FORMAT.format(inits, emotion)
-                if not os.path.isfile(times_path):
-                    continue
-
-                with open(times_path, 'r') as f:
-                    reader = csv.DictReader(f)
-                    for row in reader:
-                        # Check if a window can be generated for this time
-                        end_time = float(row["times"])
-                        if end_time < PERIOD * window_size:
-                            continue
-
-                        # Generate a window for this time
-                        times = np.linspace(end_time - PERIOD * window_size, end_time, window_size)
-                        dilation_windows.append(spline(times))
-                        labels.append(i)
+            for emotion in init_splines:
+                # Get the times for this inits + emotion combination, from the index or the times file
+                images = read_split_images(face_dir, label, inits, emotion, index)
+
+                # Check if a window can be generated for each time
+                times = np.array([time for time, _ in images])
+                times = times[times >= PERIOD * window_size]
+
+                if len(times):
+                    end_times.append((i, inits, emotion, times))
+                    durations[inits, emotion] = max(durations.get((inits, emotion), 0), times.max())
+
+    # Resample each spline once, up to the last time it is needed
+    grids = {
+        (inits, emotion): load_grid(
+            grid_dir, inits, emotion, splines[inits][emotion], duration, PERIOD
+        )
+        for (inits, emotion), duration in durations.items()
+    }
+
+    # Generate the dilation windows and labels directly into preallocated arrays
+    num_windows = sum(len(times) for _, _, _, times in end_times)
+    dilation_windows = np.empty((num_windows, window_size), dtype=np.float32)
+    labels = np.empty(num_windows, dtype=np.int32)
+    start = 0
+    for i, inits, emotion, times in end_times:
+        end = start + len(times)
+        dilation_windows[start:end] = grid_windows(grids[inits, emotion], times, window_size, PERIOD)
+        labels[start:end] = i
+        start = end
+
+    return dilation_windows, labels, classes
+
+
+def get_data(
+    pkl_dir: Path,
+    face_dir: Path,
+    window_size: int = 100,
+    batch_size: int = 32,
+    grid_dir: Optional[Path] = None,
+    cache_dir: Optional[Path] = None,
+):
+    """
+    Get the windows of the pupillometry data for the face directory (see get_windows), then create the dataset.
+    If a cache directory is given, the windows are stored there and reused while the spline files,
+    times files, window size and period are unchanged.
+
+    Args:
+        pkl_dir: The path to the directory of .pkl files (or splines.npz file) containing the pupillometry splines.
+        face_dir: The path to the directory of face images (for getting the times files)
+        window_size: The number of data samples to be considered at a time.
+        batch_size: The batch size to be used in the training.
+        grid_dir: The path to a directory to store the resampled splines in, so later runs can reuse them.
+        cache_dir: The path to a directory to store the windows in, so later runs can reuse them.
+
+    Returns:
+        The dataset and the label classes.
+    """
+    cached = None
+    if cache_dir:
+        key = dataset_key(pkl_dir, face_dir, window_size, PERIOD, cache_dir)
+        cached = load_windows(cache_dir, split_name(face_dir), key)
+
+    if cached:
+        logging.info("Using the cached windows of %s", face_dir)
+        dilation_windows, labels, classes = cached
+    else:
+        dilation_windows, labels, classes = get_windows(pkl_dir, face_dir, window_size, grid_dir)
+        if cache_dir:
+            save_windows(cache_dir, split_name(face_dir), key, dilation_windows, labels, classes)
 
     # Convert the dilations and labels to a tensor dataset
     dilations_t = tf.convert_to_tensor(dilation_windows)
@@ -136,6 +185,114 @@ def create_model(num_classes: int, input_shape: Optional[Tuple[int, int]] = None
     return model
 
 
+def create_causal_model(
+    num_classes: int,
+    input_shape: Optional[Tuple[int, int]] = None,
+    stateful: bool = False,
+    num_streams: int = 1,
+):
+    """
+    Create a causal LSTM model to be used on the pupillometry data, which only looks at the samples before each one.
+    The architecture consists of 3 unidirectional LSTM layers, with dropout applied.
+    It is trained on windows like the model of create_model, and can then be run one sample at a time
+    (see StatefulPupilModel).
+
+    Args:
+        num_classes: The number of classes to be used in the output layer.
+        input_shape: The shape of the input data.
+        stateful: Whether the model takes a single sample of each stream at a time,
+            keeping the LSTM states between calls.
+        num_streams: The number of streams of a stateful model, each with its own LSTM states.
+
+    Returns:
+        The causal LSTM model.
+    """
+    model = Sequential()
+
+    if stateful:
+        model.add(Input(batch_shape=(num_streams, 1, 1)))
+    elif input_shape:
+        model.add(Input(input_shape))
+
+    model.add(Rescaling(1.0 / MAX_PUPIL_DILATION))
+    model.add(LSTM(32, dropout=0.2, return_sequences=True, stateful=stateful))
+    model.add(LSTM(32, dropout=0.2, return_sequences=True, stateful=stateful))
+    model.add(LSTM(32, dropout=0.2, return_sequences=False, stateful=stateful))
+    model.add(Dense(num_classes, "softmax"))
+
+    loss = tf.keras.losses.SparseCategoricalCrossentropy()
+    model.compile(loss=loss, optimizer="adam", metrics=["accuracy"])
+
+    if input_shape:
+        model.summary()
+
+    return model
+
+
+class StatefulPupilModel:
+    """
+    Runs a trained causal model on a live stream of pupil samples, one sample at a time.
+
+    The causal model is trained on windows of window_size samples that start from zero LSTM states,
+    so its states must not carry on past a window: its outputs would then no longer be those of the windowed model.
+    Instead, num_copies copies of the states are kept, as the streams of a stateful model, staggered by
+    window_size / num_copies samples. Each copy is reset every window_size samples, just before its first sample,
+    so every window_size / num_copies samples one copy has seen exactly the last window_size samples,
+    and its output is the output of the causal model on that window.
+    A new sample costs one step of the model over num_copies streams, whatever the window size.
+    """
+
+    def __init__(self, model: Sequential, window_size: int = 100, num_copies: int = 4):
+        """
+        Args:
+            model: The trained causal model (see create_causal_model).
+            window_size: The number of samples in the windows the model was trained on.
+            num_copies: The number of staggered copies of the states, which must divide the window size.
+        """
+        if window_size % num_copies:
+            raise ValueError(f"The number of copies {num_copies} does not divide the window size {window_size}")
+
+        self.window_size = window_size
+        self.hop = window_size // num_copies
+        self.offsets = np.arange(num_copies) * self.hop
+        self.num_samples = 0
+
+        self.model = create_causal_model(model.output_shape[-1], stateful=True, num_streams=num_copies)
+        self.model.set_weights(model.get_weights())
+        self._states = [state for layer in self.model.layers if isinstance(layer, LSTM) for state in layer.states]
+        self._step = tf.function(lambda samples: self.model(samples, training=False))
+
+    def reset(self):
+        """Start a new stream, for example at the start of each recording."""
+        self.num_samples = 0
+
+    def push(self, diameter: float) -> Optional[np.ndarray]:
+        """
+        Feed the next sample of the stream to every copy.
+
+        Returns:
+            The probabilities of the causal model on the last window_size samples,
+            every window_size / num_copies samples once a full window has arrived, and None otherwise.
+        """
+        # Reset the copies whose window starts with this sample
+        keep = ((self.num_samples - self.offsets) % self.window_size != 0).astype(np.float32)[:, np.newaxis]
+        if self.num_samples == 0:
+            keep[:] = 0
+        if not keep.all():
+            for state in self._states:
+                state.assign(state * keep)
+
+        probabilities = self._step(np.full((len(self.offsets), 1, 1), diameter, dtype=np.float32))
+        self.num_samples += 1
+
+        # The copy whose window ends with this sample, if its first full window has arrived
+        ends = (self.num_samples - self.offsets) % self.window_size == 0
+        ends &= self.num_samples - self.offsets >= self.window_size
+        if not ends.any():
+            return None
+        return probabilities.numpy()[np.argmax(ends)]
+
+
 if __name__ == "__main__":
     # fix random seed for reproducibility
     tf.random.set_seed(496)
@@ -143,15 +300,28 @@ if __name__ == "__main__":
     window_size = 100
     batch_size = 32
 
-    train_set, classes = get_data(Path(sys.argv[1]), Path(sys.argv[2]) / "train", window_size, batch_size)
-    val_set, _ = get_data(Path(sys.argv[1]), Path(sys.argv[2]) / "val", window_size, batch_size)
+    # Optional directories to store the resampled splines and the windows in
+    grid_dir = Path(sys.argv[3]) if len(sys.argv) > 3 and sys.argv[3].lower() != "none" else None
+    cache_dir = Path(sys.argv[4]) if len(sys.argv) > 4 and sys.argv[4].lower() != "none" else None
+    # Optionally train the causal model, which can be run one sample at a time
+    causal = len(sys.argv) > 5 and sys.argv[5].lower() == "causal"
+
+    train_set, classes = get_data(
+        Path(sys.argv[1]), Path(sys.argv[2]) / "train", window_size, batch_size, grid_dir, cache_dir
+    )
+    val_set, _ = get_data(Path(sys.argv[1]), Path(sys.argv[2]) / "val", window_size, batch_size, grid_dir, cache_dir)
 
     input_shape = (window_size, 1)
     num_classes = len(classes)
 
     # Create the LSTM model
-    model = create_model(num_classes, input_shape)
+    if causal:
+        model = create_causal_model(num_classes, input_shape)
+    else:
+        model = create_model(num_classes, input_shape)
 
     # Training
-    cp_callback = ModelCheckpoint(CHECKPOINT_PATH, save_weights_only=True, verbose=1)
+    cp_callback = ModelCheckpoint(
+        CAUSAL_CHECKPOINT_PATH if causal else CHECKPOINT_PATH, save_weights_only=True, verbose=1
+    )
     model.fit(train_set, validation_data=val_set, epochs=10, callbacks=[cp_callback])
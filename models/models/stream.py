@@ -0,0 +1,363 @@
+from collections import deque
+import cv2
+from dataclasses import dataclass
+import logging
+import numpy as np
+import os
+from pathlib import Path
+import socket
+import sys
+import tensorflow as tf
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from data_processing.face.auto_crop import detect_face
+from data_processing.process_data import BINARY_EMOTIONS, MULTICLASS_EMOTIONS
+from data_processing.utils import Region
+from models.fusion import load_fusion_model
+import models.pupil as pupil
+
+# Number of fused predictions emitted per second of video
+PREDICTION_RATE = 5
+# Seconds between face detections, the last detected region is used in between
+DETECT_INTERVAL = 1.0
+# Seconds to wait for new rows when the end of the pupil data file is reached
+POLL_INTERVAL = 0.01
+
+
+@dataclass
+class Prediction:
+    time: float
+    label: str
+    scores: np.ndarray
+    # Time of the last pupil sample in the window, in seconds
+    pupil_time: float
+    # Seconds from reading the frame to emitting the fused prediction
+    latency: float
+
+
+class PupilWindow:
+    """
+    The last window_size pupil samples, resampled onto a uniform grid of the period (in seconds) as they arrive.
+    Samples are pushed from the thread reading the pupil stream.
+
+    These windows do not match the training windows of the pupil model: the splines are fitted on times in ms,
+    but get_windows evaluates them at the times of the face images, in seconds, on a grid of the same period.
+    So a training window covers window_size * period ms of pupil data, while this one covers window_size * period s.
+    """
+
+    def __init__(self, window_size: int = 100, period: float = pupil.PERIOD):
+        self.period = period
+        self.samples = deque(maxlen=window_size)
+        # Time of the last point of the grid
+        self.time: Optional[float] = None
+        self._last_sample: Optional[Tuple[float, float]] = None
+        self._lock = threading.Lock()
+
+    def push(self, sample_time: float, diameter: float):
+        """Add a sample (time in seconds), interpolating the grid points since the previous sample."""
+        with self._lock:
+            if self.time is None:
+                self.samples.append(diameter)
+                self.time = sample_time
+                self._last_sample = (sample_time, diameter)
+                return
+
+            # Samples out of order are dropped, the grid only moves forward
+            last_time, last_diameter = self._last_sample
+            if sample_time <= last_time:
+                return
+            self._last_sample = (sample_time, diameter)
+
+            num_points = int(np.floor((sample_time - self.time) / self.period + 1e-9))
+            if num_points <= 0:
+                return
+
+            # Only the grid points that stay in the window are interpolated
+            grid = self.time + self.period * np.arange(max(num_points - self.samples.maxlen, 0) + 1, num_points + 1)
+            self.samples.extend(np.interp(grid, [last_time, sample_time], [last_diameter, diameter]))
+            self.time = grid[-1]
+
+    def window(self) -> Optional[np.ndarray]:
+        """Get a copy of the window, or None until window_size samples have arrived."""
+        with self._lock:
+            if len(self.samples) < self.samples.maxlen:
+                return None
+            return np.array(self.samples, dtype=np.float32)
+
+
+def tail_pupil_csv(
+    data_file: Path, stop: Optional[threading.Event] = None, poll_interval: float = POLL_INTERVAL
+) -> Iterator[Tuple[float, float]]:
+    """
+    Read the times (ms) and diameters of a pupil data csv file as rows are appended to it, like `tail -f`.
+    The file has the columns of the data files (see data_processing.pupil.process_data.read_data).
+
+    Yields (time in seconds, diameter) tuples until the stop event is set.
+    """
+    with open(data_file, "r") as f:
+        header = f.readline()
+        while not header.endswith("\n"):
+            if stop and stop.is_set():
+                return
+            time.sleep(poll_interval)
+            header += f.readline()
+        columns = header.strip().split(",")
+        times_col, diameters_col = columns.index("times"), columns.index("diameters")
+
+        line = ""
+        while not (stop and stop.is_set()):
+            line += f.readline()
+            # Wait for the rest of a row that is still being written
+            if not line.endswith("\n"):
+                time.sleep(poll_interval)
+                continue
+
+            row = line.strip().split(",")
+            line = ""
+            try:
+                sample = float(row[times_col]) / 1000, float(row[diameters_col])
+            except (IndexError, ValueError):
+                logging.warning("Skipping malformed pupil row %s", row)
+                continue
+            yield sample
+
+
+def read_pupil_socket(
+    host: str, port: int, stop: Optional[threading.Event] = None
+) -> Iterator[Tuple[float, float]]:
+    """
+    Read the pupil samples sent to a TCP socket as "time,diameter" lines, with the time in ms.
+
+    Yields (time in seconds, diameter) tuples until the connection is closed or the stop event is set.
+    """
+    with socket.create_connection((host, port)) as connection, connection.makefile("r") as f:
+        for line in f:
+            if stop and stop.is_set():
+                return
+            try:
+                sample_time, diameter = (float(value) for value in line.strip().split(","))
+            except ValueError:
+                logging.warning("Skipping malformed pupil sample %r", line)
+                continue
+            yield sample_time / 1000, diameter
+
+
+def pupil_samples(source: str, stop: Optional[threading.Event] = None) -> Iterator[Tuple[float, float]]:
+    """Read the pupil samples from a data csv file, or from a socket if the source is 'host:port'."""
+    if not os.path.exists(source) and ":" in source:
+        host, port = source.rsplit(":", 1)
+        return read_pupil_socket(host, int(port), stop)
+    return tail_pupil_csv(Path(source), stop)
+
+
+def feed_pupil_window(samples: Iterator[Tuple[float, float]], pupil_window: PupilWindow):
+    """Push each pupil sample into the window as it is read, meant to run on its own thread."""
+    for sample_time, diameter in samples:
+        pupil_window.push(sample_time, diameter)
+
+
+def iter_video(source: str, realtime: bool = True) -> Iterator[Tuple[float, float, np.ndarray]]:
+    """
+    Read the frames of a video file, or of a local camera if the source is a device number (e.g. '0').
+    The frames of a file are released at the pace of the video if realtime is set, as a camera would.
+
+    Yields (video time in seconds, time.perf_counter() when the frame was read, BGR frame) tuples.
+    """
+    camera = source.isdigit()
+    capture = cv2.VideoCapture(int(source) if camera else source)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open video source {source}")
+
+    start = time.perf_counter()
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+
+            read_time = time.perf_counter()
+            if camera:
+                video_time = read_time - start
+            else:
+                video_time = capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+                if realtime and start + video_time > read_time:
+                    time.sleep(start + video_time - read_time)
+                    read_time = time.perf_counter()
+
+            yield video_time, read_time, frame
+    finally:
+        capture.release()
+
+
+class StreamEngine:
+    """
+    Fuses the latest cropped face and the last window of pupil samples into a prediction,
+    at most rate times per second of video.
+    The face is found with the same detector as auto_crop, unless a fixed crop region is given.
+    """
+
+    def __init__(
+        self,
+        predict: Callable[[np.ndarray, np.ndarray], np.ndarray],
+        classes: List[str],
+        window_size: int = 100,
+        image_shape: Tuple[int, int] = (224, 224),
+        rate: float = PREDICTION_RATE,
+        region: Optional[Region] = None,
+        detect_interval: float = DETECT_INTERVAL,
+    ):
+        self.predict = predict
+        self.classes = classes
+        self.image_shape = image_shape
+        self.rate = rate
+        self.pupil_window = PupilWindow(window_size)
+        self.face: Optional[np.ndarray] = None
+        self._region = region
+        self._fixed_region = region is not None
+        self._detect_interval = detect_interval
+        self._detect_time: Optional[float] = None
+
+    def update_face(self, frame: np.ndarray, video_time: float) -> bool:
+        """Crop the face in the frame, resized and in RGB as the face model is trained on. Returns whether one is found."""
+        if not self._fixed_region and (
+            self._detect_time is None or video_time - self._detect_time >= self._detect_interval
+        ):
+            region = detect_face(frame)
+            if region:
+                self._region, self._detect_time = region, video_time
+
+        if self._region is None:
+            return False
+
+        face = frame[
+            self._region.top_left.y : self._region.bottom_right.y,
+            self._region.top_left.x : self._region.bottom_right.x,
+        ]
+        face = cv2.resize(face, (self.image_shape[1], self.image_shape[0]), interpolation=cv2.INTER_LINEAR)
+        self.face = cv2.cvtColor(face, cv2.COLOR_BGR2RGB)
+        return True
+
+    def run(
+        self,
+        frames: Iterator[Tuple[float, float, np.ndarray]],
+        on_prediction: Optional[Callable[[Prediction], None]] = None,
+    ) -> List[Prediction]:
+        """
+        Emit a prediction for the first frame of each 1 / rate seconds of video, once a face was found
+        and the pupil window is full. The frames in between are dropped without being processed.
+
+        Args:
+            frames: The (video time, read time, frame) tuples of the video (see iter_video).
+            on_prediction: A function called with each prediction as soon as it is made.
+
+        Returns:
+            The predictions.
+        """
+        predictions = []
+        period = 1 / self.rate
+        next_time = None
+        for video_time, read_time, frame in frames:
+            if next_time is None:
+                next_time = video_time
+            # Frame times are rounded to the millisecond
+            if video_time < next_time - 1e-3:
+                continue
+            next_time += period * (np.floor((video_time - next_time) / period + 1e-3) + 1)
+
+            window = self.pupil_window.window()
+            if not self.update_face(frame, video_time) or window is None:
+                continue
+
+            scores = np.asarray(self.predict(self.face[np.newaxis], window[np.newaxis]))[0]
+            prediction = Prediction(
+                video_time,
+                self.classes[int(np.argmax(scores))],
+                scores,
+                self.pupil_window.time,
+                time.perf_counter() - read_time,
+            )
+            predictions.append(prediction)
+            if on_prediction:
+                on_prediction(prediction)
+
+        return predictions
+
+
+def latency_summary(predictions: List[Prediction]) -> Dict[str, float]:
+    """Get the median, 95th percentile and maximum latency of the predictions, in ms."""
+    if not predictions:
+        return {}
+
+    latencies = np.array([prediction.latency for prediction in predictions]) * 1000
+    return {
+        "median": float(np.median(latencies)),
+        "p95": float(np.percentile(latencies, 95)),
+        "max": float(latencies.max()),
+    }
+
+
+def load_predictor(
+    classes: List[str],
+    image_shape: Tuple[int, int, int] = (224, 224, 3),
+    window_size: int = 100,
+    export_dir: Optional[Path] = None,
+) -> Callable[[np.ndarray, np.ndarray], np.ndarray]:
+    """
+    Get a function running the fusion model on a batch of (images, pupil windows),
+    from the SavedModel exported by fusion.py if one is given, and from the checkpoints otherwise.
+    """
+    if export_dir:
+        # The loaded model is kept referenced, since its function does not hold its variables
+        loaded = tf.saved_model.load(str(export_dir))
+        predict = lambda images, windows: loaded.serve([tf.cast(images, tf.float32), windows]).numpy()
+    else:
+        # Calling the model directly avoids the setup of predict for every single sample
+        model = load_fusion_model(classes, image_shape, window_size)
+        predict = lambda images, windows: model((images, windows), training=False).numpy()
+
+    # Run the model once, so the first frame does not wait for the graph to be built
+    predict(np.zeros((1, *image_shape), dtype=np.uint8), np.zeros((1, window_size), dtype=np.float32))
+    return predict
+
+
+def log_prediction(prediction: Prediction):
+    logging.info(
+        "%.2f s: %s (pupil at %.2f s), latency %.1f ms",
+        prediction.time,
+        prediction.label,
+        prediction.pupil_time,
+        prediction.latency * 1000,
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    window_size = 100
+    image_shape = (224, 224, 3)
+
+    # The classes of the face model, in the order image_dataset_from_directory numbers them
+    multiclass = len(sys.argv) > 3 and sys.argv[3].lower() == "true"
+    classes = sorted(set((MULTICLASS_EMOTIONS if multiclass else BINARY_EMOTIONS).values()))
+    rate = float(sys.argv[4]) if len(sys.argv) > 4 else PREDICTION_RATE
+    export_dir = Path(sys.argv[5]) if len(sys.argv) > 5 else None
+
+    engine = StreamEngine(
+        load_predictor(classes, image_shape, window_size, export_dir), classes, window_size, image_shape[0:2], rate
+    )
+
+    # Read the pupil samples in the background while the video is processed
+    stop = threading.Event()
+    reader = threading.Thread(
+        target=feed_pupil_window, args=(pupil_samples(sys.argv[2], stop), engine.pupil_window), daemon=True
+    )
+    reader.start()
+
+    try:
+        predictions = engine.run(iter_video(sys.argv[1]), log_prediction)
+    finally:
+        stop.set()
+
+    logging.info("%d predictions, latency (ms): %s", len(predictions), latency_summary(predictions))
@@ -0,0 +1,177 @@
+import csv
+import numpy as np
+import os
+import pickle
+from PIL import Image
+import pytest
+from scipy.interpolate import CubicSpline
+import tensorflow as tf
+from tensorflow.data import Dataset
+
+from data_processing.dataset_index import write_dataset_index
+from data_processing.shards import ShardWriter
+
+import models.face as face
+import models.fusion as fusion
+from models.fusion import create_fusion_model, evaluate, get_data
+import models.pupil as pupil
+from models.pupil.train import PERIOD
+
+
+@pytest.mark.parametrize("use_index", [False, True])
+def test_get_data(use_index, tmp_path):
+    pkl_dir = tmp_path / "pupil"
+    face_dir = tmp_path / "test"
+    os.makedirs(pkl_dir)
+    os.makedirs(face_dir / "positive")
+
+    times = np.linspace(0, 20, 201)
+    spline = CubicSpline(times, 15 + np.sin(times))
+    with open(pkl_dir / "pupil_cs_joy.pkl", "wb") as f:
+        pickle.dump(spline, f)
+
+    # The first time is too early for a full window
+    end_times = [0.5, 1.0, 3.0]
+    with open(face_dir / "positive" / "times_cs_joy.csv", "w", newline="") as f:
+        writer = csv.DictWriter(f, ["times"])
+        writer.writeheader()
+        writer.writerows({"times": time} for time in end_times)
+    for i, time in enumerate(end_times):
+        # With an index, the images do not need to follow the naming convention
+        name = f"frame_{i}.png" if use_index else f"cs_joy_{time}_c.png"
+        Image.fromarray(np.full((8, 8, 3), i, dtype=np.uint8)).save(face_dir / "positive" / name)
+
+    if use_index:
+        os.remove(face_dir / "positive" / "times_cs_joy.csv")
+        write_dataset_index(
+            tmp_path,
+            [
+                {
+                    "split": "test",
+                    "label": "positive",
+                    "inits": "cs",
+                    "emotion": "joy",
+                    "time": time,
+                    "path": f"test/positive/frame_{i}.png",
+                }
+                for i, time in enumerate(end_times)
+            ],
+        )
+
+    dataset, classes = get_data(pkl_dir, face_dir, (4, 4), window_size=100)
+    assert classes == ["positive"]
+
+    samples = 0
+    for image, dilations, label in dataset.unbatch():
+        assert image.shape == (4, 4, 3)
+        assert image.dtype == np.uint8
+        assert dilations.dtype == np.float32
+        # The image identifies the time the window ends at
+        end_time = end_times[int(image[0, 0, 0])]
+        expected = spline(end_time - PERIOD * np.arange(99, -1, -1))
+        assert np.allclose(dilations.numpy(), expected)
+        assert label == 0
+        samples += 1
+
+    assert samples == 2
+
+
+def test_get_data_sorted_classes(tmp_path, monkeypatch):
+    pkl_dir = tmp_path / "pupil"
+    face_dir = tmp_path / "test"
+    os.makedirs(pkl_dir)
+
+    times = np.linspace(0, 20, 201)
+    with open(pkl_dir / "pupil_cs_joy.pkl", "wb") as f:
+        pickle.dump(CubicSpline(times, 15 + np.sin(times)), f)
+
+    # Each image is filled with the index of its label in sorted order
+    for i, label in enumerate(["fun", "happy", "sad"]):
+        os.makedirs(face_dir / label)
+        with open(face_dir / label / "times_cs_joy.csv", "w", newline="") as f:
+            writer = csv.DictWriter(f, ["times"])
+            writer.writeheader()
+            writer.writerow({"times": 2.0})
+        Image.fromarray(np.full((8, 8, 3), i, dtype=np.uint8)).save(face_dir / label / "cs_joy_2.0_c.png")
+
+    # The filesystem lists the labels in any order
+    monkeypatch.setattr(fusion, "list_labels", lambda split_dir: ["happy", "sad", "fun"])
+
+    dataset, classes = get_data(pkl_dir, face_dir, (4, 4), window_size=100)
+
+    # The labels are numbered like the outputs of the face model
+    assert classes == ["fun", "happy", "sad"]
+    samples = 0
+    for image, _, label in dataset.unbatch():
+        assert label == int(image[0, 0, 0])
+        samples += 1
+    assert samples == 3
+
+
+def test_get_data_sharded(tmp_path):
+    face_dir = tmp_path / "test"
+    writer = ShardWriter(face_dir, (8, 8))
+    Image.fromarray(np.zeros((8, 8, 3), dtype=np.uint8)).save(tmp_path / "cs_joy_2.0_c.png")
+    writer.add(tmp_path / "cs_joy_2.0_c.png", "positive", "cs", "joy", 2.0)
+    writer.close()
+
+    # The shards have no image files for the fusion model to read
+    with pytest.raises(ValueError, match="shards"):
+        get_data(tmp_path / "pupil", face_dir, (4, 4))
+
+
+@pytest.mark.parametrize("classes", [["negative", "positive"], ["sad", "happy", "fun"]])
+def test_create_fusion_model(classes, tmp_path):
+    face_model = face.create_model(len(classes), (32, 32, 3))
+    pupil_model = pupil.create_model(2, (100, 1))
+    model = create_fusion_model(face_model, pupil_model, classes)
+
+    rng = np.random.default_rng(0)
+    # The images are streamed as uint8, and rescaled by the face model
+    images = rng.integers(0, 256, (5, 32, 32, 3), dtype=np.uint8)
+    windows = rng.uniform(0, 30, (5, 100)).astype(np.float32)
+    scores = model.predict_on_batch((images, windows))
+
+    # Each emotion gets the pupil probability of its binary emotion, with the emotions in sorted order
+    face_scores = face_model.predict_on_batch(images)
+    pupil_scores = pupil_model.predict_on_batch(windows[..., None])
+    columns = [0, 1] if len(classes) == 2 else [1, 1, 0]
+    assert scores.shape == (5, len(classes))
+    assert np.allclose(scores, face_scores + pupil_scores[:, columns], atol=1e-5)
+
+    # The exported model gives the same scores
+    model.export(tmp_path / "fusion")
+    exported = tf.saved_model.load(str(tmp_path / "fusion"))
+    assert np.allclose(exported.serve([images, windows]).numpy(), scores, atol=1e-5)
+
+
+class ConstantModel:
+    """Returns the same scores for every sample, and counts the batches it is run on."""
+
+    def __init__(self, scores):
+        self.scores = np.array(scores)
+        self.batches = 0
+
+    def predict_on_batch(self, inputs):
+        self.batches += 1
+        images, _ = inputs
+        return np.tile(self.scores, (len(images), 1))
+
+
+def test_evaluate():
+    num_samples = 10
+    dataset = Dataset.from_tensor_slices(
+        (
+            np.zeros((num_samples, 4, 4, 3), dtype=np.float32),
+            np.zeros((num_samples, 100), dtype=np.float32),
+            np.arange(num_samples, dtype=np.int32) % 2,
+        )
+    ).batch(4)
+    model = ConstantModel([0.7, 1.3])
+
+    labels, predictions = evaluate(model, dataset)
+
+    # The model is run once per batch, not once per sample
+    assert model.batches == 3
+    assert list(labels) == [0, 1] * 5
+    assert list(predictions) == [1] * num_samples
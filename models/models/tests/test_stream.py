@@ -0,0 +1,110 @@
+import cv2
+import numpy as np
+import pytest
+import threading
+
+from data_processing.utils import Point, Region
+
+from models.stream import (
+    iter_video,
+    latency_summary,
+    PupilWindow,
+    StreamEngine,
+    tail_pupil_csv,
+)
+
+
+@pytest.mark.parametrize(
+    "sample_times, expected",
+    [
+        # Samples on the grid are kept as they are
+        ([0.0, 0.01, 0.02, 0.03, 0.04], [11, 12, 13, 14]),
+        # Samples between grid points are interpolated onto the grid
+        ([0.0, 0.025, 0.045], [11, 12, 13, 14]),
+        # A gap is filled in, and only the last samples are kept
+        ([0.0, 0.1], [17, 18, 19, 20]),
+        # Samples out of order are dropped
+        ([0.0, 0.02, 0.01, 0.015, 0.04], [11, 12, 13, 14]),
+        # The window is only returned once it is full
+        ([0.0, 0.02], None),
+    ],
+)
+def test_pupil_window(sample_times, expected):
+    window = PupilWindow(4, 0.01)
+    for sample_time in sample_times:
+        # The diameter increases by 1 every 0.01 s
+        window.push(sample_time, 10 + 100 * sample_time)
+
+    if expected is None:
+        assert window.window() is None
+    else:
+        assert window.window().dtype == np.float32
+        assert np.allclose(window.window(), expected)
+        assert window.time == pytest.approx((expected[-1] - 10) / 100)
+
+
+def test_tail_pupil_csv(tmp_path):
+    data_file = tmp_path / "data.csv"
+    with open(data_file, "w") as f:
+        f.write("times,diameters\n1000,3.5\n1010,3.")
+
+    stop = threading.Event()
+    samples = tail_pupil_csv(data_file, stop)
+    assert next(samples) == (1.0, 3.5)
+
+    # The row being written is read once it is complete
+    with open(data_file, "a") as f:
+        f.write("6\n")
+    assert next(samples) == (1.01, 3.6)
+
+    stop.set()
+    assert list(samples) == []
+
+
+def write_video(video_path, num_frames, fps=30):
+    writer = cv2.VideoWriter(str(video_path), cv2.VideoWriter_fourcc(*"MJPG"), fps, (64, 48))
+    for i in range(num_frames):
+        writer.write(np.full((48, 64, 3), i, dtype=np.uint8))
+    writer.release()
+
+
+def test_iter_video(tmp_path):
+    write_video(tmp_path / "video.avi", 30)
+
+    frames = list(iter_video(str(tmp_path / "video.avi"), realtime=False))
+    assert len(frames) == 30
+    assert np.allclose([video_time for video_time, _, _ in frames], np.arange(30) / 30, atol=1e-3)
+    assert frames[0][2].shape == (48, 64, 3)
+
+
+def test_stream_engine():
+    classes = ["negative", "positive"]
+    batch_shapes = []
+
+    def predict(images, windows):
+        batch_shapes.append((images.shape, images.dtype, windows.shape))
+        return np.array([[0.2, 0.8]])
+
+    engine = StreamEngine(
+        predict, classes, window_size=10, image_shape=(8, 8), rate=5, region=Region(Point(0, 0), Point(32, 32))
+    )
+    frames = [(i / 30, 0.0, np.zeros((48, 64, 3), dtype=np.uint8)) for i in range(60)]
+
+    # No prediction is made until the pupil window is full
+    assert engine.run(iter(frames[:15])) == []
+    for i in range(10):
+        engine.pupil_window.push(i * 0.01, 3.0)
+
+    emitted = []
+    predictions = engine.run(iter(frames), emitted.append)
+
+    # One prediction is made every 1 / rate seconds of video
+    assert [prediction.time for prediction in predictions] == pytest.approx([0, 0.2, 0.4, 0.6, 0.8, 1.0, 1.2, 1.4, 1.6, 1.8])
+    assert emitted == predictions
+    assert batch_shapes[0] == ((1, 8, 8, 3), np.uint8, (1, 10))
+    assert all(prediction.label == "positive" for prediction in predictions)
+    assert all(prediction.latency > 0 for prediction in predictions)
+    assert predictions[0].pupil_time == pytest.approx(0.09)
+
+    summary = latency_summary(predictions)
+    assert summary["median"] <= summary["p95"] <= summary["max"]